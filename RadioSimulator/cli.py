@@ -0,0 +1,123 @@
+"""
+Command line entry point for headless simulations. Doesn't use GUI libraries, so it can be run on machines
+without display, e.g.:
+
+    python cli.py scena.json coverage --resolution 2 --order 2 --out coverage.npy
+    python cli.py scena.json route --start 0 --end 1 --steps 500 --unit dbm --out route.csv
+    python cli.py scena.json servers --resolution 2 --unit dbm --out servers.npz
+    python cli.py scena.json paths --resolution 0.5 --out paths_dir
+    python cli.py scena.json convert --out scena.rscene
+"""
+import argparse
+import sys
+import numpy as np
+
+import simulation
+from coverage import grid_points
+from path_export import export_paths
+from scene import load_scene_file, convert_scene_file
+from diffraction import DIFFRACTION_METHODS
+from globals import MULTI_RAY_STEP, COVERAGE_RESOLUTION, COVERAGE_ORDER, NOISE_POWER, DIFFRACTION_METHOD
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    # options common for all modes, accepted after mode name as in examples above
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--transmitter", type=int, default=0, help="index of transmitter in scene file")
+    common.add_argument("--unit", choices=("lin", "db", "dbm"), default="lin", help="unit of power in results")
+    common.add_argument("--out", required=True, help="output file, .npy for binary array, anything else for csv")
+
+    parser = argparse.ArgumentParser(description="Headless radio propagation simulator")
+    parser.add_argument("scene", help="scene file in json or binary (.rscene) format")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    coverage = modes.add_parser("coverage", parents=[common], help="power on grid covering whole scene")
+    coverage.add_argument("--resolution", type=float, default=COVERAGE_RESOLUTION)
+    coverage.add_argument("--order", type=int, default=COVERAGE_ORDER, help="max number of reflections")
+    coverage.add_argument("--no-diffraction", action="store_true")
+    coverage.add_argument("--diffraction-method", choices=DIFFRACTION_METHODS, default=DIFFRACTION_METHOD,
+                          help="single strongest knife edge or multiple edges with Deygout/Epstein-Peterson method")
+
+    route = modes.add_parser("route", parents=[common],
+                             help="power along line between two receivers, order 0 gives LOS only")
+    route.add_argument("--start", type=int, default=0, help="index of first receiver")
+    route.add_argument("--end", type=int, default=1, help="index of second receiver")
+    route.add_argument("--steps", type=int, default=MULTI_RAY_STEP)
+    route.add_argument("--order", type=int, default=COVERAGE_ORDER, help="max number of reflections")
+    route.add_argument("--diffraction", action="store_true")
+
+    servers = modes.add_parser("servers", help="coverage of all transmitters with best server and SINR maps, "
+                                               "saved in .npz file as power, best_server and sinr arrays")
+    servers.add_argument("--unit", choices=("lin", "db", "dbm"), default="lin",
+                         help="unit of power, SINR is in [dB] for logarithmic units")
+    servers.add_argument("--out", required=True, help="output .npz file")
+    servers.add_argument("--resolution", type=float, default=COVERAGE_RESOLUTION)
+    servers.add_argument("--order", type=int, default=COVERAGE_ORDER, help="max number of reflections")
+    servers.add_argument("--no-diffraction", action="store_true")
+    servers.add_argument("--noise", type=float, default=NOISE_POWER, help="noise power in [W]")
+
+    paths = modes.add_parser("paths", help="export path lists (delay, gain, angles, walls) of receivers on grid "
+                                           "or of scene receivers to directory of memory-mappable columns")
+    paths.add_argument("--transmitter", type=int, default=0, help="index of transmitter in scene file")
+    paths.add_argument("--out", required=True, help="output directory")
+    paths.add_argument("--resolution", type=float, default=COVERAGE_RESOLUTION)
+    paths.add_argument("--receivers", action="store_true", help="export paths of scene receivers instead of grid")
+    paths.add_argument("--order", type=int, default=COVERAGE_ORDER, help="max number of reflections")
+    paths.add_argument("--no-diffraction", action="store_true")
+
+    convert = modes.add_parser("convert", help="convert scene between json and binary (.rscene) format")
+    convert.add_argument("--out", required=True, help="output scene file, .rscene for binary format")
+
+    return parser.parse_args(argv)
+
+
+def save_result(path: str, values: np.ndarray, header: str = ""):
+    if path.endswith(".npy"):
+        np.save(path, values)
+    else:
+        np.savetxt(path, values, delimiter=",", header=header)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.mode == "convert":
+        convert_scene_file(args.scene, args.out)
+        return 0
+
+    scene = load_scene_file(args.scene)
+    if args.mode == "servers":
+        result = simulation.multi_transmitter_map(scene, scene.transmitters, args.resolution, args.order,
+                                                  not args.no_diffraction, args.noise)
+        reference = np.array([t.power for t in scene.transmitters]).reshape(-1, 1, 1)
+        sinr_unit = "lin" if args.unit == "lin" else "db"
+        np.savez(args.out, power=simulation.convert_power(result.power, args.unit, reference),
+                 best_server=result.best_server, sinr=simulation.convert_power(result.sinr, sinr_unit))
+        return 0
+
+    transmitter = scene.transmitters[args.transmitter]
+
+    if args.mode == "coverage":
+        power = simulation.coverage_power(scene, transmitter, args.resolution, args.order, not args.no_diffraction,
+                                          args.diffraction_method)
+        save_result(args.out, simulation.convert_power(power, args.unit, transmitter.power))
+
+    elif args.mode == "paths":
+        if args.receivers:
+            points = np.array([receiver.point for receiver in scene.receivers], dtype=float).reshape(-1, 2)
+        else:
+            _, _, points = grid_points(args.resolution)
+        export_paths(transmitter, scene.walls, points, args.out, args.order, not args.no_diffraction)
+
+    elif args.mode == "route":
+        start = scene.receivers[args.start].point
+        end = scene.receivers[args.end].point
+        power, dist = simulation.route_power(scene, transmitter, start, end, args.steps, args.order,
+                                             args.diffraction)
+        power = simulation.convert_power(power, args.unit, transmitter.power)
+        save_result(args.out, np.stack((dist, power), axis=1), header=f"distance,power[{args.unit}]")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import math
+import numpy as np
+
+from props import Transmitter, Wall
+from ray import pack_walls, reflection_path_coefs
+from image_tree import ImageTree
+from diffraction import MultiEdgeDiffraction, knife_edge_loss, edge_geometry
+from spatial import WallGrid
+from geometrics import segments_blocked
+from globals import SCENE_SIZE, SCALE, COVERAGE_RESOLUTION, COVERAGE_ORDER, DIFFRACTION_METHOD
+
+
+def grid_points(resolution: float = COVERAGE_RESOLUTION,
+                size: tuple[float, float] = (SCENE_SIZE[0]*SCALE, SCENE_SIZE[1]*SCALE)) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function that returns points placed in centers of square cells covering the scene.
+
+    Args:
+        resolution: size of one cell
+        size: (width, height) of covered area
+
+    Returns:
+        x axis (nx,), y axis (ny,) and array of shape (ny*nx, 2) with all points in row-major order
+    """
+    xs = np.arange(resolution/2, size[0], resolution)
+    ys = np.arange(resolution/2, size[1], resolution)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    return xs, ys, np.stack((grid_x.ravel(), grid_y.ravel()), axis=1)
+
+
+def reflections_field(transmitter: Transmitter,
+                      walls: list[Wall],
+                      points: np.ndarray,
+                      order: int,
+                      segments: np.ndarray,
+                      tree: ImageTree | None = None) -> np.ndarray:
+    """
+    Sum of distance coefficients of all specular paths with 1 to order reflections. Reflection sequences are taken
+    from pruned image tree of transmitter, tree can be passed to reuse it between calls.
+    """
+    field = np.zeros(len(points), dtype=complex)
+    if tree is None:
+        tree = ImageTree(transmitter, walls, order)
+    for node in tree.nodes[1:]:
+        field += reflection_path_coefs(transmitter, [walls[i] for i in node.sequence], points, segments)
+    return field
+
+
+def diffraction_field(transmitter: Transmitter,
+                      points: np.ndarray,
+                      segments: np.ndarray) -> np.ndarray:
+    """
+    Distance coefficients of knife-edge diffraction. Candidate edges are wall endpoints visible from transmitter,
+    for every point the edge with the strongest diffracted field among edges visible from that point is chosen.
+    """
+    return diffraction_best(transmitter, points, segments)[0]
+
+
+def diffraction_best(transmitter: Transmitter,
+                     points: np.ndarray,
+                     segments: np.ndarray,
+                     edges: np.ndarray | None = None,
+                     visibility: np.ndarray | None = None,
+                     freq: float | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Same as diffraction_field, but also returns amplitude and coordinates of chosen edge of every point, which are
+    needed to update diffraction after scene edits (see incremental.IncrementalCoverage).
+
+    Args:
+        edges: candidate edges, by default calculated with visible_edges
+        visibility: (E, P) mask of points visible from edges (see edge_visibility), calculated when not given
+        freq: frequency in [Hz], by default frequency of transmitter
+
+    Returns:
+        field (P,), amplitude of chosen edge (P,) - 0 without edge, chosen edge (P, 2) - NaN without edge
+    """
+    field = np.zeros(len(points), dtype=complex)
+    best = np.zeros(len(points))
+    best_edge = np.full((len(points), 2), np.nan)
+    if not len(points) or not len(segments):
+        return field, best, best_edge
+
+    freq = transmitter.freq if freq is None else freq
+    if edges is None:
+        edges = visible_edges(transmitter, segments)
+    for i, edge in enumerate(edges):
+        visible = ~segments_blocked(edge, points, segments) if visibility is None else visibility[i]
+        if not visible.any():
+            continue
+        amplitude, dist = edge_amplitude(transmitter, edge, points[visible], freq)
+
+        stronger = amplitude > best[visible]
+        idx = np.flatnonzero(visible)[stronger]
+        best[idx] = amplitude[stronger]
+        best_edge[idx] = edge
+        field[idx] = amplitude[stronger] * np.exp(-2j*np.pi*freq*dist[stronger]/3e8)
+
+    return field, best, best_edge
+
+
+def edge_visibility(edges: np.ndarray,
+                    points: np.ndarray,
+                    segments: np.ndarray) -> np.ndarray:
+    """
+    Returns (E, P) mask of points visible from edges. It doesn't depend on frequency, so it can be reused by
+    diffraction_best for many frequencies.
+    """
+    visibility = np.array([~segments_blocked(edge, points, segments) for edge in edges], dtype=bool)
+    return visibility.reshape(len(edges), len(points))
+
+
+def visible_edges(transmitter: Transmitter,
+                  segments: np.ndarray) -> np.ndarray:
+    """
+    Returns array of shape (E, 2) with unique wall endpoints visible from transmitter - candidate diffraction edges.
+    """
+    edges = np.unique(segments.reshape(-1, 2), axis=0)
+    return edges[~segments_blocked(np.asarray(transmitter.point, dtype=float), edges, segments)]
+
+
+def edge_amplitude(transmitter: Transmitter,
+                   edge: np.ndarray,
+                   points: np.ndarray,
+                   freq: float | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Amplitude of field diffracted on edge at given points, visibility of edge is not checked.
+
+    Args:
+        freq: frequency in [Hz], by default frequency of transmitter
+
+    Returns:
+        amplitudes (P,) and total path lengths transmitter - edge - point (P,)
+    """
+    lam = transmitter.lam if freq is None else 3e8/freq
+    h, d1, d2 = edge_geometry(transmitter.point, edge, points)
+    v = h * np.sqrt(2/lam * (1/d1 + 1/d2))
+    return 10**(-knife_edge_loss(v)/20) / (d1 + d2), d1 + d2
+
+
+def coverage_field(transmitter: Transmitter,
+                   walls: list[Wall],
+                   points: np.ndarray,
+                   order: int = COVERAGE_ORDER,
+                   diffraction: bool = True,
+                   tree: ImageTree | None = None,
+                   diffraction_method: str = DIFFRACTION_METHOD,
+                   grid: WallGrid | None = None) -> np.ndarray:
+    """
+    Calculates complex distance coefficient at many points at once. Combines direct path, reflections up to given
+    order (image method) and diffraction for points without line-of-sight.
+
+    Args:
+        transmitter: source of radiation
+        walls: list of walls on scene
+        points: array of shape (P, 2) with points where field is calculated
+        order: max number of reflections
+        diffraction: if True, diffraction is added in NLOS points
+        tree: image tree of transmitter built for the same walls and order, created when not given
+        diffraction_method: "knife-edge" for the strongest single edge, "deygout" or "epstein-peterson" for
+            multiple edges (see diffraction.MultiEdgeDiffraction)
+        grid: optional spatial index of walls, used to find obstructing walls of multi-edge diffraction
+
+    Returns:
+        array of shape (P,) with complex distance coefficients
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    segments = pack_walls(walls)[:, 0:4]
+
+    field = reflection_path_coefs(transmitter, [], points, segments)
+    nlos = field == 0
+    if order > 0:
+        field += reflections_field(transmitter, walls, points, order, segments, tree)
+    if diffraction and diffraction_method == "knife-edge":
+        field[nlos] += diffraction_field(transmitter, points[nlos], segments)
+    elif diffraction:
+        field[nlos] += MultiEdgeDiffraction(transmitter, walls, diffraction_method, grid=grid).field(points[nlos])
+    return field
+
+
+def coverage_map(transmitter: Transmitter,
+                 walls: list[Wall],
+                 resolution: float = COVERAGE_RESOLUTION,
+                 order: int = COVERAGE_ORDER,
+                 diffraction: bool = True,
+                 diffraction_method: str = DIFFRACTION_METHOD,
+                 grid: WallGrid | None = None) -> np.ndarray:
+    """
+    Calculates received power on grid covering whole scene.
+
+    Args:
+        transmitter: source of radiation
+        walls: list of walls on scene
+        resolution: distance between grid points
+        order: max number of reflections
+        diffraction: if True, diffraction is added in NLOS points
+        diffraction_method: method of diffraction, see coverage_field
+        grid: optional spatial index of walls, see coverage_field
+
+    Returns:
+        array of shape (ny, nx) with power in [W], row i corresponds to y = (i + 0.5) * resolution
+    """
+    xs, ys, points = grid_points(resolution)
+    field = coverage_field(transmitter, walls, points, order, diffraction, None, diffraction_method, grid)
+    # Friis formula without distance, same as Ray.get_power_ref
+    power_ref = transmitter.power * (transmitter.lam / (4 * math.pi)) ** 2
+    return (power_ref * np.abs(field)**2).reshape(len(ys), len(xs))
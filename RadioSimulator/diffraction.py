@@ -0,0 +1,473 @@
+import math
+import numpy as np
+
+from props import Transmitter, Wall
+from ray import pack_walls
+from spatial import EndpointIndex, WallGrid
+from visibility import VisibilityGraph
+from geometrics import segments_blocked, segments_crossings, segment_crossings, point_line_distance
+from globals import DIFFRACTION_MAX_EDGES
+
+DIFFRACTION_METHODS = ("knife-edge", "deygout", "epstein-peterson")
+# key of transmitter in memoized sections, other points of sections are endpoint indices
+TRANSMITTER_KEY = -1
+
+
+class MultiEdgeDiffraction:
+    """
+    Diffraction over several obstructing walls between transmitter and receiver points. Every wall crossing path
+    acts as knife edge placed in its endpoint closer to the path, which the field has to go around. Combined loss
+    is calculated with Deygout method (the main edge splits path into two sections that are solved recursively) or
+    Epstein-Peterson method (losses of consecutive edges, each one calculated between its neighbours). Both methods
+    use at most max_edges edges - Deygout splits edges left after main edge between both sections, part unused by
+    first section goes to second one.
+
+    Sections that end at receiver are solved for all points at once - their walls are found with one
+    segments_crossings pass and points are grouped by their edges, so losses of last section are calculated as
+    arrays. Results of sections between edges depend only on their edges and number of edges they can use, they
+    are memoized and shared by all points, their walls are found with spatial query (WallGrid when given).
+
+    Args:
+        transmitter: source of radiation
+        walls: WallStore or list of walls
+        method: "deygout" or "epstein-peterson"
+        max_edges: max number of edges used on one path
+        grid: optional spatial index of walls
+        index: endpoint index of walls, created when not given
+    """
+    def __init__(self,
+                 transmitter: Transmitter,
+                 walls: list[Wall],
+                 method: str = "deygout",
+                 max_edges: int = DIFFRACTION_MAX_EDGES,
+                 grid: WallGrid | None = None,
+                 index: EndpointIndex | None = None):
+        if method not in ("deygout", "epstein-peterson"):
+            raise ValueError(f"Unknown multi-edge diffraction method: {method}")
+        self.transmitter = transmitter
+        self.walls = walls
+        self.method = method
+        self.max_edges = max_edges
+        self.grid = grid
+        self.index = EndpointIndex(walls) if index is None else index
+        self.segments = pack_walls(walls)[:, 0:4]
+        # grid returns walls, their indices are looked up here
+        self.wall_indices = {id(wall): i for i, wall in enumerate(walls)} if grid is not None else None
+        self.memo: dict[tuple, tuple] = dict()
+        self.hits = 0
+
+    def field(self, points: np.ndarray) -> np.ndarray:
+        """
+        Complex distance coefficients of diffracted field at points (P,). Points without obstructing walls
+        get direct path.
+        """
+        loss, length = self.losses(points)
+        field = np.zeros(len(loss), dtype=complex)
+        found = length > 0
+        field[found] = 10**(-loss[found]/20) / length[found] \
+            * np.exp(-2j*np.pi*self.transmitter.freq*length[found]/3e8)
+        return field
+
+    def losses(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns combined diffraction losses in [dB] (P,) and lengths of paths going around edges (P,).
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.method == "deygout":
+            return self.deygout_points(np.full(len(points), TRANSMITTER_KEY), points,
+                                       np.full(len(points), self.max_edges))[0:2]
+        return self.epstein_peterson_points(points)
+
+    def loss(self, point: tuple[float, float]) -> tuple[float, float]:
+        """
+        Same as losses, for single point.
+        """
+        loss, length = self.losses(point)
+        return float(loss[0]), float(length[0])
+
+    def key_points(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Returns points (N, 2) of section keys - endpoint indices or TRANSMITTER_KEY.
+        """
+        keys = np.asarray(keys, dtype=int)
+        points = self.index.points[np.maximum(keys, 0)] if len(self.index) else np.zeros((len(keys), 2))
+        points[keys == TRANSMITTER_KEY] = self.transmitter.point
+        return points
+
+    def obstacles(self,
+                  start: tuple[float, float],
+                  end: tuple[float, float]) -> list[int]:
+        """
+        Returns endpoint indices of edges obstructing segment, ordered from start. Walls ending at start or end
+        (edges the path already goes around) don't obstruct it.
+        """
+        if self.grid is not None:
+            candidates = np.array([self.wall_indices[id(wall)] for wall in self.grid.walls_on_segment(start, end)],
+                                  dtype=int)
+        else:
+            candidates = np.arange(len(self.segments))
+        crossing, _ = segment_crossings(start, end, self.segments[candidates])
+        edges = list()
+        for wall_idx in candidates[crossing]:
+            ends = self.index.wall_endpoints[wall_idx]
+            distances = [point_line_distance(self.index.points[e], (*start, *end)) for e in ends]
+            edge = int(ends[int(np.argmin(distances))])
+            if edge not in edges:
+                edges.append(edge)
+        return edges
+
+    def point_obstacles(self,
+                        starts: np.ndarray,
+                        points: np.ndarray) -> np.ndarray:
+        """
+        Vectorized obstacles of segments from starts (P, 2) or (2,) to points (P, 2), found with one
+        segments_crossings pass.
+
+        Returns:
+            (P, K) array of endpoint indices ordered from start, rows are padded with -1
+        """
+        starts = np.broadcast_to(np.asarray(starts, dtype=float), points.shape)
+        rows, walls, _ = segments_crossings(starts, points, self.segments)
+        ends = self.index.wall_endpoints[walls]
+        direct = points[rows] - starts[rows]
+        relative = self.index.points[ends] - starts[rows, None]
+        # endpoint closer to path, distances are compared without common division by length of path
+        distances = np.abs(direct[:, None, 0]*relative[:, :, 1] - direct[:, None, 1]*relative[:, :, 0])
+        edges = ends[np.arange(len(ends)), np.argmin(distances, axis=1)]
+        # corner of several crossing walls is one edge, first occurrence is kept
+        _, first = np.unique(rows * len(self.index) + edges, return_index=True)
+        first = np.sort(first)
+        rows, edges = rows[first], edges[first]
+
+        counts = np.bincount(rows, minlength=len(points))
+        obstacles = np.full((len(points), counts.max(initial=0)), -1)
+        obstacles[rows, np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]] = edges
+        return obstacles
+
+    def edge_loss(self,
+                  start: tuple[float, float],
+                  edge: int,
+                  end: tuple[float, float]) -> float:
+        """
+        Knife-edge loss in [dB] of edge between start and end.
+        """
+        point = tuple(self.index.points[edge])
+        d1 = math.dist(start, point)
+        d2 = math.dist(point, end)
+        h = point_line_distance(point, (*start, *end))
+        v = h * math.sqrt(2/self.transmitter.lam * (1/d1 + 1/d2))
+        return float(knife_edge_attenuation(v)) if v > -0.78 else 0.0  # scalar form of knife_edge_loss
+
+    def edge_losses(self,
+                    starts: np.ndarray,
+                    edges: np.ndarray,
+                    points: np.ndarray) -> np.ndarray:
+        """
+        Vectorized edge_loss for starts (P, 2) or (2,), (P, K) edges padded with -1 (see point_obstacles) and
+        points (P, 2). Returns (P, K) losses in [dB], -inf for padding.
+        """
+        h, d1, d2 = edge_geometry(np.reshape(starts, (-1, 1, 2)), self.index.points[edges], points[:, None])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            losses = knife_edge_loss(h * np.sqrt(2/self.transmitter.lam * (1/d1 + 1/d2)))
+        return np.where(edges >= 0, losses, -np.inf)
+
+    def deygout(self,
+                start: tuple[float, float],
+                start_key: int,
+                end: tuple[float, float],
+                end_key: int,
+                max_edges: int) -> tuple[float, float, int]:
+        """
+        Loss, length and number of used edges of memoized section between start and end edge.
+        """
+        key = (start_key, end_key, max_edges)
+        if key in self.memo:
+            self.hits += 1
+            return self.memo[key]
+
+        edges = self.obstacles(start, end) if max_edges > 0 else []
+        if not edges:
+            result = 0.0, math.dist(start, end), 0
+        else:
+            losses = [self.edge_loss(start, edge, end) for edge in edges]
+            main = edges[int(np.argmax(losses))]
+            point = tuple(self.index.points[main])
+            loss1, length1, used1 = self.deygout(start, start_key, point, main, max_edges // 2)
+            loss2, length2, used2 = self.deygout(point, main, end, end_key, max_edges - 1 - used1)
+            result = max(losses) + loss1 + loss2, length1 + length2, 1 + used1 + used2
+
+        self.memo[key] = result
+        return result
+
+    def deygout_points(self,
+                       start_keys: np.ndarray,
+                       points: np.ndarray,
+                       max_edges: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Same as deygout, for sections from start keys (P,) to points (P, 2) with max_edges (P,) edges each. Main
+        edges of all points are found at once, sections before them are memoized and sections after them are
+        solved for all points again, so there is one segments_crossings pass per level of recursion.
+        """
+        starts = self.key_points(start_keys)
+        loss = np.zeros(len(points))
+        length = np.sqrt(((points - starts)**2).sum(axis=1))
+        used = np.zeros(len(points), dtype=int)
+        active = np.flatnonzero(max_edges > 0)
+        obstacles = self.point_obstacles(starts[active], points[active])
+        if not obstacles.size:
+            return loss, length, used
+
+        losses = self.edge_losses(starts[active], obstacles, points[active])
+        column = np.argmax(losses, axis=1)
+        rows = np.arange(len(active))
+        main, main_loss = obstacles[rows, column], losses[rows, column]
+        blocked = main >= 0
+        active, main, main_loss = active[blocked], main[blocked], main_loss[blocked]
+
+        sections, inverse = np.unique(np.stack((start_keys[active], main, max_edges[active] // 2), axis=1), axis=0,
+                                      return_inverse=True)
+        first = np.array([self.deygout(tuple(start), key, tuple(self.index.points[edge]), edge, budget)
+                          for (key, edge, budget), start in zip(sections.tolist(), self.key_points(sections[:, 0]))],
+                         dtype=float).reshape(-1, 3)[inverse.ravel()]
+        used1 = first[:, 2].astype(int)
+        loss2, length2, used2 = self.deygout_points(main, points[active], max_edges[active] - 1 - used1)
+        loss[active] = main_loss + first[:, 0] + loss2
+        length[active] = first[:, 1] + length2
+        used[active] = 1 + used1 + used2
+        return loss, length, used
+
+    def epstein_peterson_points(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Epstein-Peterson losses and path lengths of points (P, 2). Losses of edges between two other edges are
+        memoized, losses of last edges are calculated for all points at once.
+        """
+        tx = self.transmitter.point
+        loss = np.zeros(len(points))
+        length = np.sqrt(((points - tx)**2).sum(axis=1))
+        if self.max_edges <= 0:
+            return loss, length
+        obstacles = self.point_obstacles(tx, points)
+        many = (obstacles >= 0).sum(axis=1) > self.max_edges
+        if many.any():
+            # strongest edges are kept in order along path
+            losses = self.edge_losses(tx, obstacles[many], points[many])
+            strongest = np.sort(np.argsort(losses, axis=1, kind="stable")[:, ::-1][:, :self.max_edges], axis=1)
+            obstacles[many, :self.max_edges] = np.take_along_axis(obstacles[many], strongest, axis=1)
+        obstacles = obstacles[:, :self.max_edges]
+        if not obstacles.size:
+            return loss, length
+
+        count = (obstacles >= 0).sum(axis=1)
+        found = np.flatnonzero(count > 0)
+        obstacles, count = obstacles[found], count[found]
+        sections, inverse = np.unique(obstacles, axis=0, return_inverse=True)
+        inner = np.array([self.inner_sections(edges[edges >= 0]) for edges in sections],
+                         dtype=float).reshape(-1, 2)[inverse.ravel()]
+        rows = np.arange(len(found))
+        last = obstacles[rows, count - 1]
+        before = self.key_points(np.where(count > 1, obstacles[rows, np.maximum(count - 2, 0)], TRANSMITTER_KEY))
+        loss[found] = inner[:, 0] + self.edge_losses(before, last[:, None], points[found])[:, 0]
+        length[found] = inner[:, 1] + np.sqrt(((points[found] - self.index.points[last])**2).sum(axis=1))
+        return loss, length
+
+    def inner_sections(self, edges: np.ndarray) -> tuple[float, float]:
+        """
+        Epstein-Peterson loss of all edges but the last one and length of path from transmitter to last edge.
+        Loss of every edge is memoized with its neighbours as key.
+        """
+        keys = [TRANSMITTER_KEY, *(int(edge) for edge in edges)]
+        section = [self.transmitter.point, *(tuple(self.index.points[edge]) for edge in edges)]
+        loss = 0.0
+        for i in range(1, len(section) - 1):
+            key = tuple(keys[i-1:i+2])
+            if key in self.memo:
+                self.hits += 1
+            else:
+                self.memo[key] = self.edge_loss(section[i-1], keys[i], section[i+1]), 0.0
+            loss += self.memo[key][0]
+        return loss, sum(math.dist(section[i], section[i+1]) for i in range(len(section) - 1))
+
+
+def knife_edge_attenuation(v: np.ndarray) -> np.ndarray:
+    """
+    Knife-edge diffraction attenuation (ITU-R P.526) for array of Fresnel-Kirchhoff parameters, same formula
+    as used by Ray.get_diffraction.
+
+    Returns:
+        attenuation in [dB]
+    """
+    return 6.9 + 20*np.log10(np.sqrt((v-0.1)**2 + 1) + v - 0.1)
+
+
+def knife_edge_loss(v: np.ndarray) -> np.ndarray:
+    """
+    Attenuation of single knife-edge diffraction (ITU-R P.526) for array of Fresnel-Kirchhoff parameters.
+
+    Returns:
+        attenuation in [dB], 0 for v <= -0.78
+    """
+    return np.where(v > -0.78, knife_edge_attenuation(v), 0)
+
+
+def edge_geometry(start: tuple[float, float] | np.ndarray,
+                  edge: np.ndarray,
+                  points: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Frequency independent geometry of knife-edge diffraction on edge between start (transmitter or previous edge)
+    and points, see coverage.edge_amplitude. Arguments are broadcast against each other, e.g. (2,) start and edge
+    with (P, 2) points or (P, 1, 2) starts, (P, K, 2) edges and (P, 1, 2) points.
+
+    Returns:
+        distances of edge from direct start - point lines, start - edge distances and edge - point distances
+    """
+    start = np.asarray(start, dtype=float)
+    edge = np.asarray(edge, dtype=float)
+    d1 = np.sqrt(((edge - start)**2).sum(axis=-1))
+    d2 = np.sqrt(((points - edge)**2).sum(axis=-1))
+    direct = points - start
+    h = np.abs(direct[..., 0]*(edge[..., 1] - start[..., 1]) - direct[..., 1]*(edge[..., 0] - start[..., 0])) \
+        / np.sqrt((direct**2).sum(axis=-1))
+    return h, d1, d2
+
+
+def knife_edge_sweep(transmitter: Transmitter,
+                     edges: np.ndarray,
+                     points: np.ndarray,
+                     segments: np.ndarray,
+                     visibility: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized version of Ray.get_diffraction for many endpoints and candidate edges at once. Points in
+    line-of-sight get direct path, for other points the edge giving the strongest diffracted field is chosen.
+
+    Args:
+        transmitter: source of radiation
+        edges: array of shape (E, 2) with candidate diffraction points
+        points: array of shape (P, 2) with endpoints
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of walls
+        visibility: (E, P) mask of edges that can be used for points, by default every edge can be used
+
+    Returns:
+        complex distance coefficients (P,), attenuations in [dB] (P,) - inf when no edge could be used, and
+        indices of chosen edges (P,) - -1 for LOS points and points without edge
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    edges = np.asarray(edges, dtype=float).reshape(-1, 2)
+    tx = np.asarray(transmitter.point, dtype=float)
+    coef = np.zeros(len(points), dtype=complex)
+    attenuation = np.full(len(points), np.inf)
+    chosen = np.full(len(points), -1)
+
+    los = ~segments_blocked(tx, points, segments)
+    dist = np.sqrt(((points[los] - tx)**2).sum(axis=1))
+    coef[los] = 1/dist * np.exp(2j*np.pi*transmitter.freq*dist/3e8)
+    attenuation[los] = 0
+
+    nlos = np.flatnonzero(~los)
+    if not len(nlos) or not len(edges):
+        return coef, attenuation, chosen
+    nlos_points = points[nlos]
+    # edges are ranked by field amplitude as in coverage.edge_amplitude, so the same edge is chosen
+    amplitude = np.full((len(edges), len(nlos)), np.nan)
+    edge_attenuation = np.empty((len(edges), len(nlos)))
+    length = np.empty((len(edges), len(nlos)))
+    for i, edge in enumerate(edges):
+        h, d1, d2 = edge_geometry(transmitter.point, edge, nlos_points)
+        if d1 == 0:
+            continue  # edge in transmitter can't be used
+        with np.errstate(divide="ignore", invalid="ignore"):
+            v = h * np.sqrt(2/transmitter.lam * (1/d1 + 1/d2))
+            edge_attenuation[i] = knife_edge_attenuation(v)
+            amplitude[i] = 10**(-edge_attenuation[i]/20) / (d1 + d2)
+        length[i] = d1 + d2
+    usable = np.isfinite(amplitude)
+    if visibility is not None:
+        usable &= np.asarray(visibility, dtype=bool).reshape(len(edges), -1)[:, nlos]
+    amplitude = np.where(usable, amplitude, -np.inf)
+
+    best = np.argmax(amplitude, axis=0)
+    cols = np.arange(len(nlos))
+    found = usable[best, cols]
+    idx, best = nlos[found], best[found]
+    length = length[best, cols[found]]
+    attenuation[idx] = edge_attenuation[best, cols[found]]
+    coef[idx] = 1/length * np.exp(2j*np.pi*transmitter.freq*length/3e8)
+    chosen[idx] = best
+    return coef, attenuation, chosen
+
+
+def candidate_edges(transmitter: Transmitter,
+                    walls: list[Wall],
+                    points: np.ndarray,
+                    index: EndpointIndex | None = None,
+                    visibility: VisibilityGraph | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Wall endpoints that can diffract field of transmitter to points - endpoints visible from transmitter,
+    together with their visibility from points.
+
+    Args:
+        index: endpoint index of walls, created when not given
+        visibility: optional visibility graph of walls, endpoints visible from transmitter are then found with one
+            angular sweep instead of testing every endpoint against all walls
+
+    Returns:
+        edges (E, 2) and (E, P) mask of points visible from edges
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    segments = pack_walls(walls)[:, 0:4]
+    if visibility is not None:
+        edges = visibility.visible_endpoints(transmitter.point)
+    else:
+        if index is None:
+            index = EndpointIndex(walls)
+        edges = index.points[~segments_blocked(np.asarray(transmitter.point, dtype=float), index.points, segments)]
+    visibility = np.array([~segments_blocked(edge, points, segments) for edge in edges],
+                          dtype=bool).reshape(len(edges), len(points))
+    return edges, visibility
+
+
+def diffraction_sweep(transmitter: Transmitter,
+                      walls: list[Wall],
+                      points: np.ndarray,
+                      diff_point: tuple[float, float] | None = None,
+                      index: EndpointIndex | None = None,
+                      visibility: VisibilityGraph | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Diffraction at many points at once. With diff_point given it gives the same results as calling
+    Ray.get_diffraction for every point, otherwise dominant edge is chosen for every point automatically
+    among wall endpoints visible from both transmitter and point.
+
+    Args:
+        diff_point: diffraction point, None for automatic selection
+        index: endpoint index of walls, created when needed and not given
+        visibility: optional visibility graph of walls, see candidate_edges
+
+    Returns:
+        complex distance coefficients (P,), attenuations in [dB] (P,) and diffraction points (P, 2) - NaN for
+        LOS points and points without edge
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    segments = pack_walls(walls)[:, 0:4]
+    if diff_point is None:
+        edges, edge_visibility = candidate_edges(transmitter, walls, points, index, visibility)
+    else:
+        edges, edge_visibility = np.asarray(diff_point, dtype=float).reshape(1, 2), None
+    coef, attenuation, chosen = knife_edge_sweep(transmitter, edges, points, segments, edge_visibility)
+    chosen_points = np.full((len(points), 2), np.nan)
+    chosen_points[chosen >= 0] = edges[chosen[chosen >= 0]]
+    return coef, attenuation, chosen_points
+
+
+def diffraction_values(coef: np.ndarray,
+                       attenuation: np.ndarray,
+                       mode: bool = False) -> np.ndarray:
+    """
+    Converts results of diffraction_sweep to diffraction power values - distance coefficients or attenuations.
+
+    Args:
+        mode: if True attenuation in [dB] is returned, else distance coefficients in linear form
+    """
+    if mode:
+        return attenuation
+    with np.errstate(over="ignore"):
+        return coef * 10**(-attenuation/10)
+
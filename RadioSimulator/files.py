@@ -1,54 +1,16 @@
-import json
 import PySimpleGUI as sg
 import globals as gb
-from props import Material, Wall, Transmitter, Receiver
+from scene import Scene, load_scene_file, save_scene_file
+from visibility import VisibilityGraph
 
 
 def save_scene():
     """
     Function that stores parameters of scene from globals.py in json file. File location is chosen by popup.
     """
-    walls_list = list()
-    materials_list = list()
-    transmitters_list = list()
-    receivers_list = list()
-    for wall in gb.walls:
-        wall_dict = {
-            "points": wall.points,
-            "width": wall.width,
-            "material": wall.material.name
-        }
-        if wall.material not in materials_list:
-            materials_list.append(wall.material)
-
-        walls_list.append(wall_dict)
-
-    for transmitter in gb.transmitters:
-        transmitter_dict = {
-            "point": transmitter.point,
-            "power": transmitter.power,
-            "freq": transmitter.freq
-        }
-        transmitters_list.append(transmitter_dict)
-
-    for receiver in gb.receivers:
-        receiver_dict = {
-            "point": receiver.point,
-        }
-        receivers_list.append(receiver_dict)
-
-    combined_list = {
-        "Scale": gb.SCALE,
-        "Materials": materials_list,
-        "Walls": walls_list,
-        "Transmitters": transmitters_list,
-        "Receivers": receivers_list
-    }
-
     path = sg.popup_get_file("Choose file:", save_as=True, default_extension=".json")
     if path:
-        with open(path, "w") as file:
-            file.write(json.dumps(combined_list, indent=2))
+        save_scene_file(Scene(gb.walls, gb.transmitters, gb.receivers, scale=gb.SCALE), path)
 
 
 def load_scene():
@@ -60,39 +22,20 @@ def load_scene():
     if not path:
         return
 
-    with open(path) as file:
-        file_content = json.load(file)
-        # read scene SCALE
-        new_scale = int(file_content["Scale"])
-        sf = gb.SCALE/new_scale  # scaling factor for conversion from file scale to scene scale
-
-        # read materials
-        materials = tuple(Material(*m) for m in file_content["Materials"])
-
-        # read walls
-        walls = list()
-        for wall in file_content['Walls']:
-            point1 = (wall["points"][0]*sf, wall["points"][1]*sf)
-            point2 = (wall["points"][2]*sf, wall["points"][3]*sf)
-            line_id = gb.graph.draw_line(point1, point2, width=gb.WALL_WIDTH, color=gb.WALL_COLOR)
-            material = [m for m in materials if m.name == wall["material"]][0]
-            walls.append(Wall(point1, point2, line_id, material, wall["width"]))
+    scene = load_scene_file(path, gb.SCALE)
+    for wall in scene.walls:
+        wall.graph_id = gb.graph.draw_line(wall.points[0:2], wall.points[2:], width=gb.WALL_WIDTH, color=gb.WALL_COLOR)
 
-        transmitters = list()
-        for transmitter in file_content["Transmitters"]:
-            point = (transmitter["point"][0]*sf, transmitter["point"][1]*sf)
-            power = transmitter["power"]
-            freq = transmitter["freq"]
-            graph_id = gb.graph.draw_point(point, gb.TRANSMITTER_SIZE, color=gb.TRANSMITTER_COLOR)
-            transmitters.append(Transmitter(point, graph_id, power, freq))
+    for transmitter in scene.transmitters:
+        transmitter.graph_id = gb.graph.draw_point(transmitter.point, gb.TRANSMITTER_SIZE, color=gb.TRANSMITTER_COLOR)
 
-        receivers = list()
-        for receiver in file_content["Receivers"]:
-            point = (receiver["point"][0]*sf, receiver["point"][1]*sf)
-            graph_id = gb.graph.draw_point(point, gb.RECEIVER_SIZE, color=gb.RECEIVER_COLOR)
-            receivers.append(Receiver(point, graph_id))
+    for receiver in scene.receivers:
+        receiver.graph_id = gb.graph.draw_point(receiver.point, gb.RECEIVER_SIZE, color=gb.RECEIVER_COLOR)
 
-        # update globals
-        gb.walls = walls
-        gb.transmitters = transmitters
-        gb.receivers = receivers
+    # update globals
+    gb.walls = scene.walls
+    gb.wall_grid.rebuild(scene.walls)
+    gb.endpoint_index = None
+    gb.visibility = VisibilityGraph(scene.walls) if len(scene.walls) <= gb.VISIBILITY_MAX_WALLS else None
+    gb.transmitters = scene.transmitters
+    gb.receivers = scene.receivers
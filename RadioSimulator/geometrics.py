@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from globals import FLOAT_COMP, FLOAT_ZERO
+from globals import FLOAT_COMP, FLOAT_ZERO, KERNEL_CHUNK_SIZE
 
 
 def abc(x1: int,
@@ -258,3 +258,259 @@ def vec_vec_angle(vec1: tuple[float, float],
     else:
         angle_d = angle/math.pi * 180
         return angle_d
+
+
+def nearest_intersections(points: np.ndarray,
+                          vecs: np.ndarray,
+                          segments: np.ndarray,
+                          min_dist: float = FLOAT_COMP) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function that finds closest intersection of many rays with all given line segments in one vectorized call.
+
+    Args:
+        points: array of shape (M, 2) with starting points of rays
+        vecs: array of shape (M, 2) with directions of rays (must be normalized)
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of each segment
+        min_dist: intersections closer to starting point than this value are skipped (e.g. last reflection point)
+
+    Returns:
+        array of shape (M,) with index of closest segment (-1 when ray hits nothing) and array of shape (M, 2)
+        with coordinates of intersections (NaN when ray hits nothing)
+    """
+    if len(segments) == 0 or len(points) == 0:
+        return np.full(len(points), -1), np.full((len(points), 2), np.nan)
+
+    # solve point + t*vec = p1 + u*(p2 - p1) for t (distance along ray) and u (position on segment)
+    # rays are placed along first axis and segments along second one
+    ex = segments[:, 2] - segments[:, 0]
+    ey = segments[:, 3] - segments[:, 1]
+    wx = segments[:, 0] - points[:, 0:1]
+    wy = segments[:, 1] - points[:, 1:2]
+    vx = vecs[:, 0:1]
+    vy = vecs[:, 1:2]
+    denominator = vx*ey - vy*ex
+    parallel = np.abs(denominator) < FLOAT_ZERO
+    denominator = np.where(parallel, 1, denominator)
+    t = (wx*ey - wy*ex) / denominator
+    u = (wx*vy - wy*vx) / denominator
+
+    # same tolerance as in point_on_line, but expressed in distance along segment
+    length = np.sqrt(ex**2 + ey**2)
+    s = u * length
+    valid = ~parallel & (t > min_dist) & (s >= -FLOAT_COMP/2) & (s <= length + FLOAT_COMP/2)
+
+    t = np.where(valid, t, np.inf)
+    idx = np.argmin(t, axis=1)
+    t_min = t[np.arange(len(points)), idx]
+    hit = np.isfinite(t_min)
+    idx = np.where(hit, idx, -1)
+    hits = np.full((len(points), 2), np.nan)
+    hits[hit] = points[hit] + t_min[hit, None]*vecs[hit]
+    return idx, hits
+
+
+def nearest_intersection(point: tuple[float, float],
+                         vec: tuple[float, float],
+                         segments: np.ndarray,
+                         min_dist: float = FLOAT_COMP) -> tuple[int, tuple[float, float]] | tuple[None, None]:
+    """
+    Function that finds closest intersection of single ray with all given line segments.
+    It's wrapper for nearest_intersections.
+
+    Args:
+        point: (x, y) starting point of ray
+        vec: (dx, dy) direction of ray (must be normalized)
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of each segment
+        min_dist: intersections closer to starting point than this value are skipped (e.g. last reflection point)
+
+    Returns:
+        index of closest segment and (x, y) coordinates of intersection or (None, None) when ray hits nothing
+    """
+    idx, hits = nearest_intersections(np.array([point], dtype=float), np.array([vec], dtype=float),
+                                      segments, min_dist)
+    if idx[0] < 0:
+        return None, None
+    return int(idx[0]), (float(hits[0, 0]), float(hits[0, 1]))
+
+
+def segments_blocked(starts: np.ndarray,
+                     ends: np.ndarray,
+                     segments: np.ndarray) -> np.ndarray:
+    """
+    Function that checks which of given segments are crossed by any of walls. Crossings closer than FLOAT_COMP
+    to ends of checked segment are skipped, so segments starting or ending on wall (e.g. on reflection point)
+    are not blocked by that wall. Work is split into chunks of KERNEL_CHUNK_SIZE (segment, wall) pairs.
+
+    Args:
+        starts: array of shape (P, 2) or (2,) with start points of checked segments
+        ends: array of shape (P, 2) or (2,) with end points of checked segments
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of walls
+
+    Returns:
+        array of shape (P,), True where segment is blocked
+    """
+    starts, ends = np.broadcast_arrays(np.asarray(starts, dtype=float).reshape(-1, 2),
+                                       np.asarray(ends, dtype=float).reshape(-1, 2))
+    blocked = np.zeros(len(starts), dtype=bool)
+    for i, crossing, _ in crossing_chunks(starts, ends, segments):
+        blocked[i:i + len(crossing)] = crossing.any(axis=1)
+    return blocked
+
+
+def segments_crossings(starts: np.ndarray,
+                       ends: np.ndarray,
+                       segments: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized version of segment_crossings for many segments, with the same chunks as segments_blocked.
+
+    Args:
+        starts: array of shape (P, 2) or (2,) with start points of checked segments
+        ends: array of shape (P, 2) or (2,) with end points of checked segments
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of walls
+
+    Returns:
+        indices of checked segments, indices of crossing walls and distances of crossings from start, ordered by
+        checked segment and distance
+    """
+    starts, ends = np.broadcast_arrays(np.asarray(starts, dtype=float).reshape(-1, 2),
+                                       np.asarray(ends, dtype=float).reshape(-1, 2))
+    rows, walls, distances = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)]
+    for i, crossing, t in crossing_chunks(starts, ends, segments):
+        row, wall = np.nonzero(crossing)
+        rows.append(row + i)
+        walls.append(wall)
+        distances.append(t[row, wall])
+    rows, walls, distances = np.concatenate(rows), np.concatenate(walls), np.concatenate(distances)
+    order = np.lexsort((distances, rows))
+    return rows[order], walls[order], distances[order]
+
+
+def segment_crossings(start: tuple[float, float],
+                      end: tuple[float, float],
+                      segments: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function that finds walls crossing one segment, with the same margins as segments_blocked.
+
+    Args:
+        start: (x, y) start point of segment
+        end: (x, y) end point of segment
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of walls
+
+    Returns:
+        indices of crossing walls and distances of crossings from start, ordered by distance
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    d_len = math.sqrt(dx**2 + dy**2)
+    ex = segments[:, 2] - segments[:, 0]
+    ey = segments[:, 3] - segments[:, 1]
+    length = np.sqrt(ex**2 + ey**2)
+    wx = segments[:, 0] - start[0]
+    wy = segments[:, 1] - start[1]
+    denominator = dx*ey - dy*ex
+    parallel = np.abs(denominator) < FLOAT_ZERO
+    denominator = np.where(parallel, 1, denominator)
+    t = (wx*ey - wy*ex) / denominator * d_len
+    s = (wx*dy - wy*dx) / denominator * length
+    crossing = (~parallel & (t > FLOAT_COMP) & (t < d_len - FLOAT_COMP) &
+                (s >= -FLOAT_COMP/2) & (s <= length + FLOAT_COMP/2))
+    idx = np.flatnonzero(crossing)
+    order = np.argsort(t[idx], kind="stable")
+    return idx[order], t[idx][order]
+
+
+def segment_crosses_hulls(segment: tuple[float, float, float, float],
+                          hulls: np.ndarray,
+                          margin: float = FLOAT_COMP) -> np.ndarray:
+    """
+    Function that checks which convex hulls of point sets are crossed or touched by segment (separating axis test).
+    Result is conservative - segment closer than margin to hull is treated as crossing it.
+
+    Args:
+        segment: (x1, y1, x2, y2) coordinates of segment
+        hulls: array of shape (Q, M, 2), each hull is given by M points, order of points doesn't matter
+
+    Returns:
+        array of shape (Q,), True where segment crosses hull
+    """
+    hulls = np.asarray(hulls, dtype=float)
+    seg = np.array(segment, dtype=float).reshape(2, 2)
+    # candidate separating axes - normal of segment and normals of all pairs of hull points (hull edges among them)
+    i, j = np.triu_indices(hulls.shape[1], 1)
+    edges = hulls[:, j] - hulls[:, i]
+    axes = np.concatenate((np.broadcast_to(seg[1] - seg[0], (len(hulls), 1, 2)), edges), axis=1)
+    axes = np.stack((-axes[..., 1], axes[..., 0]), axis=-1)
+    norm = np.sqrt((axes**2).sum(axis=-1))
+    valid = norm > FLOAT_ZERO
+    axes = axes / np.where(valid, norm, 1)[..., None]
+
+    hull_proj = np.einsum("qad,qmd->qam", axes, hulls)
+    seg_proj = np.einsum("qad,md->qam", axes, seg)
+    gap = np.maximum(seg_proj.min(axis=2) - hull_proj.max(axis=2), hull_proj.min(axis=2) - seg_proj.max(axis=2))
+    return ~(valid & (gap > margin)).any(axis=1)
+
+
+def segment_separates(segment: tuple[float, float, float, float],
+                      near: np.ndarray,
+                      far: np.ndarray,
+                      margin: float = FLOAT_COMP) -> np.ndarray:
+    """
+    Function that checks which pairs of convex hulls are separated by segment - every segment from near hull to far
+    hull crosses it at least margin from its ends. It's enough to check segments between points of hulls, crossings
+    of all other segments lie between their crossings.
+
+    Args:
+        segment: (x1, y1, x2, y2) coordinates of segment
+        near: array of shape (Q, A, 2), each hull is given by A points
+        far: array of shape (Q, B, 2), each hull is given by B points
+
+    Returns:
+        array of shape (Q,), True where segment separates hulls
+    """
+    seg = np.array(segment, dtype=float).reshape(2, 2)
+    direction = seg[1] - seg[0]
+    length = np.sqrt((direction**2).sum())
+    if length < 2*margin:
+        return np.zeros(len(near), dtype=bool)
+    direction = direction / length
+    normal = np.array((-direction[1], direction[0]))
+    # signed distances from segment's line and positions along it
+    h_near, h_far = (near - seg[0]) @ normal, (far - seg[0]) @ normal
+    s_near, s_far = (near - seg[0]) @ direction, (far - seg[0]) @ direction
+    opposite = ((h_near > margin).all(axis=1) & (h_far < -margin).all(axis=1)) | \
+               ((h_near < -margin).all(axis=1) & (h_far > margin).all(axis=1))
+    h_near, s_near, h_far, s_far = h_near[:, :, None], s_near[:, :, None], h_far[:, None], s_far[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = (h_near*s_far - h_far*s_near) / (h_near - h_far)
+    return opposite & ((crossing >= margin) & (crossing <= length - margin)).all(axis=(1, 2))
+
+
+def crossing_chunks(starts: np.ndarray,
+                    ends: np.ndarray,
+                    segments: np.ndarray):
+    """
+    Kernel of segments_blocked and segments_crossings. Yields (i, crossing, t) for chunks of checked segments
+    starting at index i, crossing is (C, N) mask of walls crossing them and t distances of crossings from start.
+    """
+    if len(segments) == 0:
+        return
+    ex = segments[:, 2] - segments[:, 0]
+    ey = segments[:, 3] - segments[:, 1]
+    length = np.sqrt(ex**2 + ey**2)
+    chunk = max(1, KERNEL_CHUNK_SIZE // len(segments))
+    for i in range(0, len(starts), chunk):
+        p = starts[i:i + chunk]
+        dx = ends[i:i + chunk, 0:1] - p[:, 0:1]
+        dy = ends[i:i + chunk, 1:2] - p[:, 1:2]
+        d_len = np.sqrt(dx**2 + dy**2)
+        # solve p + t*d = p1 + u*(p2 - p1), t and u are in [0, 1] range on both segments
+        wx = segments[:, 0] - p[:, 0:1]
+        wy = segments[:, 1] - p[:, 1:2]
+        denominator = dx*ey - dy*ex
+        parallel = np.abs(denominator) < FLOAT_ZERO
+        denominator = np.where(parallel, 1, denominator)
+        t = (wx*ey - wy*ex) / denominator * d_len
+        s = (wx*dy - wy*dx) / denominator * length
+        crossing = (~parallel & (t > FLOAT_COMP) & (t < d_len - FLOAT_COMP) &
+                    (s >= -FLOAT_COMP/2) & (s <= length + FLOAT_COMP/2))
+        yield i, crossing, t
@@ -12,7 +12,28 @@ FLOAT_COMP = 0.05  # threshold for float <--> float comparision
 FLOAT_ZERO = 1e-6  # threshold for float <--> zero comparision
 MULTI_RAY_STEP = 100  # number of steps for simulation
 DIFFRACTION_POINT_MARGIN = 10  # margin of error for selecting wall endpoint
+DIFFRACTION_METHOD = "knife-edge"  # diffraction of coverage maps: knife-edge, deygout or epstein-peterson
+DIFFRACTION_MAX_EDGES = 3  # max number of edges on path of multi-edge diffraction
 USE_TM = False  # If True program will calculate reflection coefficient fot TM wave, else for TE
+REFLECTION_TABLE_TOLERANCE = 1e-6  # max error of interpolated reflection coefficient
+REFLECTION_TABLE_MAX_SIZE = 2**16 + 1  # max number of points in reflection coefficient table
+FAN_CHUNK_SIZE = 512  # number of rays propagated together in batched (ray fan) mode
+TUBE_INITIAL_RAYS = 64  # number of ray tubes launched before adaptive splitting
+TUBE_RESOLUTION = 1  # max width of ray tube footprint in scene units
+TUBE_MAX_DEPTH = 16  # max number of splits of one ray tube
+COVERAGE_RESOLUTION = 1  # default distance between points of coverage map (in scene units)
+COVERAGE_ORDER = 2  # default max number of reflections used in coverage map
+COVERAGE_TILE_SIZE = 16  # side of coverage map tile in grid cells, tiles are recalculated after scene edits
+VISIBILITY_MAX_WALLS = 300  # max number of walls for which editor keeps visibility graph, its build gets slow above
+NOISE_POWER = 1e-13  # noise power at receiver in [W], used for SINR of multi-transmitter simulations
+IMAGE_CACHE_SIZE = 100000  # max number of cached transmitter image sequences
+KERNEL_CHUNK_SIZE = 2**20  # max number of (segment, wall) pairs tested at once by vectorized kernels
+PARALLEL_CHUNK_SIZE = 4096  # number of points in one task of multiprocess simulations
+JSON_CHUNK_SIZE = 2**16  # number of characters read at once by streaming scene loader
+RESULT_CACHE_SIZE = 64  # number of simulation results kept in memory
+RESULT_CACHE_DIR = None  # directory for simulation results cached on disk, None disables disk cache
+RESULT_CACHE_DISK_SIZE = 256 * 2**20  # max size of disk cache in bytes
+PATH_EXPORT_CHUNK_SIZE = 2**14  # number of receiver points traced and written at once by path export
 
 # props colors and sizes - do not remove scale multiplier
 WALL_COLOR = "#ffffff"
@@ -45,10 +66,14 @@ boundaries = [(0, 0, SCENE_SIZE[0]*SCALE, 0),
               (0, SCENE_SIZE[1]*SCALE, SCENE_SIZE[0]*SCALE, SCENE_SIZE[1]*SCALE)]
 
 # on scene objects
-walls = list()
+walls = list()  # replaced with props.WallStore in main.py
 transmitters = list()
 receivers = list()
 rays = list()
+wall_grid = None  # spatial.WallGrid over walls, created in main.py and kept in sync on every wall edit
+endpoint_index = None  # spatial.EndpointIndex of walls, dropped on wall edit and built again on first use
+visibility = None  # visibility.VisibilityGraph of walls, None when scene has more than VISIBILITY_MAX_WALLS walls
+result_cache = None  # result_cache.ResultCache for results of Calculate buttons, created in main.py
 
 
 # common mode variables
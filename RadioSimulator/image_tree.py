@@ -0,0 +1,361 @@
+from collections import namedtuple
+import numpy as np
+
+from props import Transmitter, Wall
+from ray import Ray, pack_walls
+from visibility import VisibilityGraph
+from geometrics import point_mirror_line, point_line_distance, segments_blocked
+from globals import FLOAT_ZERO, COVERAGE_ORDER
+
+ImageNode = namedtuple("ImageNode", ["sequence",  # tuple of indices of walls that path reflects of, in order
+                                     "image",  # (x, y) transmitter image after all reflections from sequence
+                                     "aperture",  # (x1, y1, x2, y2) part of last wall lit by parent's beam
+                                     "parent"  # index of parent node, -1 for root
+                                     ])
+
+
+class ImageTree:
+    """
+    Precomputed tree of transmitter images used for automatic image-method path search. Each node represents
+    sequence of reflections and holds transmitter image mirrored along all walls in sequence. Children are only
+    created for walls that can be reached by beam leaving node's aperture, so tree contains only sequences that
+    can form valid path, instead of all N^K combinations. With visibility graph, only walls visible from transmitter
+    and walls seen by node's last wall are tried as children.
+
+    Args:
+        transmitter: source of paths
+        walls: list of walls on which paths can be reflected
+        order: max number of reflections
+        visibility: optional visibility graph of the same walls, edit must be recorded before update_wall
+    """
+    def __init__(self,
+                 transmitter: Transmitter,
+                 walls: list[Wall],
+                 order: int = COVERAGE_ORDER,
+                 visibility: VisibilityGraph | None = None):
+        self.transmitter = transmitter
+        self.walls = walls
+        self.order = order
+        self.visibility = visibility
+        self.nodes: list[ImageNode] = list()
+        # candidate walls of children, by last wall of node's sequence (-1 for root), used with visibility graph
+        self.candidate_sets: dict[int, np.ndarray] = dict()
+        self.build()
+
+    def build(self):
+        """
+        Builds tree level by level. Root node represents direct path.
+        """
+        self.nodes = [ImageNode((), self.transmitter.point, None, -1)]
+        self.candidate_sets = dict()
+        level = [0]
+        for _ in range(self.order):
+            next_level = list()
+            for node_idx in level:
+                for child in self._children(node_idx):
+                    self.nodes.append(child)
+                    next_level.append(len(self.nodes) - 1)
+            level = next_level
+
+    def _children(self, node_idx: int) -> list[ImageNode]:
+        children = list()
+        for wall_idx in self._candidates(node_idx):
+            child = self._child(node_idx, int(wall_idx))
+            if child is not None:
+                children.append(child)
+        return children
+
+    def _candidates(self, node_idx: int) -> range | np.ndarray:
+        """
+        Returns indices of walls that can be reached by paths of node, all walls without visibility graph.
+        """
+        if self.visibility is None:
+            return range(len(self.walls))
+        return self._candidate_set(last_wall(self.nodes[node_idx]))
+
+    def _candidate_set(self, key: int) -> np.ndarray:
+        if key not in self.candidate_sets:
+            if key < 0:
+                self.candidate_sets[key] = self.visibility.visible_from(self.transmitter.point)[1]
+            else:
+                self.candidate_sets[key] = self.visibility.seen_walls(key)
+        return self.candidate_sets[key]
+
+    def _child(self, node_idx: int, wall_idx: int) -> ImageNode | None:
+        """
+        Creates child of node for reflection of given wall, None if wall can't be reached by node's beam.
+        """
+        node = self.nodes[node_idx]
+        wall = self.walls[wall_idx]
+        if node.sequence and wall_idx == node.sequence[-1]:
+            return None
+        # image on wall's line can't be reflected
+        if point_line_distance(node.image, wall.points) < FLOAT_ZERO:
+            return None
+        if node.aperture is None:
+            aperture = wall.points
+        else:
+            aperture = clip_segment(wall.points, beam_halfplanes(node.image, node.aperture))
+            if aperture is None:
+                return None
+        image = point_mirror_line(wall.points, node.image)
+        return ImageNode((*node.sequence, wall_idx), image, aperture, node_idx)
+
+    def update_wall(self,
+                    removed: int | None = None,
+                    added: int | None = None,
+                    shift: bool = False):
+        """
+        Updates tree after edit of one wall instead of building it again. Beam of node depends only on walls in its
+        sequence, so only nodes with edited wall are dropped and created again. With visibility graph, candidate
+        walls of nodes can change too - children of walls that stopped being candidates are dropped with their
+        subtrees and subtrees are created only for new candidates, see _update_candidates.
+
+        Args:
+            removed: index (before edit) of wall whose nodes are dropped - removed or changed wall
+            added: index (after edit) of wall whose nodes are created - added or changed wall
+            shift: True if removed wall was deleted from list, so indices of following walls decreased by one
+        """
+        if removed is not None:
+            def remap(idx: int) -> int:
+                return idx - 1 if shift and idx > removed else idx
+
+            self._prune(lambda node: removed in node.sequence, remap)
+            candidate_sets = dict()
+            for key, walls in self.candidate_sets.items():
+                if key != removed:
+                    walls = walls[walls != removed]
+                    candidate_sets[remap(key)] = walls - (walls > removed) if shift else walls
+            self.candidate_sets = candidate_sets
+
+        if self.visibility is not None:
+            self._update_candidates(added)
+        elif added is not None:
+            self._grow(lambda node: (added,))
+
+    def _prune(self, dropped, remap=None):
+        """
+        Removes nodes for which dropped(node) is True together with their descendants.
+
+        Args:
+            dropped: function of node
+            remap: optional function giving new index of wall from its old index
+        """
+        new_idx = dict()
+        nodes = list()
+        for idx, node in enumerate(self.nodes):
+            # parents are placed before children, so dropped parent is already known
+            if (node.parent >= 0 and node.parent not in new_idx) or dropped(node):
+                continue
+            new_idx[idx] = len(nodes)
+            sequence = node.sequence if remap is None else tuple(remap(i) for i in node.sequence)
+            nodes.append(ImageNode(sequence, node.image, node.aperture, new_idx.get(node.parent, -1)))
+        self.nodes = nodes
+
+    def _update_candidates(self, added: int | None):
+        """
+        Compares candidate walls of nodes with visibility graph after edit. Children of walls that are no longer
+        candidates are dropped, children of new candidates (and of added wall, whose nodes were dropped) are created
+        with their subtrees. Other children are kept, they depend only on geometry of unchanged walls.
+        """
+        old_sets = self.candidate_sets
+        self.candidate_sets = dict()
+        gained, lost = dict(), dict()
+        for key in {last_wall(node) for node in self.nodes if len(node.sequence) < self.order}:
+            new = self._candidate_set(key)
+            old = old_sets.get(key, np.zeros(0, dtype=int))
+            if added is not None:
+                old = old[old != added]
+            gained[key] = np.setdiff1d(new, old)
+            lost[key] = set(np.setdiff1d(old, new).tolist())
+
+        self._prune(lambda node: bool(node.sequence) and node.sequence[-1] in lost[last_wall(node, 2)])
+        self._grow(lambda node: gained[last_wall(node)])
+
+    def _grow(self, walls):
+        """
+        Creates children of current nodes for walls given by walls(node), then all their descendants.
+        """
+        level = list()
+        for node_idx in range(len(self.nodes)):
+            if len(self.nodes[node_idx].sequence) < self.order:
+                for wall_idx in walls(self.nodes[node_idx]):
+                    child = self._child(node_idx, int(wall_idx))
+                    if child is not None:
+                        self.nodes.append(child)
+                        level.append(len(self.nodes) - 1)
+        # all descendants of new nodes are new
+        while level:
+            next_level = list()
+            for node_idx in level:
+                if len(self.nodes[node_idx].sequence) < self.order:
+                    for child in self._children(node_idx):
+                        self.nodes.append(child)
+                        next_level.append(len(self.nodes) - 1)
+            level = next_level
+
+    def in_beam(self, node: ImageNode, point: tuple[float, float]) -> bool:
+        """
+        Checks if point can be reached by beam leaving node's aperture.
+        """
+        if node.aperture is None:
+            return True
+        return all(a*point[0] + b*point[1] + c >= -FLOAT_ZERO
+                   for a, b, c in beam_halfplanes(node.image, node.aperture))
+
+    def paths_to_point(self,
+                       endpoint: tuple[float, float],
+                       segments: np.ndarray | None = None) -> list[list[tuple[tuple[float, float], Wall | None]]]:
+        """
+        Finds all valid specular paths from transmitter to endpoint, including direct path.
+
+        Args:
+            endpoint: (x, y) destination point
+            segments: (N, 4) array of walls used for obstruction test, by default all walls of tree
+
+        Returns:
+            list of paths in reflections_list format - pairs of (point, Wall), last pair is (endpoint, None)
+        """
+        if segments is None:
+            segments = pack_walls(self.walls)[:, 0:4]
+
+        paths = list()
+        for node in self.nodes:
+            if not self.in_beam(node, endpoint):
+                continue
+            points = self._trace_back(node, endpoint)
+            if points is None:
+                continue
+            # check obstruction of all path segments at once
+            starts = np.array([self.transmitter.point, *points], dtype=float)
+            ends = np.array([*points, endpoint], dtype=float)
+            if segments_blocked(starts, ends, segments).any():
+                continue
+            path = [(point, self.walls[wall_idx]) for point, wall_idx in zip(points, node.sequence)]
+            path.append((endpoint, None))
+            paths.append(path)
+        return paths
+
+    def rays_to_point(self, endpoint: tuple[float, float]) -> list[Ray]:
+        """
+        Same as paths_to_point, but returns Ray objects ready for drawing and power calculations.
+        """
+        rays = list()
+        for path in self.paths_to_point(endpoint):
+            ray = Ray(self.transmitter, (1, 1), len(path) - 1)  # vec doesn't matter here
+            ray.reflections_list = path
+            ray.forced_reflection_walls = [wall for _, wall in path[:-1]]
+            rays.append(ray)
+        return rays
+
+    def _trace_back(self,
+                    node: ImageNode,
+                    endpoint: tuple[float, float]) -> list[tuple[float, float]] | None:
+        """
+        Calculates reflection points of node's sequence from endpoint back to transmitter.
+
+        Returns:
+            list of reflection points in order from transmitter or None if path is not valid
+        """
+        points = list()
+        current = endpoint
+        while node.parent >= 0:
+            x1, y1, x2, y2 = self.walls[node.sequence[-1]].points
+            dx, dy = current[0] - node.image[0], current[1] - node.image[1]
+            ex, ey = x2 - x1, y2 - y1
+            denominator = dx*ey - dy*ex
+            if abs(denominator) < FLOAT_ZERO:
+                return None
+            wx, wy = x1 - node.image[0], y1 - node.image[1]
+            t = (wx*ey - wy*ex) / denominator
+            u = (wx*dy - wy*dx) / denominator
+            # reflection point must be on wall and between image and current point
+            if not (0 < t < 1 and 0 <= u <= 1):
+                return None
+            current = (node.image[0] + t*dx, node.image[1] + t*dy)
+            points.append(current)
+            node = self.nodes[node.parent]
+        return points[::-1]
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def last_wall(node: ImageNode, position: int = 1) -> int:
+    """
+    Returns index of position-th wall from the end of node's sequence, -1 when sequence is shorter.
+    """
+    return node.sequence[-position] if len(node.sequence) >= position else -1
+
+
+def beam_halfplanes(apex: tuple[float, float],
+                    aperture: tuple[float, float, float, float]) -> list[tuple[float, float, float]]:
+    """
+    Returns half-planes that bound beam leaving aperture segment, as seen from apex (transmitter image).
+    Beam is the wedge from apex through aperture, on the opposite side of aperture than apex.
+
+    Args:
+        apex: (x, y) image point
+        aperture: (x1, y1, x2, y2) segment through which beam passes
+
+    Returns:
+        list of (a, b, c) coefficients, point (x, y) is inside of beam when a*x + b*y + c >= 0 for all of them
+    """
+    px, py = apex
+    ax, ay = aperture[0] - px, aperture[1] - py
+    bx, by = aperture[2] - px, aperture[3] - py
+    # orient wedge counterclockwise from a to b
+    if ax*by - ay*bx < 0:
+        ax, ay, bx, by = bx, by, ax, ay
+    halfplanes = [(-ay, ax, ay*px - ax*py),  # left of apex -> a
+                  (by, -bx, bx*py - by*px)]  # right of apex -> b
+
+    # beyond aperture line, apex side excluded
+    a, b, c = aperture[1] - aperture[3], aperture[2] - aperture[0], \
+        aperture[0]*aperture[3] - aperture[2]*aperture[1]
+    if a*px + b*py + c > 0:
+        a, b, c = -a, -b, -c
+    halfplanes.append((a, b, c))
+    return halfplanes
+
+
+def clip_segment(segment: tuple[float, float, float, float],
+                 halfplanes: list[tuple[float, float, float]]) -> tuple[float, float, float, float] | None:
+    """
+    Clips segment to convex region given by half-planes (Liang-Barsky).
+
+    Args:
+        segment: (x1, y1, x2, y2) segment to be clipped
+        halfplanes: list of (a, b, c), region is where a*x + b*y + c >= 0
+
+    Returns:
+        clipped segment or None if segment lies outside region
+    """
+    x1, y1, x2, y2 = segment
+    dx, dy = x2 - x1, y2 - y1
+    t_min, t_max = 0.0, 1.0
+    for a, b, c in halfplanes:
+        start = a*x1 + b*y1 + c
+        change = a*dx + b*dy
+        if abs(change) < FLOAT_ZERO:
+            if start < -FLOAT_ZERO:
+                return None
+            continue
+        t = -start / change
+        if change > 0:
+            t_min = max(t_min, t)
+        else:
+            t_max = min(t_max, t)
+        if t_max - t_min < FLOAT_ZERO:
+            return None
+    return x1 + t_min*dx, y1 + t_min*dy, x1 + t_max*dx, y1 + t_max*dy
+
+
+def find_paths(transmitter: Transmitter,
+               endpoint: tuple[float, float],
+               walls: list[Wall],
+               order: int = COVERAGE_ORDER) -> list[list[tuple[tuple[float, float], Wall | None]]]:
+    """
+    Wrapper that builds image tree and returns all valid paths from transmitter to endpoint.
+    """
+    return ImageTree(transmitter, walls, order).paths_to_point(endpoint)
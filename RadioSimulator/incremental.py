@@ -0,0 +1,360 @@
+import math
+import numpy as np
+
+from props import Transmitter, Wall, WallStore, Material
+from ray import pack_walls, reflection_path_coefs
+from image_tree import ImageTree, ImageNode, beam_halfplanes
+from visibility import VisibilityGraph
+from coverage import grid_points, reflections_field, diffraction_best, visible_edges, edge_amplitude
+from geometrics import segment_crosses_hulls, segment_separates, segments_blocked
+from globals import COVERAGE_RESOLUTION, COVERAGE_ORDER, COVERAGE_TILE_SIZE, FLOAT_COMP, FLOAT_ZERO
+
+
+class IncrementalCoverage:
+    """
+    Coverage map of one transmitter, which is updated after wall edits instead of being calculated again.
+    Walls have to be edited through methods of this class (move_wall, set_wall, add_wall, remove_wall), which
+    re-trace only paths that edit can change. Map is split into square tiles of tile_size cells and for every
+    image tree node (sequence of reflections) edit changes its paths only in:
+
+    - tiles lit by beam of node, if node reflects of edited wall (before or after edit),
+    - tiles for which old or new position of wall crosses corridor of node - convex hulls around path segments
+      (transmitter - first aperture, aperture - next aperture, last aperture - tile) narrowed to parts of
+      apertures used by paths to tile, so wall can block or unblock paths of node. Moved wall doesn't change
+      tiles whose paths are all blocked by both its old and new position.
+
+    Contribution of every such (node, tile) pair is subtracted before edit and added after it. Diffraction is
+    tracked per point - chosen edge and its amplitude are stored, so only points whose edge got blocked or removed,
+    or which can get stronger edge (new edge, unblocked edge) are recalculated. Image tree is updated with
+    ImageTree.update_wall, with visibility graph the tree is pruned by it and edits are recorded in the graph
+    too. Result is the same as coverage.coverage_field up to rounding. Edit that affects most of lit tiles (e.g. long
+    wall added across the scene) calculates reflections again instead, so it isn't much slower than full calculation.
+
+    Editor has no coverage map view, so this class is only used from scripts, walls edited in editor are not
+    tracked by it.
+
+    Args:
+        transmitter: source of radiation
+        walls: store with walls on scene, it's modified by edit methods
+        resolution: distance between grid points
+        order: max number of reflections
+        diffraction: if True, diffraction is added in NLOS points
+        tile_size: size of tile side in grid cells
+        visibility: optional visibility graph of walls, see ImageTree
+    """
+    def __init__(self,
+                 transmitter: Transmitter,
+                 walls: WallStore,
+                 resolution: float = COVERAGE_RESOLUTION,
+                 order: int = COVERAGE_ORDER,
+                 diffraction: bool = True,
+                 tile_size: int = COVERAGE_TILE_SIZE,
+                 visibility: VisibilityGraph | None = None):
+        self.transmitter = transmitter
+        self.walls = walls
+        self.order = order
+        self.diffraction = diffraction
+        self.visibility = visibility
+        self.xs, self.ys, self.points = grid_points(resolution)
+
+        # tiles as arrays of point indices, corners of bounding boxes of their points (T, 4, 2)
+        row, column = np.divmod(np.arange(len(self.points)), len(self.xs))
+        tile_ids = (row // tile_size) * math.ceil(len(self.xs) / tile_size) + column // tile_size
+        sorted_points = np.argsort(tile_ids, kind="stable")
+        self.tiles = np.split(sorted_points, np.flatnonzero(np.diff(tile_ids[sorted_points])) + 1)
+        boxes = np.array([(*self.points[t].min(axis=0) - FLOAT_COMP, *self.points[t].max(axis=0) + FLOAT_COMP)
+                          for t in self.tiles])
+        self.tile_corners = np.stack((boxes[:, [0, 1]], boxes[:, [2, 1]], boxes[:, [2, 3]], boxes[:, [0, 3]]), axis=1)
+
+        self.tree = ImageTree(transmitter, walls, order, visibility)
+        segments = pack_walls(walls)[:, 0:4]
+        self.los = reflection_path_coefs(transmitter, [], self.points, segments)
+        self.reflections = np.zeros(len(self.points), dtype=complex)
+        if order > 0:
+            self.reflections = reflections_field(transmitter, walls, self.points, order, segments, self.tree)
+        self.diffracted = np.zeros(len(self.points), dtype=complex)
+        self.best = np.zeros(len(self.points))
+        self.best_edge = np.full((len(self.points), 2), np.nan)
+        self.edges = np.zeros((0, 2))
+        self.update_diffraction(np.arange(len(self.points)), segments)
+
+        # statistics of last edit - number of re-traced (node, tile) pairs and of points with new diffraction
+        self.last_pairs = 0
+        self.last_points = 0
+
+    @property
+    def field(self) -> np.ndarray:
+        """
+        Complex distance coefficients in grid points, same as coverage.coverage_field.
+        """
+        field = self.los + self.reflections
+        nlos = self.los == 0
+        field[nlos] += self.diffracted[nlos]
+        return field
+
+    def power(self) -> np.ndarray:
+        """
+        Array of shape (ny, nx) with power in [W], same as coverage.coverage_map.
+        """
+        power_ref = self.transmitter.power * (self.transmitter.lam / (4 * math.pi)) ** 2
+        return (power_ref * np.abs(self.field)**2).reshape(len(self.ys), len(self.xs))
+
+    # ==================================================================================================================
+    # Edits
+    # ==================================================================================================================
+    def move_wall(self, wall: Wall, points: tuple[float, float, float, float]):
+        idx = self.walls.index(wall)
+
+        def edit():
+            wall.points = points
+        self.edit(edit, idx, idx, (wall.points, tuple(points)))
+
+    def set_wall(self, wall: Wall, material: Material | None = None, width: float | None = None):
+        """
+        Changes parameters of wall which don't change its geometry.
+        """
+        idx = self.walls.index(wall)
+
+        def edit():
+            if material is not None:
+                wall.material = material
+            if width is not None:
+                wall.width = width
+        self.edit(edit, idx, idx, ())
+
+    def add_wall(self, wall: Wall):
+        self.edit(lambda: self.walls.append(wall), None, len(self.walls), (wall.points,))
+
+    def remove_wall(self, wall: Wall):
+        self.edit(lambda: self.walls.remove(wall), self.walls.index(wall), None, (wall.points,), shift=True)
+
+    def edit(self,
+             apply,
+             removed: int | None,
+             added: int | None,
+             segments: tuple[tuple[float, float, float, float], ...],
+             shift: bool = False):
+        """
+        Applies edit of one wall and updates map.
+
+        Args:
+            apply: function that edits wall
+            removed: index of edited wall before edit, None for new wall
+            added: index of edited wall after edit, None for removed wall
+            segments: positions of edited wall that can block paths - old and/or new, empty if geometry doesn't change
+            shift: True if wall is removed from store, see ImageTree.update_wall
+        """
+        nodes = list(self.tree.nodes)
+        old_segments = pack_walls(self.walls)[:, 0:4].copy()
+        affected = np.zeros((len(nodes), len(self.tiles)), dtype=bool)
+        crossed, blocked = zip(*(self.tiles_in_corridors(segment) for segment in segments)) if segments else ((), ())
+        for mask in crossed:
+            affected |= mask
+        # paths blocked by both old and new position of moved wall are not changed
+        if len(blocked) == 2:
+            affected &= ~(blocked[0] & blocked[1])
+        if removed is not None:
+            with_wall = [i for i, node in enumerate(nodes) if removed in node.sequence]
+            affected[with_wall] = self.tiles_in_beams([nodes[i] for i in with_wall])
+        # when most of lit tiles are affected, reflections are calculated again instead of re-tracing them twice
+        rebuild = 2 * affected.sum() > self.tiles_in_beams(nodes).sum()
+        if not rebuild:
+            self.retrace(nodes, affected, old_segments, -1)
+
+        apply()
+        if self.visibility is not None and segments:
+            if removed is None:
+                self.visibility.add_wall()
+            elif added is None:
+                self.visibility.remove_wall(removed)
+            else:
+                self.visibility.update_wall(added)
+        self.tree.update_wall(removed, added, shift)
+        segments_now = pack_walls(self.walls)[:, 0:4]
+
+        # nodes without edited wall are the same before and after edit, only indices of walls could shift
+        def remap(sequence: tuple[int, ...]) -> tuple[int, ...]:
+            return tuple(i - 1 if shift and i > removed else i for i in sequence)
+        kept = [i for i, node in enumerate(nodes) if removed is None or removed not in node.sequence]
+        new_idx = {node.sequence: i for i, node in enumerate(self.tree.nodes)}
+        new_affected = np.zeros((len(self.tree.nodes), len(self.tiles)), dtype=bool)
+        # node pruned by visibility graph after edit has no paths, so it had paths only in affected tiles
+        for i in kept:
+            if affected[i].any() and remap(nodes[i].sequence) in new_idx:
+                new_affected[new_idx[remap(nodes[i].sequence)]] = affected[i]
+        # new nodes - with edited wall or newly visible by graph
+        old_sequences = {remap(nodes[i].sequence) for i in kept}
+        new = [i for i, node in enumerate(self.tree.nodes) if node.sequence not in old_sequences]
+        new_affected[new] = self.tiles_in_beams([self.tree.nodes[i] for i in new])
+        if rebuild:
+            self.reflections = reflections_field(self.transmitter, self.walls, self.points, self.order, segments_now,
+                                                 self.tree)
+        else:
+            self.retrace(self.tree.nodes, new_affected, segments_now, 1)
+        self.last_pairs = int(affected.sum() + new_affected.sum())
+
+        # direct path is root node, points which changed LOS state need new diffraction
+        changed = np.zeros(len(self.points), dtype=bool)
+        if new_affected[0].any():
+            idx = np.concatenate([self.tiles[t] for t in np.flatnonzero(new_affected[0])])
+            old_nlos = self.los[idx] == 0
+            self.los[idx] = reflection_path_coefs(self.transmitter, [], self.points[idx], segments_now)
+            changed[idx[old_nlos != (self.los[idx] == 0)]] = True
+        if self.diffraction and segments:
+            changed |= self.diffraction_changes(segments, segments_now)
+        self.last_points = int(changed.sum())
+        self.update_diffraction(np.flatnonzero(changed), segments_now)
+
+    # ==================================================================================================================
+    # Update
+    # ==================================================================================================================
+    def retrace(self,
+                nodes: list[ImageNode],
+                affected: np.ndarray,
+                segments: np.ndarray,
+                sign: int):
+        """
+        Adds (sign = 1) or subtracts (sign = -1) contributions of reflection nodes in their affected tiles.
+        """
+        for i in np.flatnonzero(affected[1:].any(axis=1)) + 1:
+            idx = np.concatenate([self.tiles[t] for t in np.flatnonzero(affected[i])])
+            self.reflections[idx] += sign * reflection_path_coefs(
+                self.transmitter, [self.walls[w] for w in nodes[i].sequence], self.points[idx], segments)
+
+    def update_diffraction(self, idx: np.ndarray, segments: np.ndarray):
+        """
+        Updates candidate edges and recalculates diffraction in given points.
+        """
+        self.edges = visible_edges(self.transmitter, segments) if len(segments) else np.zeros((0, 2))
+        self.diffracted[idx], self.best[idx], self.best_edge[idx] = 0, 0, np.nan
+        if self.diffraction:
+            nlos = idx[self.los[idx] == 0]
+            self.diffracted[nlos], self.best[nlos], self.best_edge[nlos] = \
+                diffraction_best(self.transmitter, self.points[nlos], segments, self.edges)
+
+    def tiles_in_beams(self, nodes: list[ImageNode]) -> np.ndarray:
+        """
+        Returns (K, T) mask of tiles which can be lit by beams of nodes (conservative - tile is only rejected
+        when all its corners are outside of one of half-planes bounding beam).
+        """
+        inside = np.ones((len(nodes), len(self.tiles)), dtype=bool)
+        lit = [i for i, node in enumerate(nodes) if node.aperture is not None]
+        if lit:
+            halfplanes = np.array([beam_halfplanes(nodes[i].image, nodes[i].aperture) for i in lit])
+            x, y = self.tile_corners[..., 0], self.tile_corners[..., 1]
+            values = (halfplanes[:, :, 0, None, None]*x + halfplanes[:, :, 1, None, None]*y
+                      + halfplanes[:, :, 2, None, None])
+            inside[lit] = (values >= -FLOAT_COMP).any(axis=3).all(axis=1)
+        return inside
+
+    def tiles_in_corridors(self, segment: tuple[float, float, float, float]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds tiles where paths of nodes of current tree can be blocked or unblocked by wall placed on segment.
+        Paths of node to tile pass only through part of every aperture - tile is projected from node's image onto
+        node's aperture, that part from parent's image onto parent's aperture and so on up to transmitter (see
+        aperture_parts). Hull of every hop is tested for every (node, tile) pair, so long wall crossing only some
+        paths of node doesn't mark all tiles lit by node.
+
+        Returns:
+            (K, T) mask of tiles whose corridor is crossed by segment and (K, T) mask of tiles whose paths are all
+            blocked by segment - it separates both ends of some hop
+        """
+        nodes = self.tree.nodes
+        dirty = np.zeros((len(nodes), len(self.tiles)), dtype=bool)
+        blocked = np.zeros((len(nodes), len(self.tiles)), dtype=bool)
+        k, t = np.nonzero(self.tiles_in_beams(nodes))
+        images = np.array([node.image for node in nodes], dtype=float)
+        apertures = np.array([(np.nan,)*4 if node.aperture is None else node.aperture for node in nodes],
+                             dtype=float)
+        parents = np.array([node.parent for node in nodes])
+        tx = np.asarray(self.transmitter.point, dtype=float)
+        seg_low = np.minimum(segment[0:2], segment[2:4]) - FLOAT_COMP
+        seg_high = np.maximum(segment[0:2], segment[2:4]) + FLOAT_COMP
+
+        # hops from last to first, far end is tile and then part of aperture of node closer to tile
+        crossed = np.zeros(len(k), dtype=bool)
+        separated = np.zeros(len(k), dtype=bool)
+        pair, current, far = np.arange(len(k)), k, self.tile_corners[t]
+        while len(pair):
+            root = current == 0
+            near = np.empty((len(pair), 2, 2))
+            near[root] = tx
+            near[~root] = aperture_parts(images[current[~root]], apertures[current[~root]], far[~root])
+            hulls = np.concatenate((near, far), axis=1)
+            # bounding boxes are checked first
+            candidates = np.flatnonzero((hulls.min(axis=1) <= seg_high).all(axis=1)
+                                        & (hulls.max(axis=1) >= seg_low).all(axis=1))
+            candidates = candidates[segment_crosses_hulls(segment, hulls[candidates])]
+            crossed[pair[candidates]] = True
+            separated[pair[candidates]] |= segment_separates(segment, near[candidates], far[candidates])
+            # earlier hops are needed only for pairs not blocked yet
+            keep = ~root & ~separated[pair]
+            pair, current, far = pair[keep], parents[current[keep]], np.tile(near[keep], (1, 2, 1))
+        dirty[k[crossed], t[crossed]] = True
+        blocked[k[separated], t[separated]] = True
+        return dirty, blocked
+
+    def diffraction_changes(self,
+                            segments: tuple[tuple[float, float, float, float], ...],
+                            walls_segments: np.ndarray) -> np.ndarray:
+        """
+        Returns mask of points whose diffraction can change after edit. Uses candidate edges from before edit.
+
+        Args:
+            segments: old and/or new position of edited wall
+            walls_segments: (N, 4) array of walls after edit
+        """
+        new_edges = visible_edges(self.transmitter, walls_segments) if len(walls_segments) else np.zeros((0, 2))
+        changed = np.zeros(len(self.points), dtype=bool)
+        nlos = np.flatnonzero(self.los == 0)
+        if not len(nlos):
+            return changed
+        best, best_edge, points = self.best[nlos], self.best_edge[nlos], self.points[nlos]
+        walls = np.array(segments, dtype=float)
+
+        # chosen edge doesn't exist anymore, lost visibility from transmitter or got blocked by edited wall
+        has_edge = best > 0
+        lost = has_edge & ~np.isin(best_edge[:, 0] + 1j*best_edge[:, 1], new_edges[:, 0] + 1j*new_edges[:, 1])
+        lost[has_edge] |= segments_blocked(best_edge[has_edge], points[has_edge], walls)
+        changed[nlos[lost]] = True
+
+        # new edges or edges unblocked by edited wall can be stronger than chosen one
+        old_edges = set(map(tuple, self.edges.tolist()))
+        for edge in new_edges:
+            amplitude, _ = edge_amplitude(self.transmitter, edge, points)
+            stronger = np.flatnonzero(amplitude > best)
+            if tuple(edge.tolist()) in old_edges:
+                stronger = stronger[segments_blocked(edge, points[stronger], walls)]
+            changed[nlos[stronger]] = True
+        return changed
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def aperture_parts(images: np.ndarray,
+                   apertures: np.ndarray,
+                   points: np.ndarray) -> np.ndarray:
+    """
+    Parts of apertures through which paths from images reach given points - points are projected from image onto
+    line of aperture and clipped to aperture. Whole aperture is returned when points are not all on one side of
+    line through image parallel to aperture, projection isn't monotonous then.
+
+    Args:
+        images: array of shape (M, 2) with transmitter images
+        apertures: array of shape (M, 4) with apertures of images
+        points: array of shape (M, Q, 2), e.g. corners of tiles
+
+    Returns:
+        array of shape (M, 2, 2) with endpoints of aperture parts
+    """
+    start, direction = apertures[:, None, 0:2], apertures[:, None, 2:4] - apertures[:, None, 0:2]
+    rays = points - images[:, None]
+    offset = start - images[:, None]
+    cross = rays[..., 0]*direction[..., 1] - rays[..., 1]*direction[..., 0]
+    one_side = (cross > FLOAT_ZERO).all(axis=1) | (cross < -FLOAT_ZERO).all(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = (offset[..., 0]*rays[..., 1] - offset[..., 1]*rays[..., 0]) / cross
+    low = np.where(one_side, np.clip(u.min(axis=1), 0, 1), 0)
+    high = np.where(one_side, np.clip(u.max(axis=1), 0, 1), 1)
+    return start + np.stack((low, high), axis=1)[..., None] * direction
@@ -0,0 +1,129 @@
+import json
+import re
+from typing import Iterator, TextIO
+
+from globals import JSON_CHUNK_SIZE
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# characters which can continue json number
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
+class JsonStreamReader:
+    """
+    Incremental reader of json object with large arrays. File is read in chunks of chunk_size characters and
+    only currently parsed value is kept in memory, so arrays can be processed item by item.
+
+    Args:
+        file: file opened in text mode
+        chunk_size: number of characters read at once
+    """
+    def __init__(self,
+                 file: TextIO,
+                 chunk_size: int = JSON_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        """
+        Drops parsed part of buffer and reads next chunk. Returns False at the end of file.
+        """
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespaces and returns next character, empty string at the end of file.
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Parses next complete value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # prefix of number cut by end of buffer (e.g. "1." of "1.5") is valid number too
+                number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.eof or not number or (end < len(self.buffer) and self.buffer[end] not in NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def items(self) -> Iterator:
+        """
+        Iterates over items of array starting at current position.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def members(self, streamed: tuple[str, ...] = ()) -> Iterator[tuple[str, object]]:
+        """
+        Iterates over members of object starting at current position. Arrays of keys from streamed are not
+        parsed at once, instead (key, item) pair is yielded for every item of array.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if key in streamed:
+                for item in self.items():
+                    yield key, item
+            else:
+                yield key, self.value()
+            if self.expect(",}") == "}":
+                return
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def write_array(file: TextIO,
+                items: Iterator,
+                indent: int = 2,
+                level: int = 1):
+    """
+    Writes array item by item, formatted same as json.dumps(..., indent=indent) of array nested on given level.
+    """
+    prefix = "\n" + " " * indent * (level + 1)
+    first = True
+    for item in items:
+        file.write("[" if first else ",")
+        file.write(prefix + json.dumps(item, indent=indent).replace("\n", prefix))
+        first = False
+    file.write("[]" if first else "\n" + " " * indent * level + "]")
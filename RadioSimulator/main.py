@@ -2,11 +2,19 @@ import window
 from routines import single_ray_routine, draw_scene_routine, multi_ray_routine, clear_rays, diffraction_routine
 import globals as gb
 import PySimpleGUI as sg
+from spatial import WallGrid
+from visibility import VisibilityGraph
+from props import WallStore
+from result_cache import ResultCache
 
 lines = []
 
 app = sg.Window("test", window.layout(), finalize=True)
 gb.graph = app["graph"]
+gb.walls = WallStore()
+gb.wall_grid = WallGrid(gb.walls)
+gb.visibility = VisibilityGraph(gb.walls)
+gb.result_cache = ResultCache(directory=gb.RESULT_CACHE_DIR)
 
 window.add_grid(gb.graph)
 
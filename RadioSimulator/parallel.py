@@ -0,0 +1,179 @@
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from props import Material, Wall, WallStore, Transmitter
+from spatial import WallGrid
+from image_tree import ImageTree
+from coverage import coverage_field, grid_points
+from geometrics import distance_spaces
+from globals import PARALLEL_CHUNK_SIZE, COVERAGE_RESOLUTION, COVERAGE_ORDER, MULTI_RAY_STEP, DIFFRACTION_METHOD
+
+# walls are stored in shared memory as rows of (x1, y1, x2, y2, width, material index)
+WALL_COLUMNS = 6
+# materials are stored as rows of (alpha, custom_alpha, eta), names are passed to workers separately
+MATERIAL_COLUMNS = 3
+
+# state of worker process, set by _init_worker
+_worker_walls: WallStore = WallStore()
+_worker_memory: list[shared_memory.SharedMemory] = list()
+_worker_trees: dict[tuple, ImageTree] = dict()
+_worker_grid: WallGrid | None = None
+
+
+class ParallelSimulator:
+    """
+    Process pool for coverage maps, route sweeps and multi-transmitter runs. Walls and materials are packed into
+    shared memory once, every worker attaches to it and rebuilds walls at start, so tasks only carry transmitter
+    parameters and chunk of points. Points are split into chunks of chunk_size and results are assembled by chunk
+    position, so output doesn't depend on order in which workers finish.
+
+    Use as context manager or call close, to free shared memory.
+
+    Args:
+        walls: WallStore or list of walls on scene
+        processes: number of worker processes, by default number of CPUs
+        chunk_size: number of points in one task
+    """
+    def __init__(self,
+                 walls: WallStore | list[Wall],
+                 processes: int | None = None,
+                 chunk_size: int = PARALLEL_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        if isinstance(walls, WallStore):
+            # columns of store are copied directly
+            materials = walls.materials
+            wall_rows = np.column_stack((walls.data["points"], walls.data["width"], walls.data["material"]))
+        else:
+            materials = list()
+            for wall in walls:
+                if wall.material not in materials:
+                    materials.append(wall.material)
+            wall_rows = [(*wall.points, wall.width, materials.index(wall.material)) for wall in walls]
+
+        material_rows = [(m.alpha, m.custom_alpha, m.eta) for m in materials]
+        self._memory = [create_shared_array(np.array(wall_rows, dtype=float).reshape(-1, WALL_COLUMNS)),
+                        create_shared_array(np.array(material_rows, dtype=float).reshape(-1, MATERIAL_COLUMNS))]
+        shapes = [(len(wall_rows), WALL_COLUMNS), (len(material_rows), MATERIAL_COLUMNS)]
+        names = [m.name for m in materials]
+
+        self._pool = multiprocessing.Pool(processes, _init_worker,
+                                          ([memory.name for memory in self._memory], shapes, names))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def field(self,
+              transmitters: list[Transmitter],
+              points: np.ndarray,
+              order: int = COVERAGE_ORDER,
+              diffraction: bool = True,
+              diffraction_method: str = DIFFRACTION_METHOD) -> np.ndarray:
+        """
+        Parallel version of coverage.coverage_field for many transmitters.
+
+        Returns:
+            array of shape (T, P) with complex distance coefficients of each transmitter
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        tasks = [((t.point, t.power, t.freq), points[start:start + self.chunk_size], order, diffraction,
+                  diffraction_method)
+                 for t in transmitters
+                 for start in range(0, len(points), self.chunk_size)]
+        # imap keeps order of tasks, so assembly is deterministic
+        chunks = self._pool.imap(_field_task, tasks)
+        chunks_per_transmitter = math.ceil(len(points) / self.chunk_size)
+        field = np.zeros((len(transmitters), len(points)), dtype=complex)
+        for i, chunk in enumerate(chunks):
+            t_idx, c_idx = divmod(i, chunks_per_transmitter)
+            start = c_idx * self.chunk_size
+            field[t_idx, start:start + len(chunk)] = chunk
+        return field
+
+    def coverage_maps(self,
+                      transmitters: list[Transmitter],
+                      resolution: float = COVERAGE_RESOLUTION,
+                      order: int = COVERAGE_ORDER,
+                      diffraction: bool = True,
+                      diffraction_method: str = DIFFRACTION_METHOD) -> np.ndarray:
+        """
+        Parallel version of coverage.coverage_map for many transmitters.
+
+        Returns:
+            array of shape (T, ny, nx) with power in [W] of each transmitter
+        """
+        xs, ys, points = grid_points(resolution)
+        field = self.field(transmitters, points, order, diffraction, diffraction_method)
+        power_ref = np.array([t.power * (t.lam / (4 * math.pi)) ** 2 for t in transmitters])
+        return (power_ref[:, None] * np.abs(field)**2).reshape(len(transmitters), len(ys), len(xs))
+
+    def route_power(self,
+                    transmitter: Transmitter,
+                    routes: list[tuple[tuple[float, float], tuple[float, float]]],
+                    steps: int = MULTI_RAY_STEP,
+                    order: int = COVERAGE_ORDER,
+                    diffraction: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Parallel version of simulation.route_power for many routes (receiver sweeps) at once.
+
+        Args:
+            routes: list of (start, end) points of routes
+
+        Returns:
+            array of shape (R, steps) with power in [W] and array of shape (R, steps) with distance from start
+        """
+        spaces = [distance_spaces(start, end, steps) for start, end in routes]
+        points = np.concatenate([np.stack((x, y), axis=1) for x, y, _ in spaces])
+        field = self.field([transmitter], points, order, diffraction)[0]
+        power = transmitter.power * (transmitter.lam / (4 * math.pi)) ** 2 * np.abs(field)**2
+        return power.reshape(len(routes), steps), np.stack([dist for _, _, dist in spaces])
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def create_shared_array(array: np.ndarray) -> shared_memory.SharedMemory:
+    """
+    Copies array into new block of shared memory.
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[:] = array
+    return memory
+
+
+def _init_worker(names: list[str], shapes: list[tuple[int, int]], material_names: list[str]):
+    global _worker_walls
+    for name in names:
+        _worker_memory.append(shared_memory.SharedMemory(name=name))
+    wall_rows, material_rows = (np.ndarray(shape, dtype=float, buffer=memory.buf)
+                                for shape, memory in zip(shapes, _worker_memory))
+
+    materials = [Material(name, row[0], bool(row[1]), row[2]) for name, row in zip(material_names, material_rows)]
+    _worker_walls = WallStore([Wall((row[0], row[1]), (row[2], row[3]), None, materials[int(row[5])], row[4])
+                               for row in wall_rows], capacity=len(wall_rows))
+
+
+def _field_task(task: tuple) -> np.ndarray:
+    global _worker_grid
+    (point, power, freq), points, order, diffraction, diffraction_method = task
+    transmitter = Transmitter(point, None, power, freq)
+    # image tree is built once per transmitter in each worker
+    key = (point, freq, order)
+    if key not in _worker_trees:
+        _worker_trees[key] = ImageTree(transmitter, _worker_walls, order)
+    # grid is only used by multi-edge diffraction, it's built on first such task
+    if diffraction and diffraction_method != "knife-edge" and _worker_grid is None:
+        _worker_grid = WallGrid(_worker_walls)
+    return coverage_field(transmitter, _worker_walls, points, order, diffraction, _worker_trees[key],
+                          diffraction_method, _worker_grid)
@@ -0,0 +1,190 @@
+import json
+import os
+import numpy as np
+
+from props import Transmitter, Wall
+from image_tree import ImageTree
+from paths import trace_paths, direction_angle
+from scene import map_array
+from globals import COVERAGE_ORDER, PATH_EXPORT_CHUNK_SIZE
+
+PATH_EXPORT_VERSION = 1
+# columns with one value per path, node is index of interaction sequence, -1 for diffracted path
+PATH_COLUMNS = {"delay": np.dtype("<f8"),  # [s]
+                "gain": np.dtype("<c16"),  # complex gain, received power is transmitter power times |gain|^2
+                "departure": np.dtype("<f8"),  # angle of departure in [rad]
+                "arrival": np.dtype("<f8"),  # angle of arrival in [rad], direction towards last interaction
+                "node": np.dtype("<i4")}
+# columns with one value per receiver, offsets has one more value and holds ranges of receiver's paths (CSR)
+RECEIVER_COLUMNS = {"x": np.dtype("<f8"),
+                    "y": np.dtype("<f8"),
+                    "offsets": np.dtype("<i8")}
+# interaction sequences of nodes in CSR layout, walls of node i are walls[node_offsets[i]:node_offsets[i+1]]
+NODE_COLUMNS = {"node_offsets": np.dtype("<i8"),
+                "walls": np.dtype("<i4")}
+
+
+class PathWriter:
+    """
+    Writer of path lists (channel impulse responses) of many receivers. Every column is written to its own raw
+    file in export directory, chunk after chunk, so memory use doesn't depend on number of receivers. Paths of
+    receiver are stored in consecutive rows, receiver's range of rows is given by offsets column. Layout of
+    columns is described in header.json, which is written by close. Export without header is incomplete - header of
+    previous export in directory is removed when writer is created and context manager leaving with exception
+    closes column files without writing it.
+
+    Use as context manager or call close.
+
+    Args:
+        directory: export directory, created if it doesn't exist
+        transmitter: transmitter of exported paths
+    """
+    def __init__(self,
+                 directory: str,
+                 transmitter: Transmitter):
+        self.directory = directory
+        self.transmitter = transmitter
+        self.n_receivers = 0
+        self.n_paths = 0
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, "header.json")):
+            os.remove(os.path.join(directory, "header.json"))
+        self.files = {name: open(column_path(directory, name), "wb") for name in (*PATH_COLUMNS, *RECEIVER_COLUMNS)}
+        self.files["offsets"].write(np.zeros(1, RECEIVER_COLUMNS["offsets"]).tobytes())
+
+    def write(self,
+              points: np.ndarray,
+              idx: np.ndarray,
+              columns: dict[str, np.ndarray]):
+        """
+        Appends chunk of receivers and their paths.
+
+        Args:
+            points: receiver points of chunk (R, 2)
+            idx: index of receiver in chunk for every path (M,)
+            columns: values of every column from PATH_COLUMNS for every path (M,)
+        """
+        order = np.argsort(idx, kind="stable")
+        for name, dtype in PATH_COLUMNS.items():
+            self.files[name].write(np.asarray(columns[name])[order].astype(dtype).tobytes())
+        counts = np.bincount(idx, minlength=len(points))
+        offsets = self.n_paths + np.cumsum(counts)
+        self.files["offsets"].write(offsets.astype(RECEIVER_COLUMNS["offsets"]).tobytes())
+        self.files["x"].write(points[:, 0].astype(RECEIVER_COLUMNS["x"]).tobytes())
+        self.files["y"].write(points[:, 1].astype(RECEIVER_COLUMNS["y"]).tobytes())
+        self.n_receivers += len(points)
+        self.n_paths += len(idx)
+
+    def close(self, sequences: list[tuple[int, ...]] = ()):
+        """
+        Closes column files and writes interaction sequences and header.
+
+        Args:
+            sequences: wall indices of every node
+        """
+        for file in self.files.values():
+            file.close()
+        node_offsets = np.zeros(len(sequences) + 1, NODE_COLUMNS["node_offsets"])
+        node_offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+        walls = np.array([i for sequence in sequences for i in sequence], NODE_COLUMNS["walls"])
+        node_offsets.tofile(column_path(self.directory, "node_offsets"))
+        walls.tofile(column_path(self.directory, "walls"))
+
+        shapes = {name: self.n_paths for name in PATH_COLUMNS}
+        shapes.update(x=self.n_receivers, y=self.n_receivers, offsets=self.n_receivers + 1,
+                      node_offsets=len(node_offsets), walls=len(walls))
+        columns = {**PATH_COLUMNS, **RECEIVER_COLUMNS, **NODE_COLUMNS}
+        header = {"Version": PATH_EXPORT_VERSION,
+                  "Transmitter": {"point": list(self.transmitter.point), "power": self.transmitter.power,
+                                  "freq": self.transmitter.freq},
+                  "Columns": {name: {"descr": np.lib.format.dtype_to_descr(dtype), "shape": shapes[name]}
+                              for name, dtype in columns.items()}}
+        with open(os.path.join(self.directory, "header.json"), "w") as file:
+            json.dump(header, file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            for file in self.files.values():
+                file.close()
+        elif not all(file.closed for file in self.files.values()):
+            self.close()
+
+
+class PathTable:
+    """
+    Path lists written by PathWriter. Columns are memory-mapped, so only accessed parts are read from disk.
+
+    Args:
+        directory: export directory
+    """
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "header.json")) as file:
+            self.header = json.load(file)
+        self.columns = {name: map_array(column_path(directory, name), params["descr"], params["shape"], 0)
+                        for name, params in self.header["Columns"].items()}
+
+    def __len__(self):
+        return len(self.columns["x"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def paths(self, receiver: int) -> dict[str, np.ndarray]:
+        """
+        Returns values of path columns of one receiver.
+        """
+        start, end = self.columns["offsets"][receiver:receiver + 2]
+        return {name: self.columns[name][start:end] for name in PATH_COLUMNS}
+
+    def walls(self, node: int) -> np.ndarray:
+        """
+        Returns indices of walls that path of node reflects of, in order. Diffracted paths (node -1) have none.
+        """
+        if node < 0:
+            return np.zeros(0, NODE_COLUMNS["walls"])
+        start, end = self.columns["node_offsets"][node:node + 2]
+        return self.columns["walls"][start:end]
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def export_paths(transmitter: Transmitter,
+                 walls: list[Wall],
+                 points: np.ndarray,
+                 directory: str,
+                 order: int = COVERAGE_ORDER,
+                 diffraction: bool = True,
+                 chunk_size: int = PATH_EXPORT_CHUNK_SIZE) -> int:
+    """
+    Finds paths from transmitter to every point (see paths.trace_paths) and exports them chunk by chunk with
+    PathWriter. Gains are calculated at frequency of transmitter.
+
+    Returns:
+        number of exported paths
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    tree = ImageTree(transmitter, walls, order) if order > 0 else None
+    tx = np.asarray(transmitter.point, dtype=float)
+    sequences = [()]
+    with PathWriter(directory, transmitter) as writer:
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            paths = trace_paths(transmitter, walls, chunk, order, diffraction, tree)
+            sequences = paths.sequences
+            diffracted_idx, coefs, length, edges = paths.diffraction_paths(transmitter.freq)
+            columns = {"delay": np.concatenate((paths.length, length)) / 3e8,
+                       "gain": np.concatenate((paths.coefs(transmitter.freq), coefs)) * transmitter.lam/(4*np.pi),
+                       "departure": np.concatenate((paths.departure, direction_angle(edges - tx))),
+                       "arrival": np.concatenate((paths.arrival, direction_angle(edges - chunk[diffracted_idx]))),
+                       "node": np.concatenate((paths.node, np.full(len(diffracted_idx), -1)))}
+            writer.write(chunk, np.concatenate((paths.idx, diffracted_idx)), columns)
+        writer.close(sequences)
+    return writer.n_paths
+
+
+def column_path(directory: str, name: str) -> str:
+    return os.path.join(directory, name + ".bin")
@@ -0,0 +1,263 @@
+import numpy as np
+
+from props import Transmitter, Wall
+from ray import pack_walls, reflection_paths
+from image_tree import ImageTree
+from coverage import diffraction_best, edge_visibility, visible_edges
+from diffraction import edge_geometry, knife_edge_loss
+from globals import COVERAGE_ORDER
+
+
+class PathSet:
+    """
+    Frequency independent geometry of all paths from one transmitter point to many points, found the same way as by
+    coverage.coverage_field. Paths are stored as flat arrays of endpoint index, amplitude (product of reflection
+    coefficients divided by length) and length, so field at any frequency is one phase step and scatter-add.
+    Diffraction keeps candidate edges and their visibility from NLOS points, only amplitudes are calculated per
+    frequency, because knife-edge loss depends on wavelength.
+
+    Args:
+        transmitter: source of paths, its frequency is not used by geometry
+        n_points: number of endpoints
+        idx: endpoint index of every path (N,)
+        amplitude: amplitude of every path (N,)
+        length: length of every path (N,)
+        departure: angle of departure of every path in [rad] (N,), measured at transmitter from x axis
+        arrival: angle of arrival of every path in [rad] (N,), direction from endpoint towards last interaction
+        node: index of image tree node of every path (N,), 0 for direct path
+        sequences: reflection sequences (wall indices) of image tree nodes
+        segments: (x1, y1, x2, y2) of walls, needed by diffraction
+        nlos: indices of points without direct path, where diffraction is added
+        nlos_points: coordinates of NLOS points (Pn, 2)
+        edges: candidate diffraction edges (E, 2), None disables diffraction
+        visibility: (E, Pn) mask of NLOS points visible from edges
+    """
+    def __init__(self,
+                 transmitter: Transmitter,
+                 n_points: int,
+                 idx: np.ndarray,
+                 amplitude: np.ndarray,
+                 length: np.ndarray,
+                 departure: np.ndarray,
+                 arrival: np.ndarray,
+                 node: np.ndarray,
+                 sequences: list[tuple[int, ...]],
+                 segments: np.ndarray,
+                 nlos: np.ndarray,
+                 nlos_points: np.ndarray,
+                 edges: np.ndarray | None = None,
+                 visibility: np.ndarray | None = None):
+        self.transmitter = transmitter
+        self.n_points = n_points
+        self.idx = idx
+        self.amplitude = amplitude
+        self.length = length
+        self.departure = departure
+        self.arrival = arrival
+        self.node = node
+        self.sequences = sequences
+        self.segments = segments
+        self.nlos = nlos
+        self.nlos_points = nlos_points
+        self.edges = edges
+        self.visibility = visibility
+
+    def __len__(self):
+        return len(self.idx)
+
+    def coefs(self, freq: float) -> np.ndarray:
+        """
+        Complex distance coefficients of paths (N,) at given frequency in [Hz].
+        """
+        return self.amplitude * np.exp(-2j*np.pi*freq*self.length/3e8)
+
+    def field(self, freq: float) -> np.ndarray:
+        """
+        Complex distance coefficients at all endpoints (P,) at given frequency in [Hz], equal to result of
+        coverage.coverage_field for transmitter with this frequency.
+        """
+        coefs = self.coefs(freq)
+        # paths are ordered by node, so every point sums its paths in the same order as coverage_field
+        field = np.bincount(self.idx, coefs.real, self.n_points) + 1j*np.bincount(self.idx, coefs.imag, self.n_points)
+        if self.edges is not None:
+            field[self.nlos] += diffraction_best(self.transmitter, self.nlos_points, self.segments, self.edges,
+                                                 self.visibility, freq)[0]
+        return field
+
+    def frequency_response(self,
+                           freqs: np.ndarray,
+                           points_idx: np.ndarray | None = None) -> np.ndarray:
+        """
+        Channel transfer function H(f) of chosen endpoints for vector of frequencies, evaluated as one outer product
+        of path lengths and frequencies. Received power at frequency f is transmitter power times |H(f)|^2.
+
+        Args:
+            freqs: frequencies in [Hz] (F,)
+            points_idx: indices of endpoints (R,), by default all endpoints
+
+        Returns:
+            array of shape (R, F) with complex channel response
+        """
+        freqs = np.asarray(freqs, dtype=float).ravel()
+        points_idx = np.arange(self.n_points) if points_idx is None else np.asarray(points_idx).ravel()
+        rows = np.full(self.n_points, -1)
+        rows[points_idx] = np.arange(len(points_idx))
+
+        response = np.zeros((len(points_idx), len(freqs)), dtype=complex)
+        selected = rows[self.idx] >= 0
+        coefs = self.amplitude[selected, None] * np.exp(-2j*np.pi*self.length[selected, None]*freqs/3e8)
+        np.add.at(response, rows[self.idx[selected]], coefs)
+
+        if self.edges is not None:
+            nlos_rows = np.full(self.n_points, -1)
+            nlos_rows[self.nlos] = np.arange(len(self.nlos))
+            nlos_idx = nlos_rows[points_idx]
+            has_nlos = nlos_idx >= 0
+            response[has_nlos] += self.diffraction_response(freqs, nlos_idx[has_nlos])
+        # distance coefficients times wavelength factor of Friis formula
+        return response * 3e8/(4*np.pi*freqs)
+
+    def diffraction_response(self,
+                             freqs: np.ndarray,
+                             nlos_idx: np.ndarray) -> np.ndarray:
+        """
+        Distance coefficients of diffraction for chosen NLOS points (R,) and vector of frequencies (F,), for every
+        frequency the strongest visible edge is chosen, same as coverage.diffraction_best.
+
+        Returns:
+            array of shape (R, F)
+        """
+        field = np.zeros((len(nlos_idx), len(freqs)), dtype=complex)
+        best = np.zeros((len(nlos_idx), len(freqs)))
+        if not len(self.segments):
+            return field
+        points = self.nlos_points[nlos_idx]
+        for edge, visibility in zip(self.edges, self.visibility[:, nlos_idx]):
+            if not visibility.any():
+                continue
+            h, d1, d2 = edge_geometry(self.transmitter.point, edge, points[visibility])
+            v = h[:, None] * np.sqrt(2*freqs/3e8 * (1/d1 + 1/d2)[:, None])
+            amplitude = 10**(-knife_edge_loss(v)/20) / (d1 + d2)[:, None]
+            coefs = amplitude * np.exp(-2j*np.pi*freqs*(d1 + d2)[:, None]/3e8)
+
+            stronger = amplitude > best[visibility]
+            best[visibility] = np.where(stronger, amplitude, best[visibility])
+            field[visibility] = np.where(stronger, coefs, field[visibility])
+        return field
+
+    def diffraction_paths(self, freq: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Diffracted paths chosen by field at given frequency, at most one per NLOS point.
+
+        Returns:
+            endpoint indices (D,), complex distance coefficients (D,), path lengths (D,) and edges (D, 2)
+        """
+        if self.edges is None:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=complex), np.zeros(0), np.zeros((0, 2))
+        field, best, best_edge = diffraction_best(self.transmitter, self.nlos_points, self.segments, self.edges,
+                                                  self.visibility, freq)
+        found = best > 0
+        edge = best_edge[found]
+        length = np.sqrt(((edge - np.asarray(self.transmitter.point, dtype=float))**2).sum(axis=1)) \
+            + np.sqrt(((self.nlos_points[found] - edge)**2).sum(axis=1))
+        return self.nlos[found], field[found], length, edge
+
+    def path_powers(self, freq: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Delays and path gains of all paths at given frequency, diffracted path is the one chosen by field.
+
+        Returns:
+            endpoint indices (M,), delays in [s] (M,) and path gains (M,) - received power divided by
+            transmitter power
+        """
+        diffracted_idx, coefs, diffracted_length, _ = self.diffraction_paths(freq)
+        idx = np.concatenate((self.idx, diffracted_idx))
+        length = np.concatenate((self.length, diffracted_length))
+        amplitude = np.concatenate((np.abs(self.amplitude), np.abs(coefs)))
+        return idx, length/3e8, (amplitude * 3e8/(4*np.pi*freq))**2
+
+    def power_delay_profile(self,
+                            point_idx: int,
+                            freq: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Power-delay profile of one endpoint, made of discrete paths.
+
+        Returns:
+            delays in [s] in ascending order and path gains
+        """
+        idx, delay, gain = self.path_powers(freq)
+        selected = idx == point_idx
+        order = np.argsort(delay[selected], kind="stable")
+        return delay[selected][order], gain[selected][order]
+
+    def delay_spread(self, freq: float) -> np.ndarray:
+        """
+        RMS delay spread of all endpoints - power weighted standard deviation of path delays.
+
+        Returns:
+            array of shape (P,) with delay spread in [s], NaN for points without paths
+        """
+        idx, delay, gain = self.path_powers(freq)
+        total = np.bincount(idx, gain, self.n_points)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # delays are measured from first path, so squares don't lose precision
+            first = np.full(self.n_points, np.inf)
+            np.minimum.at(first, idx, delay)
+            excess = delay - first[idx]
+            mean = np.bincount(idx, gain*excess, self.n_points) / total
+            mean_square = np.bincount(idx, gain*excess**2, self.n_points) / total
+            return np.where(total > 0, np.sqrt(np.maximum(mean_square - mean**2, 0)), np.nan)
+
+
+def trace_paths(transmitter: Transmitter,
+                walls: list[Wall],
+                points: np.ndarray,
+                order: int = COVERAGE_ORDER,
+                diffraction: bool = True,
+                tree: ImageTree | None = None) -> PathSet:
+    """
+    Finds paths from transmitter to points, see coverage.coverage_field for description of used methods.
+
+    Args:
+        transmitter: source of radiation
+        walls: list of walls on scene
+        points: array of shape (P, 2) with endpoints
+        order: max number of reflections
+        diffraction: if True, diffraction edges are prepared for NLOS points
+        tree: image tree of transmitter built for the same walls and order, created when not given
+
+    Returns:
+        paths that can be evaluated at any frequency
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    segments = pack_walls(walls)[:, 0:4]
+    if order > 0 and tree is None:
+        tree = ImageTree(transmitter, walls, order)
+    sequences = [node.sequence for node in tree.nodes] if order > 0 else [()]
+
+    idx, amplitude, length, departure, arrival, node = list(), list(), list(), list(), list(), list()
+    for i, sequence in enumerate(sequences):
+        path_idx, alpha, dist, path_points = reflection_paths(transmitter, [walls[j] for j in sequence], points,
+                                                              segments)
+        idx.append(path_idx)
+        amplitude.append(alpha/dist)
+        length.append(dist)
+        departure.append(direction_angle(path_points[1] - path_points[0]))
+        arrival.append(direction_angle(path_points[-2] - path_points[-1]))
+        node.append(np.full(len(path_idx), i))
+
+    nlos = np.setdiff1d(np.arange(len(points)), idx[0])
+    edges, visibility = None, None
+    if diffraction:
+        edges = visible_edges(transmitter, segments)
+        visibility = edge_visibility(edges, points[nlos], segments)
+    return PathSet(transmitter, len(points), np.concatenate(idx), np.concatenate(amplitude), np.concatenate(length),
+                   np.concatenate(departure), np.concatenate(arrival), np.concatenate(node), sequences, segments,
+                   nlos, points[nlos], edges, visibility)
+
+
+def direction_angle(vectors: np.ndarray) -> np.ndarray:
+    """
+    Angles of vectors (N, 2) measured from x axis, in [rad] in range [-pi, pi].
+    """
+    return np.arctan2(vectors[:, 1], vectors[:, 0])
@@ -1,7 +1,8 @@
 from collections import namedtuple
 import math
-from globals import USE_TM
-from geometrics import vec_vec_angle
+import warnings
+import numpy as np
+from globals import USE_TM, REFLECTION_TABLE_TOLERANCE, REFLECTION_TABLE_MAX_SIZE
 
 Material = namedtuple("Material", ["name",  # name of material
                                    "alpha",  # custom values of reflection coefficient
@@ -10,10 +11,24 @@ Material = namedtuple("Material", ["name",  # name of material
                                    ])
 
 
+# row of WallStore - coordinates and normal vector are first, so they can be read as one (N, 6) float array
+WALL_DTYPE = np.dtype([("points", float, (4,)),  # x1, y1, x2, y2
+                       ("normal", float, (2,)),  # normalized normal vector
+                       ("length", float),
+                       ("width", float),
+                       ("material", np.int32)  # index of material in WallStore.materials
+                       ], align=True)
+# parameters of Wall stored in rows of WallStore
+WALL_ATTRIBUTES = ("points", "normal", "length", "width", "material")
+
+
 class Wall:
     """
     Class representing simple 1 dimensional wall on 2D space. Thickness is not represented on screen, but it can be
-    simulated through properties of wall
+    simulated through properties of wall.
+    Wall appended to WallStore is a view of one row of store. Parameters are kept in plain attributes too, so pure
+    Python code reads them without touching the array, assigned values are written through to row of store (rows of
+    store must only be edited through Wall views). Views of existing rows read attributes from row on first use.
 
     Args:
         point1(int, int): x and y coordinates of first point of wall.
@@ -21,6 +36,7 @@ class Wall:
         graph_id: id of line object in pysimplegui graph
         material(props.Material): Material object describing wall parameters
     """
+    __slots__ = ("_store", "_idx", "graph_id", "points", "normal", "length", "width", "material")
 
     def __init__(self,
                  point1: tuple[int, int],
@@ -28,11 +44,76 @@ class Wall:
                  graph_id,
                  material: Material,
                  width: float = 1):
-        self.points: tuple[int, int, int, int] = (*point1, *point2)
-        self.material = material
-        self.graph_id = graph_id
-        self.width = width
-        self.normal = self.calc_normal()
+        # standalone wall, attributes are set directly without writing through to store
+        set_attribute = object.__setattr__
+        set_attribute(self, "_store", None)
+        set_attribute(self, "_idx", -1)
+        set_attribute(self, "graph_id", graph_id)
+        self.points = (*point1, *point2)
+        set_attribute(self, "width", float(width))
+        set_attribute(self, "material", material)
+
+    @classmethod
+    def view(cls,
+             store: "WallStore",
+             idx: int,
+             graph_id=None) -> "Wall":
+        """
+        Creates view of existing row of store.
+        """
+        wall = cls.__new__(cls)
+        set_attribute = object.__setattr__
+        set_attribute(wall, "_store", store)
+        set_attribute(wall, "_idx", idx)
+        set_attribute(wall, "graph_id", graph_id)
+        return wall
+
+    def __getattr__(self, name: str):
+        # called only for parameters of view that weren't read yet
+        if name not in WALL_ATTRIBUTES or self._store is None:
+            raise AttributeError(name)
+        value = self._store._data[self._idx][name]
+        if name == "material":
+            value = self._store.materials[value]
+        elif name in ("points", "normal"):
+            value = tuple(value.tolist())
+        else:
+            value = float(value)
+        object.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name: str, value):
+        if name not in WALL_ATTRIBUTES:
+            object.__setattr__(self, name, value)
+        elif name == "points":
+            # normal vector and length follow points
+            object.__setattr__(self, "points", tuple(float(p) for p in value))
+            object.__setattr__(self, "normal", self.calc_normal())
+            object.__setattr__(self, "length", math.sqrt((value[2] - value[0])**2 + (value[3] - value[1])**2))
+            if self._store is not None:
+                row = self._store._data[self._idx]
+                row["points"], row["normal"], row["length"] = self.points, self.normal, self.length
+        else:
+            object.__setattr__(self, name, value)
+            if self._store is not None:
+                self._store._data[self._idx][name] = self._store.material_index(value) if name == "material" \
+                    else value
+
+    def load(self):
+        """
+        Reads all parameters that weren't read yet from row of store.
+        """
+        for name in WALL_ATTRIBUTES:
+            getattr(self, name)
+
+    def row(self) -> np.ndarray:
+        """
+        Returns WALL_DTYPE row with parameters of wall, material column is not set.
+        """
+        row = np.zeros((), WALL_DTYPE)
+        row["points"], row["normal"], row["length"], row["width"] = self.points, self.normal, self.length, \
+            self.width
+        return row
 
     def calc_normal(self) -> tuple[float, float]:
         """
@@ -42,8 +123,9 @@ class Wall:
         Return:
             Normal vector of given wall.
         """
-        dx = self.points[0] - self.points[2]
-        dy = self.points[1] - self.points[3]
+        points = self.points
+        dx = points[0] - points[2]
+        dy = points[1] - points[3]
         n = (-dy, dx)
         n_len = math.sqrt(n[0]**2 + n[1]**2)
         n = (n[0]/n_len, n[1]/n_len)  # normalize
@@ -54,25 +136,228 @@ class Wall:
     def reflection_coefficient(self,
                                vec: tuple[float, float]):
         """
-        Calculates reflection coefficient for given vector of incidence
+        Calculates reflection coefficient for given vector of incidence. Value is taken from reflection table
+        of wall's material.
 
         """
-        if self.material.custom_alpha:
-            return self.material.alpha
+        material = self.material
+        if material.custom_alpha:
+            return material.alpha
 
-        # because angle between vectors is angle when vectors are connected with tails and with ray reflection
-        # ray vector is connected with normal vector head to tail we need to substract result from pi
-        theta = math.pi - vec_vec_angle(vec, self.normal)
+        # theta is angle between reversed vector of incidence and normal, so cos(theta) comes from dot product
+        # with sign dropped - normal vector may point to either side of wall
+        nx, ny = self.normal
+        cos_theta = abs(vec[0]*nx + vec[1]*ny) / math.sqrt(vec[0]**2 + vec[1]**2)
+        return reflection_table(material).lookup_scalar(cos_theta)
 
-        if USE_TM:
-            r = (self.material.eta * math.cos(theta) - math.sqrt(self.material.eta - math.sin(theta)**2)) \
-                / (self.material.eta * math.cos(theta) + math.sqrt(self.material.eta - math.sin(theta)**2))
+    def reflection_coefficient_array(self,
+                                     vecs: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of reflection_coefficient for many vectors of incidence at once.
 
-        else:
-            r = (math.cos(theta) - math.sqrt(self.material.eta - math.sin(theta)**2)) \
-                / (math.cos(theta) + math.sqrt(self.material.eta - math.sin(theta)**2))
+        Args:
+            vecs: array of shape (P, 2) with vectors of incidence
+
+        Returns:
+            array of shape (P,) with reflection coefficients
+        """
+        material = self.material
+        if material.custom_alpha:
+            return np.full(len(vecs), float(material.alpha))
+
+        nx, ny = self.normal
+        cos_theta = np.abs(vecs[:, 0]*nx + vecs[:, 1]*ny) / np.sqrt((vecs**2).sum(axis=1))
+        return reflection_table(material).lookup(cos_theta)
+
+
+class WallStore:
+    """
+    Columnar storage of walls. Parameters of all walls are kept in one NumPy structured array (WALL_DTYPE), so
+    vectorized kernels can read them without touching Wall objects. Store behaves like list of Wall views, so it can
+    be used wherever list of walls was used. Wall belongs to at most one store, appending standalone wall copies its
+    parameters to new row, removed wall keeps them as plain attributes.
+
+    Args:
+        walls: standalone walls to be added
+        capacity: initial number of rows, array grows when needed
+    """
+    def __init__(self,
+                 walls: list[Wall] = (),
+                 capacity: int = 16):
+        self._data = np.zeros(max(capacity, 1), WALL_DTYPE)
+        self._views: list[Wall] = list()
+        self.materials: list[Material] = list()
+        for wall in walls:
+            self.append(wall)
+
+    @classmethod
+    def from_array(cls,
+                   data: np.ndarray,
+                   materials: list[Material]) -> "WallStore":
+        """
+        Creates store directly on existing array of WALL_DTYPE rows (e.g. memory-mapped file), without copying it.
+        Material column holds indexes into materials. Array is replaced by in-memory copy once store has to grow.
+        """
+        store = cls(capacity=0)
+        store._data = data
+        store.materials = list(materials)
+        view = Wall.view
+        store._views = [view(store, idx) for idx in range(len(data))]
+        return store
+
+    @property
+    def data(self) -> np.ndarray:
+        """
+        Structured array with rows of all walls in store (without unused capacity).
+        """
+        return self._data[:len(self._views)]
+
+    @property
+    def packed(self) -> np.ndarray:
+        """
+        Zero-copy (N, 6) float view of (x1, y1, x2, y2, nx, ny) columns, same layout as ray.pack_walls.
+        """
+        packed = np.ndarray((len(self._views), 6), dtype=float, buffer=self._data, strides=(WALL_DTYPE.itemsize, 8))
+        packed.flags.writeable = False  # walls are edited through Wall views
+        return packed
+
+    def material_index(self, material: Material) -> int:
+        if material not in self.materials:
+            self.materials.append(material)
+        return self.materials.index(material)
+
+    def add(self,
+            point1: tuple[float, float],
+            point2: tuple[float, float],
+            material: Material,
+            width: float = 1,
+            graph_id=None) -> Wall:
+        """
+        Creates new wall directly in store, same as appending new Wall.
+        """
+        wall = Wall(point1, point2, graph_id, material, width)
+        self.append(wall)
+        return wall
+
+    def append(self, wall: Wall):
+        if wall._store is not None:
+            raise ValueError("Wall already belongs to other store")
+        idx = len(self._views)
+        if idx >= len(self._data):
+            self._data = np.concatenate((self._data, np.zeros(max(len(self._data), 1), WALL_DTYPE)))
+        row = wall.row()
+        row["material"] = self.material_index(wall.material)
+        self._data[idx] = row
+        # plain attributes are dropped to save memory, they are read from row again when needed
+        for name in WALL_ATTRIBUTES:
+            object.__delattr__(wall, name)
+        object.__setattr__(wall, "_store", self)
+        object.__setattr__(wall, "_idx", idx)
+        self._views.append(wall)
 
-        return r
+    def extend(self, walls: list[Wall]):
+        for wall in walls:
+            self.append(wall)
+
+    def remove(self, wall: Wall):
+        """
+        Removes wall from store, wall keeps its parameters as standalone wall. Rows and indices of all following
+        walls are shifted, so removal is O(N) - a few milliseconds for 20 000 walls.
+        """
+        idx = self.index(wall)
+        wall.load()
+        count = len(self._views)
+        self._data[idx:count - 1] = self._data[idx + 1:count]
+        del self._views[idx]
+        set_index = object.__setattr__
+        for i in range(idx, count - 1):
+            set_index(self._views[i], "_idx", i)
+        wall._store, wall._idx = None, -1
+
+    def clear(self):
+        for wall in self._views[::-1]:
+            self.remove(wall)
+
+    def index(self, wall: Wall) -> int:
+        if wall._store is not self:
+            raise ValueError("Wall is not in store")
+        return wall._idx
+
+    def __contains__(self, wall: Wall) -> bool:
+        return wall._store is self
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __getitem__(self, key):
+        return self._views[key]
+
+
+class ReflectionTable:
+    """
+    Precomputed Fresnel reflection coefficients of material on uniform grid of cosine of incidence angle.
+    Values between grid points are linearly interpolated. Grid is refined until analytical bound of interpolation
+    error (see interpolation_error_bound) is not greater than tolerance, the bound is kept in max_error. When even
+    REFLECTION_TABLE_MAX_SIZE points are not enough (permittivity very close to 1), RuntimeWarning is issued and
+    exact coefficients are calculated instead of table lookups, max_error is then 0.
+
+    Args:
+        eta: relative permittivity of material
+        tm: if True table is calculated for TM wave, else for TE
+        tolerance: max allowed absolute error of interpolated coefficient
+    """
+    def __init__(self,
+                 eta: float,
+                 tm: bool = USE_TM,
+                 tolerance: float = REFLECTION_TABLE_TOLERANCE):
+        self.eta = eta
+        self.tm = tm
+        size = 65
+        while True:
+            grid = np.linspace(0, 1, size)
+            error = interpolation_error_bound(eta, grid, tm)
+            if error <= tolerance or size >= REFLECTION_TABLE_MAX_SIZE:
+                break
+            size = 2 * (size - 1) + 1
+
+        self.exact = not error <= tolerance
+        if self.exact:
+            warnings.warn(f"Reflection table for eta={eta} doesn't reach tolerance {tolerance} with "
+                          f"{REFLECTION_TABLE_MAX_SIZE} points, exact coefficients are used", RuntimeWarning)
+            error = 0
+        self.values = fresnel_coefficient(eta, grid, tm)
+        self.max_error = float(error)
+        # plain list is faster than numpy array for single lookups
+        self._values_list = self.values.tolist()
+        self._last = size - 1
+
+    def lookup(self, cos_theta: np.ndarray) -> np.ndarray:
+        """
+        Returns interpolated coefficients for array of cosines of incidence angle (0 - grazing, 1 - normal).
+        """
+        if self.exact:
+            return fresnel_coefficient(self.eta, np.clip(cos_theta, 0, 1), self.tm)
+        position = np.clip(cos_theta, 0, 1) * self._last
+        idx = np.minimum(position.astype(int), self._last - 1)
+        fraction = position - idx
+        return self.values[idx] + fraction * (self.values[idx + 1] - self.values[idx])
+
+    def lookup_scalar(self, cos_theta: float) -> float:
+        """
+        Same as lookup, for single value from 0 to 1. Written with plain Python operations, because numpy
+        overhead is larger than the calculation itself for single values.
+        """
+        if self.exact:
+            return float(fresnel_coefficient(self.eta, cos_theta, self.tm))
+        position = cos_theta * self._last
+        idx = int(position)
+        if idx >= self._last:
+            return self._values_list[-1]
+        values = self._values_list
+        return values[idx] + (position - idx) * (values[idx + 1] - values[idx])
 
 
 class Transmitter:
@@ -86,6 +371,8 @@ class Transmitter:
          power: power value of transmitter in Watts
          freq: frequency of generated wave in Hertz
     """
+    __slots__ = ("point", "power", "graph_id", "freq", "lam")
+
     def __init__(self,
                  point: tuple[float, float],
                  graph_id: int,
@@ -106,8 +393,80 @@ class Receiver:
              point: (x, y) coordinates of receiver(represented as point)
              graph_id: id of PySimpleGUI point on graph
     """
+    __slots__ = ("point", "graph_id")
+
     def __init__(self,
                  point: tuple[float, float],
                  graph_id: int):
         self.point = point
         self.graph_id = graph_id
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+# reflection tables shared by all walls, key is (eta, polarization)
+_reflection_tables: dict[tuple[float, bool], ReflectionTable] = dict()
+
+
+def fresnel_coefficient(eta: float,
+                        cos_theta: np.ndarray,
+                        tm: bool = USE_TM) -> np.ndarray:
+    """
+    Exact Fresnel reflection coefficient for array of cosines of incidence angle.
+
+    Args:
+        eta: relative permittivity of material
+        cos_theta: cosines of incidence angle, angle is measured from normal of wall
+        tm: if True coefficient is calculated for TM wave, else for TE
+    """
+    # eta - sin^2, written without 1 - cos^2 which loses precision near grazing incidence
+    root = np.sqrt((eta - 1) + cos_theta**2)
+    if tm:
+        numerator, denominator = eta * cos_theta - root, eta * cos_theta + root
+    else:
+        numerator, denominator = cos_theta - root, cos_theta + root
+    # denominator is 0 only for eta = 1 at grazing incidence, where coefficient is 0 as for all other angles
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator == 0, 0, numerator / denominator)
+
+
+def interpolation_error_bound(eta: float,
+                              grid: np.ndarray,
+                              tm: bool = USE_TM) -> float:
+    """
+    Upper bound of error of linear interpolation of fresnel_coefficient between points of grid (sorted cosines of
+    incidence angle). On every interval [a, b] error is at most (b - a)^2 / 8 * max|f''|, where |f''| is bounded
+    by its closed form with every factor taken at the interval end where it is largest:
+
+    TE: |f''| = 2e (2r + c) / ((r + c)^2 r^3)
+    TM: |f''| = 2 eta e (3c / (r^5 (1 + eta u)^2) + 2 eta e / (r^6 (1 + eta u)^3))
+
+    with e = eta - 1, r = sqrt(e + c^2) and u = c / r, which all grow with c. Returns inf for eta < 1, where
+    coefficient is complex below critical angle and can't be tabulated.
+    """
+    e = eta - 1
+    if e == 0:
+        return 0.0  # coefficient is 0 for all angles
+    if e < 0:
+        return np.inf
+    a, b = grid[:-1], grid[1:]
+    ra, rb = np.sqrt(e + a**2), np.sqrt(e + b**2)
+    if tm:
+        ua = a / ra
+        second = 2*eta*e * (3*b / (ra**5 * (1 + eta*ua)**2) + 2*eta*e / (ra**6 * (1 + eta*ua)**3))
+    else:
+        second = 2*e * (2*rb + b) / ((ra + a)**2 * ra**3)
+    return float(((b - a)**2 / 8 * second).max())
+
+
+def reflection_table(material: Material,
+                     tm: bool = USE_TM) -> ReflectionTable:
+    """
+    Returns reflection table of material, table is created on first use.
+    """
+    key = (material.eta, tm)
+    table = _reflection_tables.get(key)
+    if table is None:
+        table = _reflection_tables[key] = ReflectionTable(material.eta, tm)
+    return table
@@ -1,10 +1,35 @@
 import math
 import cmath
+import numpy as np
+from collections import namedtuple
 
-from props import Transmitter, Wall
+from props import Transmitter, Wall, WallStore
+from spatial import WallGrid
+from visibility import VisibilityGraph
 from geometrics import intersection2, vec_normalize, point_point_distance, point_mirror_line, reflection_vec, \
-    point_on_line, point_line_distance
-from globals import SCENE_SIZE
+    point_on_line, point_line_distance, nearest_intersection, nearest_intersections, segments_blocked
+from globals import SCENE_SIZE, FAN_CHUNK_SIZE, FLOAT_ZERO, IMAGE_CACHE_SIZE, KERNEL_CHUNK_SIZE, \
+    TUBE_INITIAL_RAYS, TUBE_RESOLUTION, TUBE_MAX_DEPTH
+
+# scene edges used as ray terminators, same layout as packed walls endpoints
+SCENE_BOUNDARIES = np.array([(0, 0, SCENE_SIZE[0], 0),
+                             (0, 0, 0, SCENE_SIZE[1]),
+                             (SCENE_SIZE[0], 0, SCENE_SIZE[0], SCENE_SIZE[1]),
+                             (0, SCENE_SIZE[1], SCENE_SIZE[0], SCENE_SIZE[1])], dtype=float)
+
+# transmitter images cache used by transmitter_images function
+_image_cache: dict[tuple, list[tuple[float, float]]] = dict()
+
+FanPaths = namedtuple("FanPaths", ["points",  # (M, AP+1, 2) array, transmitter point followed by reflection points
+                                   "walls",  # (M, AP) array of indices of reflecting walls, -1 for scene boundary
+                                   "lengths"  # (M,) array with number of valid points after transmitter point
+                                   ])
+
+RayTubes = namedtuple("RayTubes", ["angles",  # (M,) array with launch angles of central rays in [rad]
+                                   "half_widths",  # (M,) array with angular half-widths of tubes in [rad]
+                                   "depths",  # (M,) array with number of splits of every tube
+                                   "fan"  # FanPaths of central rays
+                                   ])
 
 
 class Ray:
@@ -23,70 +48,55 @@ class Ray:
         self.forced_reflection_walls = list()
         self.graph_ids = list()
 
-    def propagate(self, walls: list[Wall]):
+    def propagate(self,
+                  walls: list[Wall],
+                  grid: WallGrid | None = None,
+                  visibility: VisibilityGraph | None = None):
         """
         Calculates path that ray will take with given AP value. Saves all reflection points in reflections_list.
         No power values are calculated.
 
         Args:
             walls: list of walls on which ray can be reflected.
+            grid: optional spatial index of walls. If given, only walls from cells crossed by ray are tested.
+            visibility: optional visibility graph of walls. If given, after reflection only walls seen by reflecting
+                wall are tested (grid is then used only for the first segment).
         """
-        # points that defines ray's line
+        # packed once, so every bounce is a single vectorized call over all walls
+        packed_walls = pack_walls(walls) if grid is None or visibility is not None else None
+        candidates = None
         point1 = self.transmitter.point
-        point2 = (point1[0]+self.vec[0], point1[1]+self.vec[1])
         # copy for restoration after calculations
         initial_ap = self.ap
         initial_vec = self.vec
 
         while self.ap > 0:
-            intersections = list()
-            for wall in walls:
-                # wall's line direction vector
-                wall_dx = wall.points[0] - wall.points[2]
-                wall_dy = wall.points[1] - wall.points[3]
-                # check for parallel lines
-                if wall_dx == self.vec[0] and wall_dy == self.vec[1]:
-                    continue
-                # calculate intersection and check if result is placed on wall
-                intersection = intersection2((*point1, *point2), wall.points)
-                if intersection and check_on_wall(wall, intersection):
-                    intersections.append((intersection, wall))
-
-            # check if points are in desired direction
-            intersections = [i for i in intersections if check_direction(self.vec, point1, i[0])]
-
-            if intersections:
+            if grid is None or candidates is not None:
+                if candidates is None:
+                    idx, intersection = nearest_intersection(point1, self.vec, packed_walls[:, 0:4])
+                else:
+                    idx, intersection = nearest_intersection(point1, self.vec, packed_walls[candidates, 0:4])
+                    idx = candidates[idx] if idx is not None else None
+                wall = walls[idx] if idx is not None else None
+            else:
+                wall, intersection = grid.nearest_intersection(point1, self.vec)
+                idx = walls.index(wall) if wall is not None and visibility is not None else None
+
+            if wall is not None:
                 self.ap -= 1
-                # sort results and add closest from last reflection point to reflections_list
-                if len(intersections) > 1:
-                    # avoid unnecesary sorting
-                    intersections = sorted(intersections, key=lambda i: point_point_distance(point1, i[0]))
-                self.reflections_list.append(intersections[0])
+                self.reflections_list.append((intersection, wall))
+                if visibility is not None:
+                    candidates = visibility.seen_walls(idx)
 
-                # calculate new ray vector and update point1 & point2
-                self.vec = reflection_vec(self.vec, intersections[0][1].normal)
-                point1 = intersections[0][0]
-                point2 = (point1[0] + self.vec[0], point1[1] + self.vec[1])
+                # calculate new ray vector and update starting point
+                self.vec = reflection_vec(self.vec, wall.normal)
+                point1 = intersection
 
             # no wall found for reflection. End ray on scene boundary.
             else:
-                boundaries = [(0, 0, SCENE_SIZE[0], 0),
-                              (0, 0, 0, SCENE_SIZE[1]),
-                              (SCENE_SIZE[0], 0, SCENE_SIZE[0], SCENE_SIZE[1]),
-                              (0, SCENE_SIZE[1], SCENE_SIZE[0], SCENE_SIZE[1])]
-                for edge in boundaries:
-                    wall_dx = edge[0] - edge[2]
-                    wall_dy = edge[1] - edge[3]
-                    # check for parallel lines
-                    if wall_dx == self.vec[0] and wall_dy == self.vec[1]:
-                        continue
-                    # calculate intersection and check if result is placed on wall
-                    intersection = intersection2((*point1, *point2), edge)
-                    if intersection and point_on_line(edge, intersection):
-                        intersections.append((intersection, None))
-                # there should be only one result
-                intersections = [i for i in intersections if check_direction(self.vec, point1, i[0])]
-                self.reflections_list.append(intersections[0])
+                _, intersection = nearest_intersection(point1, self.vec, SCENE_BOUNDARIES)
+                if intersection is not None:
+                    self.reflections_list.append((intersection, None))
                 break
 
         # restore initial parameters
@@ -108,21 +118,19 @@ class Ray:
             self.reflections_list = [(endpoint, None)]
             return
 
-        points = [endpoint]
-        # create list of mirrored point starting from endpoint towards transmitter
-        for wall in walls[::-1]:
-            points.append(point_mirror_line(wall.points, points[-1]))
+        # transmitter images depend only on transmitter and walls, so they are taken from cache
+        images = transmitter_images(self.transmitter, walls)
 
-        # calculate first reflection point from transmitter
-        points = points[::-1]
-        reflections = [self.transmitter.point]
-        for point, wall in zip(points, walls):
-            new_point = intersection2(wall.points, (*point, *reflections[-1]))
+        # calculate reflection points starting from endpoint towards transmitter
+        reflections = [endpoint]
+        for image, wall in zip(images[:0:-1], walls[::-1]):
+            new_point = intersection2(wall.points, (*image, *reflections[-1]))
             if new_point and not check_on_wall(wall, new_point):
                 return
             reflections.append(new_point)
 
-        self.reflections_list = [(p, w) for p, w in zip(reflections[1:], walls)]
+        reflections = reflections[::-1]
+        self.reflections_list = [(p, w) for p, w in zip(reflections[:-1], walls)]
         self.reflections_list.append((endpoint, None))
 
     def get_dist_coef(self, dist: float) -> tuple[complex, bool]:
@@ -166,11 +174,11 @@ class Ray:
         path = alpha/dist * cmath.exp(-2j*math.pi*self.transmitter.freq*dist/3e8)
         return path, True
 
-    def get_dist_coef_array(self, step: float) -> list[complex]:
+    def get_dist_coef_array(self, step: float) -> np.ndarray:
         """
             Method that returns array of distance coefficients of ray. Array covers distance from start
-            to end of the ray with 'step' change in distance. Propagate method must be called beforehand else empty list
-            will be returned.
+            to end of the ray with 'step' change in distance. Propagate method must be called beforehand else empty array
+            will be returned. First element is always 1 (coefficient at transmitter).
             Multiply module squared of this coefficient times reference power gives actual power value.
 
            Args:
@@ -181,35 +189,50 @@ class Ray:
        """
         # check if ray has propagation list filled
         if not self.reflections_list:
-            return list()
+            return np.array([], dtype=complex)
 
-        alpha = 1
-        dist_sum = step
-        dist_threshold = point_point_distance(self.transmitter.point, self.reflections_list[0][0])
-        ref_idx = 0
-        dist_coefs = [1]
-        # current path segment vector for alpha calculation
-        # reflection_list is list of pairs(point, Wall) so there is chosen first_pair -> point -> point element
-        current_vector = (self.reflections_list[0][0][0] - self.transmitter.point[0],
-                          self.reflections_list[0][0][1] - self.transmitter.point[1])
-        while True:
-            if dist_sum > dist_threshold:
-                ref_idx += 1
-                if ref_idx >= len(self.reflections_list):
-                    break
-                else:
-                    dist_threshold += point_point_distance(self.reflections_list[ref_idx - 1][0],
-                                                           self.reflections_list[ref_idx][0])
-                    alpha *= self.reflections_list[ref_idx-1][1].reflection_coefficient(current_vector)
-                    current_vector = (self.reflections_list[ref_idx][0][0] - self.reflections_list[ref_idx-1][0][0],
-                                      self.reflections_list[ref_idx][0][1] - self.reflections_list[ref_idx-1][0][1])
+        chunks = [coefs for _, coefs in self.iter_dist_coef_array(step)]
+        return np.concatenate([np.ones(1, dtype=complex), *chunks])
+
+    def iter_dist_coef_array(self, step: float, chunk_size: int = KERNEL_CHUNK_SIZE):
+        """
+            Streaming version of get_dist_coef_array for very long paths. Coefficients are calculated in chunks,
+            so memory usage doesn't depend on length of path. Leading 1 is not included.
+
+           Args:
+               step: distance from transmitter where power will be calculated.
+               chunk_size: number of coefficients in one chunk
 
-            # calculate coefficient
-            coef = alpha / dist_sum * cmath.exp(-2j * math.pi * self.transmitter.freq * dist_sum / 3e8)
-            dist_coefs.append(coef)
-            dist_sum += step
+           Yields:
+               (distances, coefficients) arrays of up to chunk_size elements
+       """
+        if not self.reflections_list:
+            return
+
+        bounds, alphas = self.get_segments()
+        count = int(bounds[-1] // step)
+        for start in range(1, count + 1, chunk_size):
+            dist = step * np.arange(start, min(start + chunk_size, count + 1))
+            # index of path segment for every distance, segment changes when distance is greater than its end
+            alpha = alphas[np.searchsorted(bounds, dist, side="left")]
+            yield dist, alpha / dist * np.exp(-2j * np.pi * self.transmitter.freq * dist / 3e8)
+
+    def get_segments(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Method that returns cumulative distance at end of each path segment and product of reflection coefficients
+        valid on each segment. Propagate method must be called beforehand.
 
-        return dist_coefs
+        Returns:
+            (bounds, alphas) arrays, both with one element per path segment
+        """
+        points = np.array([self.transmitter.point, *(point for point, _ in self.reflections_list)], dtype=float)
+        vectors = np.diff(points, axis=0)
+        bounds = np.cumsum(np.sqrt((vectors**2).sum(axis=1)))
+        alphas = [1]
+        # reflection coefficient depends on vector of incidence - segment that ends on wall
+        for (_, wall), vector in zip(self.reflections_list[:-1], vectors[:-1]):
+            alphas.append(alphas[-1] * wall.reflection_coefficient(tuple(vector)))
+        return bounds, np.array(alphas)
 
     def get_power_ref(self):
         """
@@ -222,11 +245,14 @@ class Ray:
         """
         return self.transmitter.power * (self.transmitter.lam / (4 * math.pi)) ** 2
 
-    def get_coef_at_end(self) -> complex | None:
+    def get_coef_at_end(self, freq: float | None = None) -> complex | None:
         """
                 Method that returns distance coefficient at the end of ray. Propagate method must be called beforehand.
                 Multiply module squared of this coefficient times reference power gives actual power value.
 
+                Args:
+                    freq: frequency in [Hz], by default frequency of ray's transmitter
+
                 Returns:
                     Distance coefficient as complex number.
         """
@@ -246,12 +272,14 @@ class Ray:
                               self.reflections_list[i][0][1] - self.reflections_list[i-1][0][1])
             dist_sum += point_point_distance(self.reflections_list[i][0], self.reflections_list[i-1][0])
 
-        return alpha/dist_sum * cmath.exp(-2j*math.pi*self.transmitter.freq*dist_sum/3e8)
+        freq = self.transmitter.freq if freq is None else freq
+        return alpha/dist_sum * cmath.exp(-2j*math.pi*freq*dist_sum/3e8)
 
     def get_diffraction(self,
                         diff_point: tuple[float, float],
                         endpoint: tuple[float, float],
-                        walls: list[Wall]) -> (complex, float):
+                        walls: list[Wall],
+                        grid: WallGrid | None = None) -> (complex, float):
         """
         Method that will calculate distance coefficient and additional attenuation from transmitter to given endpoint.
         If endpoint is in line-of-sight result will be the same to any get_coef method.
@@ -261,6 +289,7 @@ class Ray:
             diff_point: point where diffraction should happen
             endpoint: destination point for ray
             walls: list of walls that ray may collide with
+            grid: optional spatial index of walls, limits LOS check to walls near the direct path
 
         Returns:
             complex distance coefficient and additional attenuation in [dB]
@@ -268,6 +297,8 @@ class Ray:
         # check if endpoint is in LOS
         x0, y0 = self.transmitter.point
         x2, y2 = endpoint
+        if grid is not None:
+            walls = grid.walls_on_segment((x0, y0), (x2, y2))
         dx = x2 - x0
         dy = y2 - y0
         intersections = [(intersection2(wall.points, (x0, y0, x2, y2)), wall) for wall in walls]
@@ -294,6 +325,314 @@ class Ray:
 # ======================================================================================================================
 # Helper functions
 # ======================================================================================================================
+def pack_walls(walls: list[Wall] | WallStore) -> np.ndarray:
+    """
+    Packs walls into one contiguous array used by vectorized intersection kernels. WallStore already holds
+    walls in this layout, so its read-only view is returned without copying.
+
+    Args:
+        walls: list of Wall objects or WallStore
+
+    Returns:
+        array of shape (N, 6), each row is (x1, y1, x2, y2, nx, ny) - endpoints and normal vector of wall
+    """
+    if isinstance(walls, WallStore):
+        return walls.packed
+    packed = np.empty((len(walls), 6), dtype=float)
+    for i, wall in enumerate(walls):
+        packed[i, 0:4] = wall.points
+        packed[i, 4:6] = wall.normal
+    return packed
+
+
+def transmitter_images(transmitter: Transmitter,
+                       walls: list[Wall]) -> list[tuple[float, float]]:
+    """
+    Returns transmitter point followed by its images mirrored along walls in order of reflections. Results are cached,
+    key is made of transmitter and walls coordinates, so edited objects never get stale images. Cache should be
+    cleared with clear_image_cache after scene edits to free entries of old coordinates.
+
+    Args:
+        transmitter: source of paths
+        walls: walls that path reflects of, in order
+
+    Returns:
+        list of len(walls) + 1 points
+    """
+    key = (transmitter.point, tuple(wall.points for wall in walls))
+    images = _image_cache.get(key)
+    if images is None:
+        images = [transmitter.point]
+        for wall in walls:
+            images.append(point_mirror_line(wall.points, images[-1]))
+        if len(_image_cache) >= IMAGE_CACHE_SIZE:
+            _image_cache.clear()
+        _image_cache[key] = images
+    return images
+
+
+def clear_image_cache():
+    """
+    Removes all cached transmitter images. Should be called when wall or transmitter is edited or deleted.
+    """
+    _image_cache.clear()
+
+
+def reflection_path_coefs(transmitter: Transmitter,
+                          reflection_walls: list[Wall],
+                          points: np.ndarray,
+                          segments: np.ndarray | None = None) -> np.ndarray:
+    """
+    Vectorized image method. Calculates distance coefficients of paths from transmitter to many endpoints at once,
+    forced to reflect of each wall from reflection_walls in order (like Ray.propagate_to_point).
+    For endpoints without valid path coefficient is 0.
+
+    Args:
+        transmitter: source of paths
+        reflection_walls: walls that path must reflect of, in order. Empty list means direct path.
+        points: array of shape (P, 2) with endpoints
+        segments: (N, 4) array of walls endpoints. If given, path segments crossing any wall are invalid.
+
+    Returns:
+        array of shape (P,) with complex distance coefficients
+    """
+    idx, alpha, dist, _ = reflection_paths(transmitter, reflection_walls, points, segments)
+    coefs = np.zeros(len(points), dtype=complex)
+    coefs[idx] = alpha/dist * np.exp(-2j*np.pi*transmitter.freq*dist/3e8)
+    return coefs
+
+
+def reflection_paths(transmitter: Transmitter,
+                     reflection_walls: list[Wall],
+                     points: np.ndarray,
+                     segments: np.ndarray | None = None) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray, list[np.ndarray]]:
+    """
+    Geometry of paths found by reflection_path_coefs, which doesn't depend on frequency.
+
+    Returns:
+        indices (V,) of endpoints with valid path, products of reflection coefficients (V,), path lengths (V,) and
+        list of path points - arrays (V, 2) with transmitter, reflection points in order and endpoint
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    images = transmitter_images(transmitter, reflection_walls)
+
+    # trace reflection points back from endpoints towards transmitter
+    # arrays are compacted after each step, so only endpoints with still valid paths are processed
+    idx = np.arange(len(points))
+    path_points = [points]
+    for wall, image in zip(reflection_walls[::-1], images[:0:-1]):
+        current = path_points[-1]
+        x1, y1, x2, y2 = wall.points
+        dx = current[:, 0] - image[0]
+        dy = current[:, 1] - image[1]
+        ex, ey = x2 - x1, y2 - y1
+        denominator = dx*ey - dy*ex
+        parallel = np.abs(denominator) < FLOAT_ZERO
+        denominator = np.where(parallel, 1, denominator)
+        wx, wy = x1 - image[0], y1 - image[1]
+        t = (wx*ey - wy*ex) / denominator
+        u = (wx*dy - wy*dx) / denominator
+        # reflection point must be on wall and between image and current point
+        valid = ~parallel & (t > 0) & (t < 1) & (u >= 0) & (u <= 1)
+        idx = idx[valid]
+        path_points = [p[valid] for p in path_points]
+        path_points.append(np.stack((image[0] + t[valid]*dx[valid], image[1] + t[valid]*dy[valid]), axis=1))
+    path_points.append(np.broadcast_to(np.asarray(transmitter.point, dtype=float), path_points[0].shape))
+    path_points = path_points[::-1]
+
+    if segments is not None:
+        for i in range(len(path_points) - 1):
+            if not len(idx):
+                break
+            valid = ~segments_blocked(path_points[i], path_points[i+1], segments)
+            idx = idx[valid]
+            path_points = [p[valid] for p in path_points]
+
+    alpha = np.ones(len(idx))
+    for i, wall in enumerate(reflection_walls):
+        alpha *= wall.reflection_coefficient_array(path_points[i+1] - path_points[i])
+
+    dist = np.sqrt(((path_points[-1] - np.asarray(images[-1]))**2).sum(axis=1))
+    return idx, alpha, dist, path_points
+
+
+def propagate_fan(transmitter: Transmitter,
+                  vecs: np.ndarray,
+                  ap: int,
+                  walls: list[Wall],
+                  chunk_size: int = FAN_CHUNK_SIZE) -> FanPaths:
+    """
+    Batched version of Ray.propagate. Propagates many rays launched from one transmitter at once, keeping their
+    positions and directions in arrays. Rays are processed in chunks to limit memory used by intersection kernel.
+
+    Args:
+        transmitter: Transmitter that all rays start from
+        vecs: array of shape (M, 2) with initial directions of rays
+        ap: maximal number of reflections of each ray
+        walls: list of walls on which rays can be reflected
+        chunk_size: number of rays propagated together
+
+    Returns:
+        FanPaths with reflection points and reflecting walls of every ray. Unused entries are NaN for points
+        and -1 for walls.
+    """
+    vecs = np.asarray(vecs, dtype=float).reshape(-1, 2)
+    vecs = vecs / np.sqrt((vecs**2).sum(axis=1))[:, None]
+    m = len(vecs)
+    packed_walls = pack_walls(walls)
+
+    points = np.full((m, ap + 1, 2), np.nan)
+    points[:, 0] = transmitter.point
+    wall_ids = np.full((m, ap), -1)
+    lengths = np.zeros(m, dtype=int)
+
+    for start in range(0, m, chunk_size):
+        pos = points[start:start + chunk_size, 0].copy()
+        vec = vecs[start:start + chunk_size].copy()
+        # indices of rays (relative to chunk) that are still being reflected
+        active = np.arange(len(pos))
+
+        for bounce in range(ap):
+            idx, hits = nearest_intersections(pos[active], vec[active], packed_walls[:, 0:4])
+            hit = idx >= 0
+
+            # reflected rays - store results and calculate new positions and vectors
+            reflected = active[hit]
+            rows = start + reflected
+            points[rows, bounce + 1] = hits[hit]
+            wall_ids[rows, bounce] = idx[hit]
+            lengths[rows] = bounce + 1
+            # r = d - 2(d dot n)*n,  n->normalized
+            n = packed_walls[idx[hit], 4:6]
+            d = vec[reflected]
+            vec[reflected] = d - 2 * (d * n).sum(axis=1)[:, None] * n
+            pos[reflected] = hits[hit]
+
+            # no wall found for reflection. End rays on scene boundary.
+            missed = active[~hit]
+            if len(missed):
+                b_idx, b_hits = nearest_intersections(pos[missed], vec[missed], SCENE_BOUNDARIES)
+                on_boundary = b_idx >= 0
+                rows = start + missed[on_boundary]
+                points[rows, bounce + 1] = b_hits[on_boundary]
+                lengths[rows] = bounce + 1
+
+            active = reflected
+            if not len(active):
+                break
+
+    return FanPaths(points, wall_ids, lengths)
+
+
+def fan_reflections_list(fan: FanPaths,
+                         ray_idx: int,
+                         walls: list[Wall]) -> list[tuple[tuple[float, float], Wall | None]]:
+    """
+    Converts single ray of FanPaths into reflections_list format used by Ray class (e.g. for drawing).
+
+    Args:
+        fan: result of propagate_fan
+        ray_idx: index of ray in fan
+        walls: list of walls that was used for propagation
+
+    Returns:
+        list of (point, Wall) pairs, Wall is None for scene boundary
+    """
+    return [((float(point[0]), float(point[1])), walls[wall_idx] if wall_idx >= 0 else None)
+            for point, wall_idx in zip(fan.points[ray_idx, 1:fan.lengths[ray_idx] + 1],
+                                       fan.walls[ray_idx, :fan.lengths[ray_idx]])]
+
+
+def launch_tubes(transmitter: Transmitter,
+                 ap: int,
+                 walls: list[Wall],
+                 resolution: float = TUBE_RESOLUTION,
+                 distance: float | None = None,
+                 initial_rays: int = TUBE_INITIAL_RAYS,
+                 max_depth: int = TUBE_MAX_DEPTH,
+                 chunk_size: int = FAN_CHUNK_SIZE) -> RayTubes:
+    """
+    Adaptive version of propagate_fan. Every ray is central ray of tube - angular sector of launch directions. Tubes
+    start from few rays around transmitter and are traced level by level. Tube is split into equal parts when its
+    footprint (width across tube after unfolding reflections) exceeds resolution before end of path or given
+    distance, or when its footprint on reflecting wall is longer than wall, so part of tube misses it. Only tubes
+    that reach far or hit small walls become narrow, while uniform fan needs the narrowest width in all directions.
+
+    Args:
+        transmitter: Transmitter that all rays start from
+        ap: maximal number of reflections of each ray, at least 1 - tube footprint is measured along traced path
+        walls: list of walls on which rays can be reflected
+        resolution: max footprint of tube in scene units
+        distance: max unfolded path length where resolution is guaranteed, by default whole path
+        initial_rays: number of tubes of first level
+        max_depth: max number of times tube and its parts are split, tubes at this depth are kept as they are
+        chunk_size: number of rays propagated together
+
+    Returns:
+        RayTubes of final tubes ordered by launch angle
+    """
+    if ap < 1:
+        raise ValueError(f"Ray tubes need at least one traced segment, got ap={ap}")
+    packed_walls = pack_walls(walls)
+    half_widths = np.full(initial_rays, np.pi / initial_rays)
+    angles = (2*np.arange(initial_rays) + 1) * half_widths
+    depths = np.zeros(initial_rays, dtype=int)
+    tubes = list()
+
+    while len(angles):
+        fan = propagate_fan(transmitter, np.stack((np.cos(angles), np.sin(angles)), axis=1), ap, walls, chunk_size)
+        parts = np.where(depths < max_depth, tube_parts(fan, half_widths, packed_walls, resolution, distance), 1)
+        kept = parts == 1
+        tubes.append((angles[kept], half_widths[kept], depths[kept], fan.points[kept], fan.walls[kept],
+                      fan.lengths[kept]))
+
+        # split tubes are replaced by parts of equal width
+        parent = np.repeat(np.flatnonzero(~kept), parts[~kept])
+        part = np.arange(len(parent)) - np.repeat(np.cumsum(parts[~kept]) - parts[~kept], parts[~kept])
+        half_widths = half_widths[parent] / parts[parent]
+        angles = angles[parent] - half_widths*parts[parent] + (2*part + 1)*half_widths
+        depths = depths[parent] + 1
+
+    angles, half_widths, depths, points, wall_ids, lengths = (np.concatenate(column) for column in zip(*tubes))
+    order = np.argsort(angles, kind="stable")
+    return RayTubes(angles[order], half_widths[order], depths[order],
+                    FanPaths(points[order], wall_ids[order], lengths[order]))
+
+
+def tube_parts(fan: FanPaths,
+               half_widths: np.ndarray,
+               packed_walls: np.ndarray,
+               resolution: float,
+               distance: float | None = None) -> np.ndarray:
+    """
+    Calculates into how many parts every tube of fan has to be split, see launch_tubes.
+
+    Returns:
+        int array of shape (M,), 1 for tubes that are narrow enough
+    """
+    steps = fan.points[:, 1:] - fan.points[:, :-1]
+    step_lengths = np.nan_to_num(np.sqrt((steps**2).sum(axis=2)))
+    # unfolded distance from transmitter to every reflection point
+    unfolded = np.cumsum(step_lengths, axis=1)
+    reach = unfolded[:, -1] if distance is None else np.minimum(unfolded[:, -1], distance)
+    ratio = 2*half_widths*reach / resolution
+
+    reflected = fan.walls >= 0
+    if distance is not None:
+        reflected &= unfolded <= distance
+    rows, bounce = np.nonzero(reflected)
+    if len(rows):
+        walls = packed_walls[fan.walls[rows, bounce]]
+        wall_lengths = np.sqrt(((walls[:, 2:4] - walls[:, 0:2])**2).sum(axis=1))
+        cos_incidence = np.abs((steps[rows, bounce] * walls[:, 4:6]).sum(axis=1)) \
+            / np.maximum(step_lengths[rows, bounce], FLOAT_ZERO)
+        footprint = 2*half_widths[rows]*unfolded[rows, bounce] / np.maximum(cos_incidence, FLOAT_ZERO)
+        np.maximum.at(ratio, rows, footprint / np.maximum(wall_lengths, FLOAT_ZERO))
+    # small margin keeps parts from being split again because of rounding
+    return np.maximum(np.ceil(ratio * (1 + 1e-9)), 1).astype(int)
+
+
 def check_on_wall(wall: Wall,
                   point: tuple[float, float]) -> bool:
     """
@@ -330,31 +669,3 @@ def check_direction(vec: tuple[float, float],
             (vec[1] > 0 and new_point[1] > last_point[1] or
              vec[1] < 0 and new_point[1] < last_point[1] or
              vec[1] == 0 and new_point[1] == last_point[1]))
-
-
-def get_diffraction_power(ray: Ray,
-                          diff_point: tuple[float, float],
-                          endpoint: tuple[float, float],
-                          walls: list[Wall],
-                          mode: bool = False) -> float:
-    """
-    Wrapper for get_diffraction method of Ray class. Depend on mode will return distance coefficient or attenuation.
-
-    Args:
-        ray: Ray that will be propagated
-        diff_point: point where diffraction will take place
-        endpoint: point where ray should end
-        walls: list of wall that ray may collide with
-        mode: default is False
-
-    Returns:
-        if mode = True: Attenuation of just diffraction
-        else: Distance coefficient in linear form
-    """
-    coefficient, attenuation = ray.get_diffraction(diff_point, endpoint, walls)
-    if mode:  # [dB]
-        return attenuation
-
-    else:  # linear
-        a_linear = 10**(-attenuation/10)
-        return coefficient * a_linear
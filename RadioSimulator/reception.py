@@ -0,0 +1,213 @@
+from collections import namedtuple
+import numpy as np
+
+from props import Transmitter, Wall
+from ray import RayTubes, launch_tubes
+from spatial import PointGrid
+from globals import COVERAGE_ORDER, TUBE_RESOLUTION, KERNEL_CHUNK_SIZE, FLOAT_COMP, FLOAT_ZERO
+
+ReceivedPaths = namedtuple("ReceivedPaths", ["idx",  # (M,) index of receiver of every path
+                                             "sequences",  # (M, order) walls that path reflects of, padded with -1
+                                             "alpha",  # (M,) product of reflection coefficients
+                                             "length"  # (M,) path length - distance from transmitter image
+                                             ])
+
+
+def collect_paths(tubes: RayTubes,
+                  walls: list[Wall],
+                  points: np.ndarray,
+                  order: int = COVERAGE_ORDER,
+                  cell_size: float | None = None,
+                  chunk_size: int = KERNEL_CHUNK_SIZE) -> ReceivedPaths:
+    """
+    Shoot-and-bounce reception of ray tubes at many receivers in one pass. Every segment of central ray is tested
+    against receivers in cells of spatial hash (PointGrid) around it, receiver is reached by tube when it lies in
+    tube's reception circle - its distance from central ray is not greater than tube's half-width at unfolded
+    distance of receiver. Neighbouring tubes can reach the same receiver with the same sequence of walls, such paths
+    are equivalent and only the one closest to its central ray is kept.
+
+    Args:
+        tubes: result of launch_tubes with at least order + 1 reflections, otherwise part of rays after their
+            last reflection is missing
+        walls: list of walls used by launch_tubes
+        points: array of shape (P, 2) with receiver points
+        order: max number of reflections of collected paths
+        cell_size: side of spatial hash cell, by default mean spacing of receivers or twice the typical radius of
+            reception circles, whichever is larger
+        chunk_size: approximate max number of (segment, cell) pairs processed at once
+
+    Returns:
+        ReceivedPaths with unique paths of all receivers
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    fan = tubes.fan
+    n_rays, ap = fan.walls.shape
+    steps = fan.points[:, 1:] - fan.points[:, :-1]
+    step_lengths = np.sqrt((steps**2).sum(axis=2))
+    unfolded = np.concatenate((np.zeros((n_rays, 1)), np.cumsum(np.nan_to_num(step_lengths), axis=1)), axis=1)
+    alpha = reflection_products(fan.walls, steps, walls)
+
+    # segment k of ray goes from its k-th to (k+1)-th point, after k reflections
+    rays, k = np.nonzero(np.arange(min(order + 1, ap)) < fan.lengths[:, None])
+    start = fan.points[rays, k]
+    length = step_lengths[rays, k]
+    direction = steps[rays, k] / np.maximum(length, FLOAT_COMP)[:, None]
+    tangent = np.tan(tubes.half_widths[rays])
+    radius = tangent * unfolded[rays, k + 1]
+    if cell_size is None:
+        # cells hold a few receivers and are not much smaller than reception circles
+        spacing = np.sqrt(np.prod(np.ptp(points, axis=0)) / len(points)) if len(points) else 0
+        cell_size = max(2*np.median(radius) if len(radius) else 0, spacing)
+    grid = PointGrid(points, max(cell_size, FLOAT_COMP))
+
+    # approximate number of cells in band around every segment
+    pairs = (length / grid.cell_size + 2) * (2*radius / grid.cell_size + 3)
+
+    found = list()
+    cumulative = np.cumsum(pairs)
+    first = 0
+    while first < len(pairs):
+        last = max(int(np.searchsorted(cumulative, cumulative[first] - pairs[first] + chunk_size, side="right")),
+                   first + 1)
+        segments = np.arange(first, last)
+        first = last
+        segment, receiver = segment_receivers(grid, start[segments],
+                                              start[segments] + direction[segments] * length[segments, None],
+                                              radius[segments])
+        segment = segments[segment]
+        # position along segment and distance from central ray
+        rel = points[receiver] - start[segment]
+        t = (rel * direction[segment]).sum(axis=1)
+        offset = np.sqrt(np.maximum((rel**2).sum(axis=1) - t**2, 0))
+        distance = unfolded[rays[segment], k[segment]] + t
+        # receivers on border of neighbouring tubes are reached by both of them, duplicates are removed below
+        inside = (t >= 0) & (t < length[segment]) & (offset <= tangent[segment] * distance + FLOAT_ZERO)
+        found.append((segment[inside], receiver[inside], offset[inside], distance[inside]))
+
+    if found:
+        segment, receiver, offset, distance = (np.concatenate(column) for column in zip(*found))
+    else:
+        segment, receiver, offset, distance = np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+    sequences = np.where(np.arange(order) < k[segment, None], pad_walls(fan.walls, order)[rays[segment]], -1)
+
+    # equivalent paths - the same receiver and walls, path closest to central ray of its tube is the first one
+    closest = np.argsort(offset / np.maximum(tangent[segment] * distance, FLOAT_COMP), kind="stable")
+    _, unique = np.unique(np.column_stack((receiver, sequences))[closest], axis=0, return_index=True)
+    kept = np.sort(closest[unique])
+    return ReceivedPaths(receiver[kept], sequences[kept], alpha[rays[segment[kept]], k[segment[kept]]],
+                         np.sqrt(distance[kept]**2 + offset[kept]**2))
+
+
+def reception_field(paths: ReceivedPaths,
+                    freq: float,
+                    n_points: int) -> np.ndarray:
+    """
+    Sums complex distance coefficients of received paths at every receiver, same quantity as
+    coverage.coverage_field.
+
+    Returns:
+        array of shape (n_points,) with complex distance coefficients
+    """
+    coefs = paths.alpha / paths.length * np.exp(-2j*np.pi*freq*paths.length/3e8)
+    return np.bincount(paths.idx, coefs.real, n_points) + 1j*np.bincount(paths.idx, coefs.imag, n_points)
+
+
+def shoot_and_bounce_field(transmitter: Transmitter,
+                           walls: list[Wall],
+                           points: np.ndarray,
+                           order: int = COVERAGE_ORDER,
+                           resolution: float = TUBE_RESOLUTION) -> np.ndarray:
+    """
+    Calculates complex distance coefficients of direct path and reflections up to given order at many receivers
+    with one fan of adaptive ray tubes, alternative to image method of coverage.coverage_field.
+
+    Args:
+        transmitter: source of rays
+        walls: list of walls on scene
+        points: array of shape (P, 2) with receiver points
+        order: max number of reflections
+        resolution: max footprint of ray tubes, see ray.launch_tubes
+
+    Returns:
+        array of shape (P,) with complex distance coefficients
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    tubes = launch_tubes(transmitter, order + 1, walls, resolution)
+    return reception_field(collect_paths(tubes, walls, points, order), transmitter.freq, len(points))
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def segment_receivers(grid: PointGrid,
+                      start: np.ndarray,
+                      end: np.ndarray,
+                      radius: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds candidate receivers of segments - points of grid cells in band of given radius around every segment. Band
+    is rasterized column by column along longer axis of segment, so every cell is visited once.
+
+    Returns:
+        index of segment (M,) and index of receiver (M,)
+    """
+    a = (start - grid.origin) / grid.cell_size
+    b = (end - grid.origin) / grid.cell_size
+    r = radius / grid.cell_size
+    # steep segments are rasterized along y axis
+    steep = np.abs(b[:, 1] - a[:, 1]) > np.abs(b[:, 0] - a[:, 0])
+    a = np.where(steep[:, None], a[:, ::-1], a)
+    b = np.where(steep[:, None], b[:, ::-1], b)
+    low = np.minimum(a[:, 0], b[:, 0])
+    high = np.maximum(a[:, 0], b[:, 0])
+    slope = (b[:, 1] - a[:, 1]) / np.maximum(high - low, FLOAT_COMP) * np.sign(b[:, 0] - a[:, 0])
+    # vertical extent of band, at least radius at segment's ends
+    margin = r * np.sqrt(1 + slope**2)
+
+    first = np.floor(low - r).astype(np.int64)
+    columns = np.floor(high + r).astype(np.int64) - first + 1
+    column_segment = np.repeat(np.arange(len(a)), columns)
+    column = np.repeat(first, columns) + np.arange(columns.sum()) - np.repeat(np.cumsum(columns) - columns, columns)
+    # part of segment inside column (clipped to segment) gives range of rows
+    u1 = np.clip(column, low[column_segment], high[column_segment])
+    u2 = np.clip(column + 1, low[column_segment], high[column_segment])
+    v1 = a[column_segment, 1] + (u1 - a[column_segment, 0]) * slope[column_segment]
+    v2 = a[column_segment, 1] + (u2 - a[column_segment, 0]) * slope[column_segment]
+    row_low = np.floor(np.minimum(v1, v2) - margin[column_segment]).astype(np.int64)
+    rows = np.floor(np.maximum(v1, v2) + margin[column_segment]).astype(np.int64) - row_low + 1
+
+    cell_column = np.repeat(np.arange(len(column)), rows)
+    row = np.repeat(row_low, rows) + np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows)
+    cells = np.stack((column[cell_column], row), axis=1)
+    cells = np.where(steep[column_segment[cell_column], None], cells[:, ::-1], cells)
+    cell, receiver = grid.query(cells)
+    return column_segment[cell_column[cell]], receiver
+
+
+def reflection_products(wall_ids: np.ndarray,
+                        steps: np.ndarray,
+                        walls: list[Wall]) -> np.ndarray:
+    """
+    Products of reflection coefficients of rays before every segment.
+
+    Args:
+        wall_ids: array of shape (M, AP) with reflecting walls of rays, -1 for no reflection
+        steps: array of shape (M, AP, 2) with vectors of segments of rays, segment b ends in reflection b
+        walls: list of walls
+
+    Returns:
+        array of shape (M, AP + 1), value k is product of coefficients of first k reflections
+    """
+    coefficients = np.ones(wall_ids.shape)
+    for wall_idx in np.unique(wall_ids[wall_ids >= 0]):
+        rows, bounce = np.nonzero(wall_ids == wall_idx)
+        coefficients[rows, bounce] = walls[wall_idx].reflection_coefficient_array(steps[rows, bounce])
+    return np.concatenate((np.ones((len(wall_ids), 1)), np.cumprod(coefficients, axis=1)), axis=1)
+
+
+def pad_walls(wall_ids: np.ndarray, order: int) -> np.ndarray:
+    """
+    Returns first order columns of wall_ids, padded with -1 when rays have less reflections.
+    """
+    padded = np.full((len(wall_ids), order), -1)
+    padded[:, :min(order, wall_ids.shape[1])] = wall_ids[:, :order]
+    return padded
@@ -0,0 +1,155 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Callable
+import numpy as np
+
+from props import Wall, WallStore, Transmitter
+from globals import RESULT_CACHE_SIZE, RESULT_CACHE_DISK_SIZE
+
+
+class ResultCache:
+    """
+    Content-addressed cache of simulation results. Results are tuples of NumPy arrays stored under key created
+    by make_key, so any change of walls, transmitter or query parameters gives new key and stale results are
+    never returned. Recently used results are kept in memory (LRU), optionally they are also saved in directory,
+    which is trimmed to max_disk_size bytes by removing least recently used files.
+
+    Args:
+        max_entries: max number of results kept in memory
+        directory: directory of on-disk tier, None disables it
+        max_disk_size: max total size of files in directory in bytes
+    """
+    def __init__(self,
+                 max_entries: int = RESULT_CACHE_SIZE,
+                 directory: str | None = None,
+                 max_disk_size: int = RESULT_CACHE_DISK_SIZE):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.memory: OrderedDict[str, tuple[np.ndarray, ...]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> tuple[np.ndarray, ...] | None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        path = self.path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as file:
+                value = tuple(file[f"arr_{i}"] for i in range(len(file.files)))
+        except (OSError, ValueError):
+            return None  # file removed by other process or damaged
+        os.utime(path)  # modification time is used as last access time by eviction
+        for array in value:
+            array.flags.writeable = False
+        self.store_in_memory(key, value)
+        return value
+
+    def put(self, key: str, value: tuple[np.ndarray, ...]) -> tuple[np.ndarray, ...]:
+        """
+        Caches value and returns it as tuple of read-only arrays.
+        """
+        value = tuple(np.array(array) for array in value)
+        for array in value:
+            array.flags.writeable = False  # cached arrays are shared by all users of result
+        self.store_in_memory(key, value)
+
+        path = self.path(key)
+        if path is not None:
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as file:
+                np.savez(file, *value)
+            os.replace(temp_path, path)
+            self.trim_disk()
+        return value
+
+    def get_or_compute(self,
+                       key: str,
+                       compute: Callable[[], tuple[np.ndarray, ...]]) -> tuple[np.ndarray, ...]:
+        """
+        Returns cached result or computes and caches it.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return self.put(key, compute())
+
+    def clear(self):
+        self.memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def path(self, key: str) -> str | None:
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + ".npz")
+
+    def store_in_memory(self, key: str, value: tuple[np.ndarray, ...]):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def trim_disk(self):
+        entries = list()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def make_key(*parts) -> str:
+    """
+    Creates cache key from hash of parts. Parts can be walls (WallStore or list of Wall), transmitters, NumPy arrays,
+    and numbers, strings, None or tuples of them.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        hash_part(digest, part)
+    return digest.hexdigest()
+
+
+def hash_part(digest, part):
+    # every part is prefixed with its type, so e.g. (1, 2) and "(1, 2)" give different keys
+    if isinstance(part, WallStore):
+        data = part.data
+        digest.update(b"walls")
+        for name in ("points", "width", "material"):
+            hash_part(digest, np.ascontiguousarray(data[name]))
+        hash_part(digest, part.materials)
+    elif isinstance(part, Wall):
+        hash_part(digest, ("wall", part.points, part.width, part.material))
+    elif isinstance(part, Transmitter):
+        hash_part(digest, ("transmitter", part.point, part.power, part.freq))
+    elif isinstance(part, np.ndarray):
+        digest.update(f"array{part.dtype.str}{part.shape}".encode())
+        digest.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, (tuple, list)):
+        digest.update(f"tuple{len(part)}".encode())
+        for item in part:
+            hash_part(digest, item)
+    else:
+        digest.update(f"{type(part).__name__}:{part!r};".encode())
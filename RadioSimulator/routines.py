@@ -1,15 +1,19 @@
 import PySimpleGUI as sg
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import numpy as np
 from numpy import ndarray
 import globals as gb
 import math
 
 from props import Wall, Transmitter, Receiver, Material
-from ray import Ray, get_diffraction_power
+from ray import Ray, clear_image_cache
 from files import save_scene, load_scene
 from materials import materials_list
-from geometrics import point_point_distance, distance_spaces
+from geometrics import distance_spaces
+from spatial import EndpointIndex
+from visibility import VisibilityGraph
+from diffraction import diffraction_sweep, diffraction_values
+from result_cache import make_key
+import simulation
 
 
 # ======================================================================================================================
@@ -34,6 +38,8 @@ def draw_wall(app, event, values):
             sg.popup_error('Given width is not a number. Maybe you used "," instead of "."?  Used default value.')
             width = 1
         gb.walls.append(Wall(gb.last_click, values_s, line_id, material, width))
+        gb.wall_grid.insert(gb.walls[-1])
+        walls_edited("add")
         gb.last_click = None
         app["x1"].update("")
         app["y1"].update("")
@@ -43,6 +49,37 @@ def draw_wall(app, event, values):
         app["y1"].update(values_s[1])
 
 
+def walls_edited(edit: str, wall_idx: int | None = None):
+    """
+    Keeps state derived from walls in sync after wall edit - "add" (wall appended), "update" (points of wall
+    changed), "remove" (wall removed, wall_idx is its index before removal) or "rebuild". Rays traced before edit
+    are removed, their paths are no longer valid. Edit is only recorded in visibility graph, which is updated on
+    its first query. Graph is dropped when scene has more than VISIBILITY_MAX_WALLS walls and created again when
+    it gets smaller, it is built on first query too, same as endpoint index.
+    """
+    clear_rays()
+    gb.endpoint_index = None
+    if len(gb.walls) > gb.VISIBILITY_MAX_WALLS:
+        gb.visibility = None
+    elif gb.visibility is None or edit == "rebuild":
+        gb.visibility = VisibilityGraph(gb.walls)
+    elif edit == "add":
+        gb.visibility.add_wall()
+    elif edit == "update":
+        gb.visibility.update_wall(wall_idx)
+    elif edit == "remove":
+        gb.visibility.remove_wall(wall_idx)
+
+
+def endpoint_index() -> EndpointIndex:
+    """
+    Returns endpoint index of current walls, index dropped by walls_edited is built again here.
+    """
+    if gb.endpoint_index is None:
+        gb.endpoint_index = EndpointIndex(gb.walls)
+    return gb.endpoint_index
+
+
 def draw_transmitter(event, values):
     values_s = point_quantization(values[event])
 
@@ -156,7 +193,11 @@ def delete_element(app, event, values):
         gb.receivers.remove(receivers[0])
     elif walls:
         gb.graph.delete_figure(walls[0].graph_id)
+        wall_idx = gb.walls.index(walls[0])
         gb.walls.remove(walls[0])
+        gb.wall_grid.remove(walls[0])
+        walls_edited("remove", wall_idx)
+    clear_image_cache()
 
 
 def draw_ray(ray: Ray):
@@ -177,6 +218,8 @@ def clear_rays():
 
 
 def draw_figure(canvas, figure):
+    # plotting stack is imported on first plot, it's slow to import and not needed to open the editor window
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
     figure_canvas_agg = FigureCanvasTkAgg(figure, canvas)
     figure_canvas_agg.draw()
     figure_canvas_agg.get_tk_widget().pack(side='top', fill='both', expand=1)
@@ -184,25 +227,43 @@ def draw_figure(canvas, figure):
 
 
 def draw_plot(y: list | ndarray, x: list | ndarray, canvas):
+    import matplotlib.pyplot as plt
     fig = plt.figure(figsize=(5, 2))
     fig.add_subplot(111).plot(x, y)
     plt.grid()
     draw_figure(canvas, fig)
 
 
-def multi_ray_power(steps: int):
+def multi_ray_power(steps: int) -> tuple[ndarray, ndarray]:
+    return simulation.multi_ray_power(gb.rays, gb.selected_r1.point, gb.selected_r2.point, steps)
+
+
+def single_ray_power(ray: Ray, step: float) -> tuple[ndarray, ndarray]:
+    coefs = ray.get_dist_coef_array(step)
+    power_values = ray.get_power_ref() * np.abs(coefs[1:])**2
+    return power_values, step*np.arange(len(power_values))
+
+
+def diffraction_power(steps: int, mode: bool) -> tuple[ndarray, ndarray]:
     x_space, y_space, dist_space = distance_spaces(gb.selected_r1.point, gb.selected_r2.point, steps)
-    power_list = list()
-    for x, y in zip(x_space, y_space):
-        for ray in gb.rays:
-            ray.propagate_to_point((x, y), ray.forced_reflection_walls)
-        coefficients = [ray.get_coef_at_end() for ray in gb.rays]
-        power_ref = gb.rays[0].get_power_ref()
-        coefs_sum = sum(coefficients)
-        power = power_ref * abs(coefs_sum)**2
-        power_list.append(power)
+    # all sample points are calculated at once
+    coef, attenuation, _ = diffraction_sweep(gb.rays[-1].transmitter, gb.walls, np.stack((x_space, y_space), axis=1),
+                                             gb.diff_point)
+    values = diffraction_values(coef, attenuation, mode)
+    if not mode:
+        values = gb.rays[-1].get_power_ref() * np.abs(values)**2
+    return values, dist_space
 
-    return power_list, dist_space
+
+def selected_unit(values: dict, prefix: str) -> str:
+    """
+    Returns unit selected by radio buttons of mode with given prefix, in format used by simulation.convert_power.
+    """
+    if values[f"{prefix}_radio_db"]:
+        return "db"
+    elif values[f"{prefix}_radio_dbm"]:
+        return "dbm"
+    return "lin"
 
 
 # ======================================================================================================================
@@ -229,9 +290,12 @@ def draw_scene_routine(app, event, values):
         for line in gb.walls:
             gb.graph.delete_figure(line.graph_id)
         gb.walls.clear()
+        gb.wall_grid.clear()
+        walls_edited("rebuild")
         for transmitter in gb.transmitters:
             gb.graph.delete_figure(transmitter.graph_id)
         gb.transmitters.clear()
+        clear_image_cache()
 
     elif event == "draw":
         gb.current_sub_mode = "draw_l"
@@ -266,11 +330,17 @@ def draw_scene_routine(app, event, values):
         if type(gb.edit_prop) == Wall:
             points = (values["x1"], values["y1"], values["x2"], values["y2"])
             try:
+                # walls keep coordinates as floats, so values shown in inputs can be e.g. "10.0"
+                points = tuple(float(p) for p in points)
+                if not all(p.is_integer() for p in points):
+                    raise ValueError
                 points = tuple(int(p) for p in points)
             except ValueError:
                 sg.popup_error("Coordinates from inputs are not integers!")
                 return
             gb.edit_prop.points = points
+            gb.wall_grid.update(gb.edit_prop)
+            walls_edited("update", gb.walls.index(gb.edit_prop))
             material = [m for m in materials_list if m.name == values["material_list"]][0]
             try:
                 width = float(values["width"])
@@ -282,6 +352,7 @@ def draw_scene_routine(app, event, values):
             gb.edit_prop.material = material
             gb.edit_prop.width = width
             gb.edit_prop = None
+            clear_image_cache()
 
         elif type(gb.edit_prop) == Transmitter:
             points = (values["x1"], values["y1"])
@@ -306,12 +377,15 @@ def draw_scene_routine(app, event, values):
             gb.edit_prop.freq = freq
             gb.edit_prop.graph_id = transmitter_id
             gb.edit_prop = None
+            clear_image_cache()
 
     elif event == "save":
         save_scene()
 
     elif event == "load":
         load_scene()
+        clear_rays()
+        clear_image_cache()
 
 
 # ======================================================================================================================
@@ -337,24 +411,17 @@ def single_ray_routine(app, event, values):
         if not gb.rays:
             sg.popup_error("Draw ray first")
             return
-        coefs = gb.rays[-1].get_dist_coef_array(step)
-        if not coefs:
+        ray = gb.rays[-1]
+        # result depends only on path of ray, which was calculated when ray was drawn
+        key = make_key("single", ray.transmitter, ray.reflections_list, step)
+        power_values, x_space = gb.result_cache.get_or_compute(key, lambda: single_ray_power(ray, step))
+        if not len(power_values):
             return
 
-        # calculate power array
-        power_ref = gb.rays[-1].get_power_ref()
-        power_values = [power_ref * abs(c)**2 for c in coefs[1:]]
-
-        # convert if selected so
-        if values["single_radio_dbm"]:
-            power_values = [10*math.log10(p/0.001) for p in power_values]
-
-        elif values["single_radio_db"]:
-            initial_power = gb.rays[-1].transmitter.power
-            power_values = [10*math.log10(p/initial_power) for p in power_values]
+        # convert if selected so, cached values are always linear
+        power_values = simulation.convert_power(power_values, selected_unit(values, "single"), ray.transmitter.power)
 
         # plot results
-        x_space = [i*step for i in range(len(power_values))]
         draw_plot(power_values, x_space, app["plot_canvas"].TKCanvas)
 
     elif event == "graph" and gb.current_sub_mode == "draw_ray":
@@ -367,7 +434,7 @@ def single_ray_routine(app, event, values):
             vec = (values[event][0] - gb.last_click.point[0],
                    values[event][1] - gb.last_click.point[1])
             gb.rays.append(Ray(gb.last_click, vec, ap))
-            gb.rays[-1].propagate(gb.walls)
+            gb.rays[-1].propagate(gb.walls, gb.wall_grid, gb.visibility)
             draw_ray(gb.rays[-1])
             # exit drawing sub_mode
             gb.current_sub_mode = None
@@ -434,14 +501,11 @@ def multi_ray_routine(app, event, values):
             step = int(values["diff_step"])
         except ValueError:
             step = gb.MULTI_RAY_STEP
-        p_values, space = multi_ray_power(step)
-        # convert if selected so
-        if values["multi_radio_db"]:
-            initial_power = gb.rays[-1].transmitter.power
-            p_values = [10*math.log10(p/initial_power) for p in p_values]
-
-        elif values["multi_radio_dbm"]:
-            p_values = [10*math.log10(p/0.001) for p in p_values]
+        key = make_key("multi", [(ray.transmitter, ray.forced_reflection_walls) for ray in gb.rays],
+                       gb.selected_r1.point, gb.selected_r2.point, step)
+        p_values, space = gb.result_cache.get_or_compute(key, lambda: multi_ray_power(step))
+        # convert if selected so, points without any valid path have no power (-inf dB)
+        p_values = simulation.convert_power(p_values, selected_unit(values, "multi"), gb.rays[-1].transmitter.power)
 
         draw_plot(p_values, space, app["plot_canvas"].TKCanvas)
 
@@ -462,27 +526,25 @@ def diffraction_routine(app, event, values):
     elif event == "graph" and gb.current_sub_mode == "add_ray_diff" and not gb.rays:
         figures = gb.graph.get_figures_at_location(values[event])
         receivers_list = [r for r in gb.receivers if r.graph_id in figures]
-        wall_list = [wall for wall in gb.walls if wall.graph_id in figures]
         transmitter_list = [t for t in gb.transmitters if t.graph_id in figures]
 
         if not gb.selected_t:
             if transmitter_list:
                 gb.selected_t = transmitter_list[0]
 
-        elif not gb.diff_point:
-            if wall_list:
-                point = values[event]
-                points_list = []
-                for wall in wall_list:
-                    if point_point_distance(point, wall.points[0:2]) < gb.DIFFRACTION_POINT_MARGIN:
-                        points_list.append(wall.points[0:2])
-                    elif point_point_distance(point, wall.points[2:]) < gb.DIFFRACTION_POINT_MARGIN:
-                        points_list.append(wall.points[2:])
-
-                gb.diff_point = points_list[0] if points_list else None
+        elif not gb.diff_point and not receivers_list:
+            # wall endpoint closest to click
+            index = endpoint_index()
+            endpoint = index.nearest(values[event], gb.DIFFRACTION_POINT_MARGIN)
+            gb.diff_point = tuple(map(float, index.points[endpoint])) if endpoint is not None else None
 
         elif not gb.selected_r1:
-            if receivers_list:
+            if receivers_list and not gb.diff_point:
+                # receiver clicked before diffraction point - dominant edge of transmitter-receiver link is chosen
+                _, _, diff_points = diffraction_sweep(gb.selected_t, gb.walls, receivers_list[0].point,
+                                                      index=endpoint_index(), visibility=gb.visibility)
+                gb.diff_point = None if np.isnan(diff_points[0, 0]) else tuple(map(float, diff_points[0]))
+            if receivers_list and gb.diff_point:
                 gb.selected_r1 = receivers_list[0]
                 lines = [gb.graph.draw_line(gb.selected_t.point, gb.diff_point,
                                             width=gb.RAY_SIZE, color=gb.RAY_COLOR),
@@ -514,16 +576,11 @@ def diffraction_routine(app, event, values):
         except ValueError:
             step = gb.MULTI_RAY_STEP
 
-        x_space, y_space, dist_space = distance_spaces(gb.selected_r1.point, gb.selected_r2.point, step)
-
-        if values["diff_radio_db"]:
-            attenuation = [get_diffraction_power(gb.rays[-1], gb.diff_point, (x, y), gb.walls, mode=True)
-                           for x, y in zip(x_space, y_space)]
-            draw_plot(attenuation, dist_space, app["plot_canvas"].TKCanvas)
-
-        elif values["diff_radio_lin"]:
-            coefs = [get_diffraction_power(gb.rays[-1], gb.diff_point, (x, y), gb.walls)
-                     for x, y in zip(x_space, y_space)]
-            power_ref = gb.rays[-1].get_power_ref()
-            power = [power_ref * abs(coef)**2 for coef in coefs]
-            draw_plot(power, dist_space, app["plot_canvas"].TKCanvas)
+        # dB shows diffraction attenuation, which is different quantity than power, so mode is part of key
+        mode = bool(values["diff_radio_db"])
+        key = make_key("diffraction", gb.walls, gb.rays[-1].transmitter, gb.diff_point, gb.selected_r1.point,
+                       gb.selected_r2.point, step, mode)
+        result, dist_space = gb.result_cache.get_or_compute(key, lambda: diffraction_power(step, mode))
+        if not mode:
+            result = simulation.convert_power(result, selected_unit(values, "diff"), gb.rays[-1].transmitter.power)
+        draw_plot(result, dist_space, app["plot_canvas"].TKCanvas)
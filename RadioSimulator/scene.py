@@ -0,0 +1,324 @@
+import json
+import struct
+import numpy as np
+
+from props import Material, Wall, WallStore, Transmitter, Receiver, WALL_DTYPE
+from spatial import WallGrid
+from json_stream import JsonStreamReader, write_array
+from globals import SCALE
+
+# binary scene file: magic, length of json header, json header, raw arrays at offsets given in header
+SCENE_MAGIC = b"RSCENE01"
+SCENE_ALIGNMENT = 64  # arrays start at multiples of this, so they can be memory-mapped
+TRANSMITTER_DTYPE = np.dtype([("point", float, (2,)), ("power", float), ("freq", float)])
+RECEIVER_DTYPE = np.dtype([("point", float, (2,))])
+# arrays of json scene file which are read and written item by item
+STREAMED_KEYS = ("Walls", "Transmitters", "Receivers")
+
+
+class Scene:
+    """
+    Plain model of simulated scene, independent of GUI. Objects created here have no graph ids (None), GUI code
+    assigns them when objects are drawn.
+
+    Args:
+        walls: WallStore or list of standalone Wall objects, which are moved to new store
+        transmitters: list of Transmitter objects
+        receivers: list of Receiver objects
+        materials: materials used by walls
+        scale: scale of scene, scale = 1 means 1px = 1m
+    """
+    def __init__(self,
+                 walls: WallStore | list[Wall] = (),
+                 transmitters: list[Transmitter] = (),
+                 receivers: list[Receiver] = (),
+                 materials: tuple[Material, ...] = (),
+                 scale: float = SCALE):
+        self.walls = walls if isinstance(walls, WallStore) else WallStore(walls)
+        self.transmitters = list(transmitters)
+        self.receivers = list(receivers)
+        self.materials = tuple(materials)
+        self.scale = scale
+        self._grid = None
+
+    @property
+    def grid(self) -> WallGrid:
+        """
+        Spatial index of walls, built on first use. Call invalidate after editing walls.
+        """
+        if self._grid is None:
+            self._grid = WallGrid(self.walls)
+        return self._grid
+
+    def invalidate(self):
+        self._grid = None
+
+    @classmethod
+    def from_dict(cls, content: dict, scale: float = SCALE) -> "Scene":
+        """
+        Creates scene from dictionary in scene file format (keys: Scale, Materials, Walls, Transmitters, Receivers).
+        Coordinates are converted from file scale to given scale.
+        """
+        members = ((key, item) for key, value in content.items()
+                   for item in (value if key in STREAMED_KEYS else (value,)))
+        return cls.from_members(members, scale)
+
+    @classmethod
+    def from_members(cls,
+                     members,
+                     scale: float = SCALE,
+                     grid: WallGrid | None = None) -> "Scene":
+        """
+        Creates scene from (key, value) pairs of scene file, where arrays from STREAMED_KEYS are given as
+        (key, item) pair for each item (see JsonStreamReader.members). Objects are created as soon as their item
+        arrives, walls are also inserted into grid, if it's given. Items which come before Scale and Materials
+        (never the case for files saved by program) are kept until both are known.
+        """
+        walls = WallStore()
+        transmitters = list()
+        receivers = list()
+        header = dict()
+        pending = list()
+
+        def add(key: str, item: dict):
+            sf = header["sf"]
+            if key == "Walls":
+                point1 = (item["points"][0]*sf, item["points"][1]*sf)
+                point2 = (item["points"][2]*sf, item["points"][3]*sf)
+                wall = walls.add(point1, point2, header["materials"][item["material"]], item["width"])
+                if grid is not None:
+                    grid.insert(wall)
+            elif key == "Transmitters":
+                point = (item["point"][0]*sf, item["point"][1]*sf)
+                transmitters.append(Transmitter(point, None, item["power"], item["freq"]))
+            else:
+                point = (item["point"][0]*sf, item["point"][1]*sf)
+                receivers.append(Receiver(point, None))
+
+        for key, value in members:
+            if key not in STREAMED_KEYS:
+                header[key] = value
+                if "sf" not in header and "Scale" in header and "Materials" in header:
+                    header["sf"] = scale / int(header["Scale"])  # scaling factor from file scale to scene scale
+                    header["materials"] = {m.name: m for m in (Material(*m) for m in header["Materials"])}
+                    for item in pending:
+                        add(*item)
+                    pending.clear()
+            elif "sf" in header:
+                add(key, value)
+            else:
+                pending.append((key, value))
+
+        if "sf" not in header:
+            raise KeyError("Scene file has no Scale or Materials")
+        for item in pending:
+            add(*item)
+        scene = cls(walls, transmitters, receivers, tuple(header["materials"].values()), scale)
+        scene._grid = grid
+        return scene
+
+    def to_dict(self) -> dict:
+        """
+        Returns scene in scene file format. Only materials used by walls are stored.
+        """
+        materials_list = list()
+        walls_list = list()
+        for wall in self.walls:
+            if wall.material not in materials_list:
+                materials_list.append(wall.material)
+            walls_list.append({
+                "points": file_points(wall.points),
+                "width": wall.width,
+                "material": wall.material.name
+            })
+
+        return {
+            "Scale": self.scale,
+            "Materials": materials_list,
+            "Walls": walls_list,
+            "Transmitters": [{"point": file_points(t.point), "power": t.power, "freq": t.freq}
+                             for t in self.transmitters],
+            "Receivers": [{"point": file_points(r.point)} for r in self.receivers]
+        }
+
+
+def load_scene_file(path: str, scale: float = SCALE) -> Scene:
+    """
+    Loads scene from json or binary file, format is recognized by content.
+    """
+    if is_binary_scene(path):
+        return load_binary_scene(path, scale)
+    return load_json_scene(path, scale)
+
+
+def save_scene_file(scene: Scene, path: str):
+    """
+    Saves scene to binary file if path ends with ".rscene", else to json file.
+    """
+    if path.endswith(".rscene"):
+        save_binary_scene(scene, path)
+    else:
+        save_json_scene(scene, path)
+
+
+def convert_scene_file(source: str, destination: str):
+    """
+    Converts scene file between json and binary format, see save_scene_file. Scale of source file is kept.
+    """
+    save_scene_file(load_scene_file(source, read_scene_scale(source)), destination)
+
+
+# ======================================================================================================================
+# Json scene format
+# ======================================================================================================================
+def load_json_scene(path: str,
+                    scale: float = SCALE,
+                    grid: WallGrid | None = None) -> Scene:
+    """
+    Loads scene from json file. File is parsed incrementally and walls go straight into scene store (and grid if
+    it's given), so memory used besides the scene itself doesn't depend on size of file.
+    """
+    with open(path) as file:
+        return Scene.from_members(JsonStreamReader(file).members(STREAMED_KEYS), scale, grid)
+
+
+def save_json_scene(scene: Scene, path: str):
+    """
+    Saves scene to json file item by item. Output is the same as json.dumps(scene.to_dict(), indent=2).
+    """
+    walls = scene.walls
+    # only used materials are stored, in order of first use
+    used, first = np.unique(walls.data["material"], return_index=True)
+    materials = [walls.materials[i] for i in used[np.argsort(first)]]
+
+    with open(path, "w") as file:
+        file.write('{\n  "Scale": ' + json.dumps(scene.scale) + ',\n  "Materials": ')
+        write_array(file, materials)
+        file.write(',\n  "Walls": ')
+        write_array(file, wall_items(walls))
+        file.write(',\n  "Transmitters": ')
+        write_array(file, ({"point": file_points(t.point), "power": t.power, "freq": t.freq}
+                           for t in scene.transmitters))
+        file.write(',\n  "Receivers": ')
+        write_array(file, ({"point": file_points(r.point)} for r in scene.receivers))
+        file.write("\n}")
+
+
+def wall_items(walls: WallStore,
+               chunk_size: int = 4096):
+    """
+    Yields walls of store in scene file format, columns are converted in chunks.
+    """
+    data = walls.data
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        for points, width, material in zip(chunk["points"].tolist(), chunk["width"].tolist(),
+                                           chunk["material"].tolist()):
+            yield {"points": file_points(points), "width": width, "material": walls.materials[material].name}
+
+
+def file_points(points) -> list:
+    """
+    Returns coordinates as written to scene file. Objects keep coordinates as floats, integral ones are written
+    as ints, so scenes drawn on integer grid are saved the same as before.
+    """
+    return [int(p) if float(p).is_integer() else float(p) for p in points]
+
+
+# ======================================================================================================================
+# Binary scene format
+# ======================================================================================================================
+def is_binary_scene(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(SCENE_MAGIC)) == SCENE_MAGIC
+
+
+def read_scene_header(path: str) -> dict:
+    """
+    Reads json header of binary scene file. Besides Scale and Materials it holds dtype, shape and offset of
+    every array in "Arrays".
+    """
+    with open(path, "rb") as file:
+        file.seek(len(SCENE_MAGIC))
+        (size,) = struct.unpack("<Q", file.read(8))
+        return json.loads(file.read(size))
+
+
+def read_scene_scale(path: str) -> float:
+    if is_binary_scene(path):
+        return read_scene_header(path)["Scale"]
+    with open(path) as file:
+        # only members before Scale are read, arrays are streamed item by item
+        for key, value in JsonStreamReader(file).members(STREAMED_KEYS):
+            if key == "Scale":
+                return value
+    raise KeyError("Scene file has no Scale")
+
+
+def save_binary_scene(scene: Scene, path: str):
+    """
+    Saves scene to binary file. Walls are written as raw WallStore rows, transmitters and receivers as
+    TRANSMITTER_DTYPE and RECEIVER_DTYPE arrays.
+    """
+    transmitters = np.array([(t.point, t.power, t.freq) for t in scene.transmitters], dtype=TRANSMITTER_DTYPE)
+    receivers = np.array([(r.point,) for r in scene.receivers], dtype=RECEIVER_DTYPE)
+    arrays = {"Walls": scene.walls.data, "Transmitters": transmitters, "Receivers": receivers}
+
+    header = {"Scale": scene.scale, "Materials": scene.walls.materials, "Arrays": dict()}
+    # offsets depend on header size, so header is encoded until its size doesn't change
+    header_size = 0
+    while True:
+        offset = align(len(SCENE_MAGIC) + 8 + header_size)
+        for name, array in arrays.items():
+            header["Arrays"][name] = {"descr": np.lib.format.dtype_to_descr(array.dtype),
+                                      "shape": len(array),
+                                      "offset": offset}
+            offset = align(offset + array.nbytes)
+        encoded = json.dumps(header).encode()
+        if len(encoded) == header_size:
+            break
+        header_size = len(encoded)
+
+    with open(path, "wb") as file:
+        file.write(SCENE_MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        for name, array in arrays.items():
+            file.seek(header["Arrays"][name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(offset)
+
+
+def load_binary_scene(path: str, scale: float = SCALE) -> Scene:
+    """
+    Loads scene from binary file. Wall rows are memory-mapped in copy-on-write mode and used directly by
+    WallStore, so walls are read from disk only when they are used and edits never change the file.
+    """
+    header = read_scene_header(path)
+    arrays = {name: map_array(path, **params) for name, params in header["Arrays"].items()}
+    sf = scale / int(header["Scale"])  # same conversion as in Scene.from_dict
+
+    walls = arrays["Walls"]
+    if walls.dtype != WALL_DTYPE:
+        walls = walls.astype(WALL_DTYPE)  # file written on machine with other byte order or alignment
+    if sf != 1:
+        walls["points"] *= sf
+        walls["length"] *= sf
+
+    walls = WallStore.from_array(walls, [Material(*m) for m in header["Materials"]])
+    transmitters = [Transmitter((float(t["point"][0]*sf), float(t["point"][1]*sf)), None,
+                                float(t["power"]), float(t["freq"])) for t in arrays["Transmitters"]]
+    receivers = [Receiver((float(r["point"][0]*sf), float(r["point"][1]*sf)), None) for r in arrays["Receivers"]]
+    return Scene(walls, transmitters, receivers, tuple(walls.materials), scale)
+
+
+def map_array(path: str,
+              descr,
+              shape: int,
+              offset: int) -> np.ndarray:
+    dtype = np.lib.format.descr_to_dtype(descr)
+    if shape == 0:
+        return np.zeros(0, dtype)  # empty file region can't be mapped
+    return np.memmap(path, dtype, mode="c", offset=offset, shape=(shape,))
+
+
+def align(offset: int) -> int:
+    return -(-offset // SCENE_ALIGNMENT) * SCENE_ALIGNMENT
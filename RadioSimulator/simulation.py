@@ -0,0 +1,323 @@
+from collections import namedtuple
+import numpy as np
+
+from props import Transmitter, Wall
+from ray import Ray, reflection_path_coefs
+from coverage import coverage_field, coverage_map, grid_points
+from paths import PathSet, trace_paths
+from diffraction import diffraction_sweep, diffraction_values
+from reception import shoot_and_bounce_field
+from geometrics import distance_spaces
+from scene import Scene
+from globals import MULTI_RAY_STEP, COVERAGE_RESOLUTION, COVERAGE_ORDER, NOISE_POWER, DIFFRACTION_METHOD, \
+    TUBE_RESOLUTION
+
+MultiResult = namedtuple("MultiResult", ["power",  # (T, P) power in [W] of every transmitter
+                                         "best_server",  # (P,) index of strongest transmitter, -1 without signal
+                                         "sinr"  # (P,) linear SINR of best server, interference from same frequency
+                                         ])
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def convert_power(power: np.ndarray,
+                  unit: str = "lin",
+                  reference: float = 1) -> np.ndarray:
+    """
+    Converts power values in [W] to selected unit.
+
+    Args:
+        power: power values in [W]
+        unit: "lin" - no conversion, "db" - relative to reference power, "dbm"
+        reference: reference power for "db" unit, usually power of transmitter
+
+    Returns:
+        converted array, points without power are -inf for logarithmic units
+    """
+    power = np.asarray(power, dtype=float)
+    with np.errstate(divide="ignore"):
+        if unit == "db":
+            return 10*np.log10(power/reference)
+        elif unit == "dbm":
+            return 10*np.log10(power/0.001)
+    return power
+
+
+def power_ref(transmitter: Transmitter) -> float:
+    """
+    Reference power level of transmitter, same as Ray.get_power_ref.
+    """
+    return Ray(transmitter, (1, 0)).get_power_ref()
+
+
+# ======================================================================================================================
+# Simulations
+# ======================================================================================================================
+def single_ray_power(scene: Scene,
+                     transmitter: Transmitter,
+                     vec: tuple[float, float],
+                     ap: int,
+                     step: float = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Propagates single ray with given AP value and calculates power along its path.
+
+    Returns:
+        power values in [W] and distance from transmitter of each value
+    """
+    ray = Ray(transmitter, vec, ap)
+    ray.propagate(scene.walls, scene.grid)
+    coefs = np.asarray(ray.get_dist_coef_array(step)[1:])
+    power = ray.get_power_ref() * np.abs(coefs)**2
+    return power, step*np.arange(len(power))
+
+
+def multi_ray_power(rays: list[Ray],
+                    start: tuple[float, float],
+                    end: tuple[float, float],
+                    steps: int = MULTI_RAY_STEP) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates power along line from start to end as sum of rays forced to reflect of their
+    forced_reflection_walls. Rays of one transmitter are summed coherently with its reference power,
+    powers of different transmitters are added, as their signals are not correlated.
+
+    Returns:
+        power values in [W] and distance from start of each value
+    """
+    x_space, y_space, dist_space = distance_spaces(start, end, steps)
+    points = np.stack((x_space, y_space), axis=1)
+    # rays grouped by transmitter object, in order of first ray
+    groups: dict[int, list[Ray]] = dict()
+    for ray in rays:
+        groups.setdefault(id(ray.transmitter), list()).append(ray)
+
+    power = np.zeros(len(points))
+    for group in groups.values():
+        # each ray is evaluated for all sample points at once
+        coefs_sum = sum(reflection_path_coefs(ray.transmitter, ray.forced_reflection_walls, points) for ray in group)
+        power += group[0].get_power_ref() * np.abs(coefs_sum)**2
+
+    return power, dist_space
+
+
+def route_power(scene: Scene,
+                transmitter: Transmitter,
+                start: tuple[float, float],
+                end: tuple[float, float],
+                steps: int = MULTI_RAY_STEP,
+                order: int = COVERAGE_ORDER,
+                diffraction: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates power along line from start to end with all paths found automatically - direct path, reflections up
+    to given order and optionally diffraction. Order 0 without diffraction gives line-of-sight only simulation.
+
+    Returns:
+        power values in [W] and distance from start of each value
+    """
+    x_space, y_space, dist_space = distance_spaces(start, end, steps)
+    points = np.stack((x_space, y_space), axis=1)
+    field = coverage_field(transmitter, scene.walls, points, order, diffraction, grid=scene.grid)
+    return power_ref(transmitter) * np.abs(field)**2, dist_space
+
+
+def diffraction_power(scene: Scene,
+                      transmitter: Transmitter,
+                      diff_point: tuple[float, float] | None,
+                      start: tuple[float, float],
+                      end: tuple[float, float],
+                      steps: int = MULTI_RAY_STEP,
+                      mode: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculates diffraction on diff_point along line from start to end, same as diffraction mode of GUI.
+
+    Args:
+        diff_point: diffraction point, None to choose dominant wall endpoint for every point automatically
+        mode: if True diffraction attenuation in [dB] is returned, else power in [W]
+
+    Returns:
+        attenuation or power values and distance from start of each value
+    """
+    x_space, y_space, dist_space = distance_spaces(start, end, steps)
+    coef, attenuation, _ = diffraction_sweep(transmitter, scene.walls, np.stack((x_space, y_space), axis=1),
+                                             diff_point)
+    values = diffraction_values(coef, attenuation, mode)
+    if not mode:
+        values = power_ref(transmitter) * np.abs(values)**2
+    return values, dist_space
+
+
+def coverage_power(scene: Scene,
+                   transmitter: Transmitter,
+                   resolution: float = COVERAGE_RESOLUTION,
+                   order: int = COVERAGE_ORDER,
+                   diffraction: bool = True,
+                   diffraction_method: str = DIFFRACTION_METHOD) -> np.ndarray:
+    """
+    Calculates coverage map of transmitter, see coverage.coverage_map.
+
+    Returns:
+        array of shape (ny, nx) with power in [W]
+    """
+    return coverage_map(transmitter, scene.walls, resolution, order, diffraction, diffraction_method, scene.grid)
+
+
+def forced_ray(transmitter: Transmitter,
+               walls: list[Wall]) -> Ray:
+    """
+    Creates ray that will be forced to reflect of given walls, for use with multi_ray_power.
+    """
+    ray = Ray(transmitter, (1, 1), len(walls))  # vec doesn't matter here
+    ray.forced_reflection_walls = list(walls)
+    return ray
+
+
+# ======================================================================================================================
+# Multi-transmitter simulations
+# ======================================================================================================================
+def multi_transmitter_power(scene: Scene,
+                            transmitters: list[Transmitter],
+                            points: np.ndarray,
+                            order: int = COVERAGE_ORDER,
+                            diffraction: bool = True,
+                            noise: float = NOISE_POWER) -> MultiResult:
+    """
+    Calculates power of many transmitters with own power and frequency at given points, together with best server
+    and SINR. Paths are traced once per transmitter location, transmitters placed in the same point (e.g. one AP
+    on several channels) only evaluate these paths at their frequency.
+
+    Args:
+        transmitters: transmitters on scene
+        points: array of shape (P, 2) with receiver points
+        noise: noise power in [W]
+
+    Returns:
+        MultiResult with per-transmitter power, best server and SINR of every point
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    path_sets: dict[tuple[float, float], PathSet] = dict()
+    power = np.zeros((len(transmitters), len(points)))
+    for i, transmitter in enumerate(transmitters):
+        location = tuple(transmitter.point)
+        if location not in path_sets:
+            path_sets[location] = trace_paths(transmitter, scene.walls, points, order, diffraction)
+        field = path_sets[location].field(transmitter.freq)
+        power[i] = power_ref(transmitter) * np.abs(field)**2
+    return best_server(transmitters, power, noise)
+
+
+def multi_transmitter_map(scene: Scene,
+                          transmitters: list[Transmitter],
+                          resolution: float = COVERAGE_RESOLUTION,
+                          order: int = COVERAGE_ORDER,
+                          diffraction: bool = True,
+                          noise: float = NOISE_POWER) -> MultiResult:
+    """
+    Map version of multi_transmitter_power on grid covering whole scene, see coverage.coverage_map.
+
+    Returns:
+        MultiResult with power of shape (T, ny, nx), best server and SINR of shape (ny, nx)
+    """
+    xs, ys, points = grid_points(resolution)
+    result = multi_transmitter_power(scene, transmitters, points, order, diffraction, noise)
+    return MultiResult(result.power.reshape(len(transmitters), len(ys), len(xs)),
+                       result.best_server.reshape(len(ys), len(xs)), result.sinr.reshape(len(ys), len(xs)))
+
+
+def best_server(transmitters: list[Transmitter],
+                power: np.ndarray,
+                noise: float = NOISE_POWER) -> MultiResult:
+    """
+    Chooses strongest transmitter at every point. Transmitters on the same frequency as the best server are
+    interference, other frequencies are treated as separate channels and don't interfere.
+
+    Args:
+        transmitters: transmitters in order of rows of power
+        power: array of shape (T, P) with power in [W]
+        noise: noise power in [W]
+
+    Returns:
+        MultiResult with given power, best server and SINR of every point
+    """
+    power = np.asarray(power, dtype=float).reshape(len(transmitters), -1)
+    if not len(transmitters):
+        empty = np.zeros(power.shape[1])
+        return MultiResult(power, np.full(power.shape[1], -1), empty)
+
+    best = np.argmax(power, axis=0)
+    signal = np.take_along_axis(power, best[None], axis=0)[0]
+    freqs, channel = np.unique([transmitter.freq for transmitter in transmitters], return_inverse=True)
+    channel_power = np.stack([power[channel == i].sum(axis=0) for i in range(len(freqs))])
+    # power of all transmitters on channel of best server, signal itself is subtracted
+    interference = channel_power[channel[best], np.arange(power.shape[1])] - signal
+    sinr = signal / (np.maximum(interference, 0) + noise)
+    return MultiResult(power, np.where(signal > 0, best, -1), sinr)
+
+
+# ======================================================================================================================
+# Wideband simulations
+# ======================================================================================================================
+def subcarrier_frequencies(center: float,
+                           bandwidth: float,
+                           count: int) -> np.ndarray:
+    """
+    Returns count equally spaced frequencies in [Hz] covering channel of given bandwidth, e.g. OFDM subcarriers.
+    """
+    spacing = bandwidth / count
+    return center + spacing * (np.arange(count) - (count - 1)/2)
+
+
+def frequency_response(scene: Scene,
+                       transmitter: Transmitter,
+                       points: np.ndarray,
+                       freqs: np.ndarray,
+                       order: int = COVERAGE_ORDER,
+                       diffraction: bool = True) -> np.ndarray:
+    """
+    Calculates channel transfer function H(f) at given points for vector of frequencies. Paths are traced once,
+    frequencies only change phase and diffraction loss, see paths.PathSet.frequency_response.
+
+    Returns:
+        array of shape (P, F) with complex channel response, received power is transmitter.power * |H|^2
+    """
+    paths = trace_paths(transmitter, scene.walls, points, order, diffraction)
+    return paths.frequency_response(freqs)
+
+
+def delay_spread_map(scene: Scene,
+                     transmitter: Transmitter,
+                     resolution: float = COVERAGE_RESOLUTION,
+                     order: int = COVERAGE_ORDER,
+                     diffraction: bool = True) -> np.ndarray:
+    """
+    Calculates RMS delay spread on grid covering whole scene, see coverage.coverage_map.
+
+    Returns:
+        array of shape (ny, nx) with delay spread in [s], NaN where no path was found
+    """
+    xs, ys, points = grid_points(resolution)
+    paths = trace_paths(transmitter, scene.walls, points, order, diffraction)
+    return paths.delay_spread(transmitter.freq).reshape(len(ys), len(xs))
+
+
+# ======================================================================================================================
+# Shoot-and-bounce simulations
+# ======================================================================================================================
+def receivers_power(scene: Scene,
+                    transmitter: Transmitter,
+                    points: np.ndarray | None = None,
+                    order: int = COVERAGE_ORDER,
+                    resolution: float = TUBE_RESOLUTION) -> np.ndarray:
+    """
+    Calculates power of direct path and reflections at many receivers with one fan of adaptive ray tubes, see
+    reception.shoot_and_bounce_field. Diffraction is not included.
+
+    Args:
+        points: array of shape (P, 2) with receiver points, by default receivers of scene
+
+    Returns:
+        array of shape (P,) with power in [W]
+    """
+    if points is None:
+        points = np.array([receiver.point for receiver in scene.receivers], dtype=float)
+    field = shoot_and_bounce_field(transmitter, scene.walls, points, order, resolution)
+    return power_ref(transmitter) * np.abs(field)**2
@@ -0,0 +1,344 @@
+import math
+import numpy as np
+
+from props import Wall, WallStore
+from geometrics import nearest_intersections, vec_normalize
+from globals import SCENE_GRID, SCENE_SIZE, FLOAT_COMP
+
+
+class WallGrid:
+    """
+    Uniform grid spatial index over walls. Each cell keeps list of walls that cross it, so ray and segment queries
+    only test walls from cells that are crossed by them (grid traversal - DDA). Grid must be kept in sync with walls
+    list by calling insert, remove and update methods on each scene edit.
+
+    Cell (i, j) covers [i*width, (i+1)*width) x [j*height, (j+1)*height). Indexed area starts as the scene area and
+    grows when wall outside of it is inserted, so walls of scenes larger than SCENE_SIZE are not lost. Rays and
+    segments starting outside of indexed area are clipped to it.
+
+    Args:
+        walls: walls to be indexed
+        cell_size: (width, height) of one cell, by default same as grid of scene
+        scene_size: (width, height) of initially indexed area
+    """
+    def __init__(self,
+                 walls: list[Wall] = (),
+                 cell_size: tuple[float, float] = SCENE_GRID,
+                 scene_size: tuple[float, float] = SCENE_SIZE):
+        self.cell_size = cell_size
+        # indexed area in cells - first and one past last cell along x and y
+        self.bounds = [0, 0, max(1, math.ceil(scene_size[0] / cell_size[0])),
+                       max(1, math.ceil(scene_size[1] / cell_size[1]))]
+        self.cells: dict[tuple[int, int], list[Wall]] = dict()
+        # cells occupied by each wall, needed for removal of moved walls
+        self.wall_cells: dict[int, list[tuple[int, int]]] = dict()
+        self.rebuild(walls)
+
+    def clear(self):
+        self.cells.clear()
+        self.wall_cells.clear()
+
+    def rebuild(self, walls: list[Wall]):
+        """
+        Removes all walls from index and inserts given ones.
+        """
+        self.clear()
+        for wall in walls:
+            self.insert(wall)
+
+    def insert(self, wall: Wall):
+        """
+        Adds wall to all cells it crosses. Wall is widened by FLOAT_COMP margin, so walls lying on cell boundaries
+        or passing near cell corners are registered in all neighbouring cells.
+        """
+        x1, y1, x2, y2 = wall.points
+        dx, dy = vec_normalize((x2 - x1, y2 - y1))
+        # margin along and perpendicular to wall
+        mx, my = dx * FLOAT_COMP, dy * FLOAT_COMP
+        self.extend((min(x1, x2) - 2*FLOAT_COMP, min(y1, y2) - 2*FLOAT_COMP),
+                    (max(x1, x2) + 2*FLOAT_COMP, max(y1, y2) + 2*FLOAT_COMP))
+        cells = set()
+        for ox, oy in ((0, 0), (-my, mx), (my, -mx)):
+            start = (x1 - mx + ox, y1 - my + oy)
+            end = (x2 + mx + ox, y2 + my + oy)
+            cells.update(cell for cell, _ in self.traverse(start, (end[0] - start[0], end[1] - start[1]), 1))
+
+        self.wall_cells[id(wall)] = list(cells)
+        for cell in cells:
+            self.cells.setdefault(cell, list()).append(wall)
+
+    def remove(self, wall: Wall):
+        for cell in self.wall_cells.pop(id(wall), ()):
+            self.cells[cell].remove(wall)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def update(self, wall: Wall):
+        """
+        Re-indexes wall after its points were changed.
+        """
+        self.remove(wall)
+        self.insert(wall)
+
+    def extend(self,
+               low: tuple[float, float],
+               high: tuple[float, float]):
+        """
+        Grows indexed area to cover box low-high. Cells don't depend on indexed area, so walls are not re-indexed.
+        """
+        self.bounds = [min(self.bounds[0], math.floor(low[0] / self.cell_size[0])),
+                       min(self.bounds[1], math.floor(low[1] / self.cell_size[1])),
+                       max(self.bounds[2], math.floor(high[0] / self.cell_size[0]) + 1),
+                       max(self.bounds[3], math.floor(high[1] / self.cell_size[1]) + 1)]
+
+    def cell_of(self, point: tuple[float, float]) -> tuple[int, int]:
+        """
+        Returns cell containing given point. Points outside of indexed area are clamped to border cells.
+        """
+        cx = min(max(int(math.floor(point[0] / self.cell_size[0])), self.bounds[0]), self.bounds[2] - 1)
+        cy = min(max(int(math.floor(point[1] / self.cell_size[1])), self.bounds[1]), self.bounds[3] - 1)
+        return cx, cy
+
+    def clip(self,
+             point: tuple[float, float],
+             vec: tuple[float, float],
+             max_t: float = math.inf) -> tuple[float, float] | None:
+        """
+        Returns range of line parameter (t_enter, t_leave) where line point + t*vec, 0 <= t <= max_t, is inside of
+        indexed area, None when it misses the area.
+        """
+        t_enter, t_leave = 0, max_t
+        for axis in (0, 1):
+            low = self.bounds[axis] * self.cell_size[axis]
+            high = self.bounds[axis + 2] * self.cell_size[axis]
+            if vec[axis] == 0:
+                if not low <= point[axis] <= high:
+                    return None
+                continue
+            t1 = (low - point[axis]) / vec[axis]
+            t2 = (high - point[axis]) / vec[axis]
+            t_enter, t_leave = max(t_enter, min(t1, t2)), min(t_leave, max(t1, t2))
+        return (t_enter, t_leave) if t_enter <= t_leave else None
+
+    def traverse(self,
+                 point: tuple[float, float],
+                 vec: tuple[float, float],
+                 max_t: float = math.inf):
+        """
+        Generator of cells crossed by line point + t*vec for 0 <= t <= max_t (Amanatides-Woo grid traversal).
+
+        Args:
+            point: (x, y) start point
+            vec: (dx, dy) direction, doesn't have to be normalized
+            max_t: maximal value of line parameter, e.g. 1 for segment from point to point + vec
+
+        Yields:
+            (cell, t_exit) - cell index and value of line parameter where line leaves the cell
+        """
+        clipped = self.clip(point, vec, max_t)
+        if clipped is None:
+            return
+        t = clipped[0]
+        cx, cy = self.cell_of((point[0] + t*vec[0], point[1] + t*vec[1]))
+        w, h = self.cell_size
+
+        if vec[0] > 0:
+            step_x, t_max_x, t_delta_x = 1, ((cx + 1) * w - point[0]) / vec[0], w / vec[0]
+        elif vec[0] < 0:
+            step_x, t_max_x, t_delta_x = -1, (cx * w - point[0]) / vec[0], -w / vec[0]
+        else:
+            step_x, t_max_x, t_delta_x = 0, math.inf, math.inf
+
+        if vec[1] > 0:
+            step_y, t_max_y, t_delta_y = 1, ((cy + 1) * h - point[1]) / vec[1], h / vec[1]
+        elif vec[1] < 0:
+            step_y, t_max_y, t_delta_y = -1, (cy * h - point[1]) / vec[1], -h / vec[1]
+        else:
+            step_y, t_max_y, t_delta_y = 0, math.inf, math.inf
+
+        while t <= max_t:
+            t_exit = min(t_max_x, t_max_y)
+            yield (cx, cy), t_exit
+            if t_max_x < t_max_y:
+                cx += step_x
+                t, t_max_x = t_max_x, t_max_x + t_delta_x
+            else:
+                cy += step_y
+                t, t_max_y = t_max_y, t_max_y + t_delta_y
+            x1, y1, x2, y2 = self.bounds
+            if not (x1 <= cx < x2 and y1 <= cy < y2) or math.isinf(t):
+                break
+
+    def walls_on_segment(self,
+                         point1: tuple[float, float],
+                         point2: tuple[float, float]) -> list[Wall]:
+        """
+        Returns walls from all cells crossed by segment point1-point2, without duplicates.
+        Result is superset of walls intersecting the segment.
+        """
+        walls = dict()
+        vec = (point2[0] - point1[0], point2[1] - point1[1])
+        for cell, _ in self.traverse(point1, vec, 1):
+            for wall in self.cells.get(cell, ()):
+                walls[id(wall)] = wall
+        return list(walls.values())
+
+    def nearest_intersection(self,
+                             point: tuple[float, float],
+                             vec: tuple[float, float],
+                             min_dist: float = FLOAT_COMP) -> tuple[Wall, tuple[float, float]] | tuple[None, None]:
+        """
+        Finds closest wall hit by ray. Cells are visited in order along the ray and search stops at first cell
+        that contains the closest hit found so far.
+
+        Args:
+            point: (x, y) starting point of ray
+            vec: (dx, dy) direction of ray (must be normalized)
+            min_dist: intersections closer to starting point than this value are skipped
+
+        Returns:
+            hit Wall and (x, y) coordinates of intersection or (None, None) when ray doesn't hit any wall
+        """
+        tested = set()
+        best_wall, best_point, best_t = None, None, math.inf
+        for cell, t_exit in self.traverse(point, vec):
+            candidates = [wall for wall in self.cells.get(cell, ()) if id(wall) not in tested]
+            if candidates:
+                tested.update(id(wall) for wall in candidates)
+                segments = np.array([wall.points for wall in candidates], dtype=float)
+                idx, hits = nearest_intersections(np.array([point], dtype=float), np.array([vec], dtype=float),
+                                                  segments, min_dist)
+                if idx[0] >= 0:
+                    t = (hits[0, 0] - point[0]) * vec[0] + (hits[0, 1] - point[1]) * vec[1]
+                    if t < best_t:
+                        best_wall, best_t = candidates[idx[0]], t
+                        best_point = (float(hits[0, 0]), float(hits[0, 1]))
+
+            if best_t <= t_exit:
+                break
+
+        return best_wall, best_point
+
+
+class EndpointIndex:
+    """
+    Hashed index of unique wall endpoints - candidate diffraction edges. Endpoints shared by several walls
+    (corners) are stored once, endpoints are bucketed into uniform grid cells, so endpoints near given point or in
+    given box are found without testing all walls.
+
+    Args:
+        walls: WallStore or list of walls, index is not updated after edits and has to be rebuilt
+        cell_size: (width, height) of one cell, by default same as grid of scene
+    """
+    def __init__(self,
+                 walls: WallStore | list[Wall] = (),
+                 cell_size: tuple[float, float] = SCENE_GRID):
+        self.cell_size = cell_size
+        if isinstance(walls, WallStore):
+            ends = walls.data["points"].reshape(-1, 2)
+        else:
+            ends = np.array([wall.points for wall in walls], dtype=float).reshape(-1, 2)
+        self.points, inverse = np.unique(ends, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        # indices of both endpoints of every wall
+        self.wall_endpoints = inverse.reshape(-1, 2)
+
+        self.cells: dict[tuple[int, int], list[int]] = dict()
+        keys = np.floor(self.points / np.asarray(cell_size, dtype=float)).astype(int)
+        for i, key in enumerate(map(tuple, keys)):
+            self.cells.setdefault(key, list()).append(i)
+
+    def __len__(self):
+        return len(self.points)
+
+    def in_box(self,
+               x1: float,
+               y1: float,
+               x2: float,
+               y2: float) -> np.ndarray:
+        """
+        Returns indices of endpoints inside box with corners (x1, y1) and (x2, y2), in ascending order.
+        """
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        w, h = self.cell_size
+        cx1, cy1, cx2, cy2 = (int(math.floor(x1 / w)), int(math.floor(y1 / h)),
+                              int(math.floor(x2 / w)), int(math.floor(y2 / h)))
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self.cells):
+            keys = [key for key in self.cells if cx1 <= key[0] <= cx2 and cy1 <= key[1] <= cy2]
+        else:
+            keys = [(cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1) if (cx, cy) in self.cells]
+        ids = np.array(sorted(i for key in keys for i in self.cells[key]), dtype=int)
+        if not len(ids):
+            return ids
+        points = self.points[ids]
+        inside = (points[:, 0] >= x1) & (points[:, 0] <= x2) & (points[:, 1] >= y1) & (points[:, 1] <= y2)
+        return ids[inside]
+
+    def nearest(self,
+                point: tuple[float, float],
+                radius: float) -> int | None:
+        """
+        Returns index of endpoint closest to point, None if there is no endpoint closer than radius.
+        """
+        ids = self.in_box(point[0] - radius, point[1] - radius, point[0] + radius, point[1] + radius)
+        if not len(ids):
+            return None
+        dist = np.sqrt(((self.points[ids] - point)**2).sum(axis=1))
+        best = int(np.argmin(dist))
+        return int(ids[best]) if dist[best] <= radius else None
+
+
+class PointGrid:
+    """
+    Spatial hash of many points, e.g. receivers. Points are sorted by key of their cell and every occupied cell keeps
+    range of sorted points (CSR), so points of many cells are found at once with one binary search.
+
+    Args:
+        points: array of shape (P, 2) with indexed points
+        cell_size: side of one square cell
+    """
+    def __init__(self,
+                 points: np.ndarray,
+                 cell_size: float):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        self.origin = self.points.min(axis=0) if len(self.points) else np.zeros(2)
+        cells = self.cell_of(self.points)
+        self.shape = cells.max(axis=0) + 1 if len(cells) else np.zeros(2, dtype=int)
+        keys = self.key(cells)
+        # points of cell keys[i] are order[offsets[i]:offsets[i+1]]
+        self.order = np.argsort(keys, kind="stable")
+        self.keys, starts = np.unique(keys[self.order], return_index=True)
+        self.offsets = np.append(starts, len(keys))
+
+    def __len__(self):
+        return len(self.points)
+
+    def cell_of(self, points: np.ndarray) -> np.ndarray:
+        """
+        Returns (column, row) of cells of points (N, 2), cells outside of indexed area are allowed.
+        """
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def key(self, cells: np.ndarray) -> np.ndarray:
+        return cells[:, 0] * self.shape[1] + cells[:, 1]
+
+    def query(self, cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds points in many cells at once.
+
+        Args:
+            cells: array of shape (N, 2) with (column, row) of cells
+
+        Returns:
+            index of cell (M,) and index of point (M,) for every point found in cells
+        """
+        inside = np.flatnonzero(((cells >= 0) & (cells < self.shape)).all(axis=1))
+        keys = self.key(cells[inside])
+        pos = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        found = self.keys[pos] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        inside, pos = inside[found], pos[found]
+        counts = self.offsets[pos + 1] - self.offsets[pos]
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(inside, counts), self.order[np.repeat(self.offsets[pos], counts) + local]
@@ -0,0 +1,443 @@
+import math
+import numpy as np
+
+from props import Wall, WallStore
+from geometrics import crossing_chunks
+from globals import FLOAT_COMP, FLOAT_ZERO
+
+# angular tolerance of sweep in [rad]
+SWEEP_EPS = 1e-9
+# number of angular bins used to cull hidden walls before sweep
+SWEEP_BINS = 128
+
+
+class VisibilityGraph:
+    """
+    Precomputed visibility between walls and wall endpoints (vertices, also used as diffraction edges). Vertex v is
+    endpoint v % 2 of wall v // 2. Vertices seen from every vertex are found with angular sweep (see angular_sweep),
+    which also gives walls visible from the vertex. Wall A sees wall B when there is line through some vertex that
+    reaches A in one direction and B in the other one, or A touches the vertex and B is visible from it. Every
+    unobstructed segment between two walls can be slid until it touches some vertex, so this relation contains
+    all pairs of walls that can be connected by path segment and can be used to prune path searches without
+    losing paths.
+
+    Both relations are stored in CSR layout (offsets and neighbours arrays), which is assembled again only after
+    edits. Graph is built on first query. Edits are only recorded by add_wall, update_wall and remove_wall, called
+    after walls were changed, and applied together on next query - only rows of vertices that saw edited walls
+    before edit (reverse index seen_by) or can see them after it (see affected_by) are calculated again. Rows are
+    kept by slots of walls, which don't change when other walls are removed, so no rows are renumbered.
+
+    Args:
+        walls: WallStore or list of walls
+    """
+    def __init__(self, walls: WallStore | list[Wall]):
+        self.walls = walls
+        self._segments = np.zeros((0, 4))
+        # slot of every wall, rows of vertex v of wall in slot s are at index 2*s + v % 2, wall at slot s is
+        # at index ext[s] of walls (-1 for removed walls)
+        self.slots = np.zeros(0, dtype=int)
+        self.ext = np.zeros(0, dtype=int)
+        # visible vertices, visible walls and pairs of walls connected by line through every vertex, by slots
+        self.vertex_rows: list[np.ndarray] = list()
+        self.wall_rows: list[np.ndarray] = list()
+        self.pair_rows: list[np.ndarray] = list()
+        # vertices whose rows contain wall in slot or its vertices
+        self.seen_by: list[set[int]] = list()
+        # slots of added or changed walls and of removed walls, not applied yet
+        self.changed: set[int] = set()
+        self.removed: set[int] = set()
+        self.built = False
+        self._csr: tuple[np.ndarray, ...] | None = None
+
+    # ==================================================================================================================
+    # Queries
+    # ==================================================================================================================
+    @property
+    def segments(self) -> np.ndarray:
+        self.refresh()
+        return self._segments
+
+    @property
+    def vertices(self) -> np.ndarray:
+        return self.segments.reshape(-1, 2)
+
+    @property
+    def vertex_offsets(self) -> np.ndarray:
+        return self.csr()[0]
+
+    @property
+    def vertex_neighbors(self) -> np.ndarray:
+        return self.csr()[1]
+
+    @property
+    def wall_offsets(self) -> np.ndarray:
+        return self.csr()[2]
+
+    @property
+    def wall_neighbors(self) -> np.ndarray:
+        return self.csr()[3]
+
+    def csr(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns vertex offsets, vertex neighbours, wall offsets and wall neighbours - neighbours of vertex v are
+        vertex_neighbors[vertex_offsets[v]:vertex_offsets[v+1]], the same for walls.
+        """
+        self.refresh()
+        if self._csr is None:
+            # slots are increasing, so mapping to indices of walls keeps rows sorted
+            rows = (2 * self.slots[:, None] + np.arange(2)).ravel()
+            vertex_offsets, neighbors = rows_to_csr([self.vertex_rows[v] for v in rows])
+            vertex_neighbors = 2 * self.ext[neighbors // 2] + neighbors % 2
+            n = len(self.slots)
+            pairs = [self.pair_rows[v] for v in rows]
+            pairs = self.ext[np.concatenate(pairs)] if pairs else np.zeros((0, 2), dtype=int)
+            pairs = pairs[pairs[:, 0] != pairs[:, 1]].astype(np.int64)
+            # relation is symmetric, unique keys a * n + b are sorted by row and then by neighbour
+            keys = np.unique(np.concatenate((pairs[:, 0] * n + pairs[:, 1], pairs[:, 1] * n + pairs[:, 0])))
+            wall_offsets = np.searchsorted(keys, np.arange(n + 1) * n)
+            self._csr = vertex_offsets, vertex_neighbors, wall_offsets, keys % n
+        return self._csr
+
+    def seen_vertices(self, vertex: int) -> np.ndarray:
+        offsets, neighbors = self.csr()[0:2]
+        return neighbors[offsets[vertex]:offsets[vertex + 1]]
+
+    def seen_walls(self, wall: int) -> np.ndarray:
+        """
+        Returns indices of walls that can be reached by segment starting on wall, in ascending order.
+        """
+        offsets, neighbors = self.csr()[2:4]
+        return neighbors[offsets[wall]:offsets[wall + 1]]
+
+    def visible_from(self, point: tuple[float, float]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns vertices and walls visible from point which is not vertex, e.g. transmitter, see angular_sweep.
+        """
+        return angular_sweep(point, self.segments)
+
+    def visible_endpoints(self, point: tuple[float, float]) -> np.ndarray:
+        """
+        Returns array of shape (E, 2) with unique wall endpoints visible from point - candidate diffraction edges.
+        """
+        vertices, _, _ = self.visible_from(point)
+        return np.unique(self.vertices[vertices], axis=0)
+
+    # ==================================================================================================================
+    # Edits
+    # ==================================================================================================================
+    def add_wall(self):
+        """
+        Records that wall was appended to walls.
+        """
+        if self.built:
+            self.changed.add(self.add_slot())
+            self.slots = np.append(self.slots, len(self.seen_by) - 1)
+        self._csr = None
+
+    def update_wall(self, wall: int):
+        """
+        Records that points of wall were changed.
+        """
+        if self.built:
+            self.changed.add(int(self.slots[wall]))
+        self._csr = None
+
+    def remove_wall(self, wall: int):
+        """
+        Records that wall was removed from walls, indices of following walls decrease by one.
+        """
+        if self.built:
+            self.removed.add(int(self.slots[wall]))
+            self.slots = np.delete(self.slots, wall)
+        self._csr = None
+
+    def refresh(self):
+        """
+        Builds graph on first call, later applies edits recorded since last call.
+        """
+        if self.built and not self.changed and not self.removed:
+            return
+        self._segments = wall_segments(self.walls)
+        if not self.built:
+            self.slots = np.arange(len(self._segments))
+            self.vertex_rows, self.wall_rows, self.pair_rows, self.seen_by = list(), list(), list(), list()
+            for _ in self.slots:
+                self.add_slot()
+            affected = set(range(2 * len(self.slots)))
+        else:
+            affected = set()
+            for slot in self.changed | self.removed:
+                affected |= self.seen_by[slot]
+        self.ext = np.full(len(self.seen_by), -1)
+        self.ext[self.slots] = np.arange(len(self.slots))
+        for slot in self.changed - self.removed:
+            affected |= self.affected_by(slot) | {2*slot, 2*slot + 1}
+        for slot in self.removed:
+            for v in (2*slot, 2*slot + 1):
+                self.set_rows(v, np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((0, 2), dtype=int))
+        self.changed, self.removed, self.built = set(), set(), True
+        for v in sorted(affected):
+            if self.ext[v // 2] >= 0:
+                self.update_vertex(v)
+        self._csr = None
+
+    def add_slot(self) -> int:
+        for _ in range(2):
+            self.vertex_rows.append(np.zeros(0, dtype=int))
+            self.wall_rows.append(np.zeros(0, dtype=int))
+            self.pair_rows.append(np.zeros((0, 2), dtype=int))
+        self.seen_by.append(set())
+        return len(self.seen_by) - 1
+
+    def update_vertex(self, vertex: int):
+        wall = self.ext[vertex // 2]
+        vertices, walls, pairs = angular_sweep(self._segments[wall].reshape(2, 2)[vertex % 2], self._segments)
+        vertices = 2 * self.slots[vertices // 2] + vertices % 2
+        self.set_rows(vertex, vertices[vertices != vertex], self.slots[walls], self.slots[pairs])
+
+    def set_rows(self,
+                 vertex: int,
+                 vertices: np.ndarray,
+                 walls: np.ndarray,
+                 pairs: np.ndarray):
+        for slot in set(self.wall_rows[vertex].tolist()) | set((self.vertex_rows[vertex] // 2).tolist()):
+            self.seen_by[slot].discard(vertex)
+        self.vertex_rows[vertex], self.wall_rows[vertex], self.pair_rows[vertex] = vertices, walls, pairs
+        for slot in set(walls.tolist()) | set((vertices // 2).tolist()):
+            self.seen_by[slot].add(vertex)
+
+    def affected_by(self, slot: int) -> set[int]:
+        """
+        Returns vertices whose view can contain wall in slot - all vertices except those from which the wall is
+        hidden behind one other wall, which are found for all vertices at once (see hidden_behind_wall).
+        """
+        wall = self.ext[slot]
+        vertices = self._segments.reshape(-1, 2)
+        ids = np.flatnonzero(np.arange(len(vertices)) // 2 != wall)
+        ids = ids[~hidden_behind_wall(vertices[ids], self._segments[wall], self._segments)]
+        return set((2 * self.slots[ids // 2] + ids % 2).tolist())
+
+
+# ======================================================================================================================
+# Helper functions
+# ======================================================================================================================
+def wall_segments(walls: WallStore | list[Wall]) -> np.ndarray:
+    if isinstance(walls, WallStore):
+        return np.array(walls.data["points"], dtype=float).reshape(-1, 4)
+    return np.array([wall.points for wall in walls], dtype=float).reshape(-1, 4)
+
+
+def hidden_behind_wall(points: np.ndarray,
+                       segment: np.ndarray,
+                       segments: np.ndarray) -> np.ndarray:
+    """
+    Returns mask of points from which whole segment is hidden behind one of walls - the wall crosses both segments
+    from point to ends of segment, so it crosses every ray from point to segment before it. Walls whose line
+    passes closer than FLOAT_COMP to point are skipped, crossings near point don't block rays in sweep.
+    """
+    hidden = np.zeros(len(points), dtype=bool)
+    ex, ey = segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]
+    length = np.maximum(np.sqrt(ex**2 + ey**2), FLOAT_ZERO)
+    ends = [np.broadcast_to(end, points.shape) for end in segment.reshape(2, 2)]
+    for (i, crossing1, _), (_, crossing2, _) in zip(crossing_chunks(points, ends[0], segments),
+                                                    crossing_chunks(points, ends[1], segments)):
+        p = points[i:i + len(crossing1)]
+        distance = np.abs((segments[:, 0] - p[:, 0:1])*ey - (segments[:, 1] - p[:, 1:2])*ex) / length
+        hidden[i:i + len(crossing1)] = (crossing1 & crossing2 & (distance > FLOAT_COMP)).any(axis=1)
+    return hidden
+
+
+def rows_to_csr(rows: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    offsets = np.concatenate(([0], np.cumsum([len(row) for row in rows]))).astype(int)
+    neighbors = np.concatenate(rows).astype(int) if rows else np.zeros(0, dtype=int)
+    return offsets, neighbors
+
+
+def angular_sweep(point: tuple[float, float],
+                  segments: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds vertices (wall endpoints) and walls visible from point. Walls hidden behind nearer walls are culled first
+    (see hidden_walls), then rays are cast at angles of vertices of remaining walls and in the middle of every
+    angular sector between them, in sectors wall in front of point doesn't change, so these rays see every visible
+    wall. Every wall is tested only by rays inside its angular interval, which are found by binary search in sorted
+    ray angles, so cost depends on number of walls overlapping in view of point instead of product of all vertices
+    and walls.
+
+    Pairs of walls connected by line through point are returned too - walls seen in opposite directions and walls
+    touching point paired with all visible walls. Rays opposite to vertex rays are added for that, other opposite
+    directions are covered by sectors.
+
+    Args:
+        point: (x, y) point of view
+        segments: array of shape (N, 4) with (x1, y1, x2, y2) coordinates of walls
+
+    Returns:
+        indices of visible vertices (vertex v is endpoint v % 2 of wall v // 2), indices of visible walls and
+        array of shape (K, 2) with pairs of walls, walls touching point are visible, vertices in point too
+    """
+    p = np.asarray(point, dtype=float)
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    rel = segments.reshape(-1, 2) - p
+    dist = np.sqrt((rel**2).sum(axis=1))
+    angle = np.arctan2(rel[:, 1], rel[:, 0])
+    at_point = dist < FLOAT_COMP
+    touching = np.flatnonzero(at_point.reshape(-1, 2).any(axis=1))
+    length = np.sqrt(((segments[:, 2:4] - segments[:, 0:2])**2).sum(axis=1))
+    blocking = np.flatnonzero(length > FLOAT_ZERO)
+    blocking = blocking[~np.isin(blocking, touching)]
+
+    # angular interval of every wall, widened by angle of FLOAT_COMP margin at wall's ends, grazing rays are
+    # checked exactly below
+    low, span = angular_interval(angle[2*blocking], angle[2*blocking + 1])
+    low = wrap_angle(low)
+    near = np.maximum(np.minimum(dist[2*blocking], dist[2*blocking + 1]), FLOAT_COMP)
+    eps = SWEEP_EPS + np.minimum(FLOAT_COMP / near, 0.5)
+    # walls hidden behind nearer ones can't be seen and don't change nearest hits, they cast no rays
+    hidden = hidden_walls(p, segments[blocking], low, span, eps)
+    culled = np.zeros(len(segments), dtype=bool)
+    culled[blocking[hidden]] = True
+    blocking, low, span, eps = blocking[~hidden], low[~hidden], span[~hidden], eps[~hidden]
+
+    # rays at vertex angles, in middle of sectors between them and opposite to vertex rays
+    vertex_ids = np.flatnonzero(~at_point & ~np.repeat(culled, 2))
+    vertex_angles = angle[vertex_ids]
+    sector_angles = np.sort(wrap_angle(vertex_angles))
+    if len(sector_angles):
+        mids = (sector_angles + np.append(sector_angles[1:], sector_angles[0] + 2*math.pi)) / 2
+    else:
+        mids = np.zeros(0)
+    ray_angles = wrap_angle(np.concatenate((vertex_angles, mids, vertex_angles + math.pi)))
+    ray_vertex = np.concatenate((vertex_ids, np.full(len(ray_angles) - len(vertex_ids), -1)))
+    order = np.argsort(ray_angles, kind="stable")
+    ray_angles, ray_vertex = ray_angles[order], ray_vertex[order]
+    position = np.empty(len(order), dtype=int)
+    position[order] = np.arange(len(order))
+
+    n_rays = len(ray_angles)
+    if not n_rays:
+        return np.flatnonzero(at_point), touching, np.zeros((0, 2), dtype=int)
+
+    # rays inside angular interval of every wall - binary search in doubled array handles wrap around
+    doubled = np.concatenate((ray_angles, ray_angles + 2*math.pi))
+    start = np.searchsorted(doubled, low - eps, side="left")
+    count = np.minimum(np.searchsorted(doubled, low + span + eps, side="right") - start, n_rays)
+    pair_wall = np.repeat(blocking, count)
+    pair_ray = (np.repeat(start - np.cumsum(count) + count, count) + np.arange(count.sum())) % n_rays
+
+    # distance along ray to wall, p + t*d = a + s*e
+    dx, dy = np.cos(ray_angles[pair_ray]), np.sin(ray_angles[pair_ray])
+    seg = segments[pair_wall]
+    ex, ey = seg[:, 2] - seg[:, 0], seg[:, 3] - seg[:, 1]
+    wx, wy = seg[:, 0] - p[0], seg[:, 1] - p[1]
+    denominator = dx*ey - dy*ex
+    parallel = np.abs(denominator) < FLOAT_ZERO
+    denominator = np.where(parallel, 1, denominator)
+    t = (wx*ey - wy*ex) / denominator
+    s = (wx*dy - wy*dx) / denominator
+    margin = FLOAT_COMP / 2 / length[pair_wall]
+    # crossings closer than FLOAT_COMP to point are skipped, same as in segments_blocked
+    hit = ~parallel & (t > FLOAT_COMP) & (s >= -margin) & (s <= 1 + margin)
+    t = np.where(hit, t, np.inf)
+    nearest = np.full(n_rays, np.inf)
+    np.minimum.at(nearest, pair_ray, t)
+
+    # walls giving nearest hit of ray (with tolerance for corners) are visible
+    first = hit & (t <= nearest[pair_ray] + FLOAT_COMP)
+    first_ray, first_wall = pair_ray[first], pair_wall[first]
+    walls = np.union1d(first_wall, touching).astype(int)
+    vertex_rays = ray_vertex >= 0
+    seen = vertex_rays.copy()
+    seen[vertex_rays] = dist[ray_vertex[vertex_rays]] <= nearest[vertex_rays] + FLOAT_COMP
+    vertices = np.union1d(ray_vertex[seen], np.flatnonzero(at_point)).astype(int)
+    # directions of lines through point - vertex rays with their opposite rays and cells of sectors overlaid
+    # with sectors turned by pi, where walls in both directions are constant
+    n_vertex, n_sectors = len(vertex_ids), len(sector_angles)
+    mid_rays = position[n_vertex + np.arange(n_sectors)]
+    boundaries = np.sort(wrap_angle(np.concatenate((sector_angles, sector_angles + math.pi))))
+    cells = wrap_angle((boundaries + np.append(boundaries[1:], boundaries[0] + 2*math.pi)) / 2)
+    sector1 = (np.searchsorted(sector_angles, cells, side="right") - 1) % n_sectors
+    sector2 = (np.searchsorted(sector_angles, wrap_angle(cells + math.pi), side="right") - 1) % n_sectors
+    rays1 = np.concatenate((position[np.arange(n_vertex)], mid_rays[sector1]))
+    rays2 = np.concatenate((position[n_vertex + n_sectors + np.arange(n_vertex)], mid_rays[sector2]))
+    pairs = np.concatenate((join_rays(rays1, rays2, first_ray, first_wall, n_rays),
+                            np.stack(np.meshgrid(touching, walls, indexing="ij"), axis=-1).reshape(-1, 2)))
+    return vertices, walls, pairs
+
+
+def hidden_walls(point: np.ndarray,
+                 segments: np.ndarray,
+                 low: np.ndarray,
+                 span: np.ndarray,
+                 eps: np.ndarray) -> np.ndarray:
+    """
+    Returns mask of walls which can't be seen from point, walls are given with their angular intervals
+    (low, low + span) widened by eps. Full angle is divided into SWEEP_BINS bins, distance to nearest wall along
+    any ray in bin is at most distance to wall covering whole bin at bin's edges (distance along rays to line is
+    convex function of angle). Wall farther than this bound in all bins it overlaps is hidden, so far walls are
+    culled at cost of their number of bins instead of number of rays.
+    """
+    if not len(segments):
+        return np.zeros(0, dtype=bool)
+    width = 2*math.pi / SWEEP_BINS
+    a, e = segments[:, 0:2], segments[:, 2:4] - segments[:, 0:2]
+    along = np.clip(((point - a) * e).sum(axis=1) / (e**2).sum(axis=1), 0, 1)
+    distance = np.sqrt(((a + along[:, None] * e - point)**2).sum(axis=1))
+
+    # bin edges inside interval of every wall, walls too close to point may not block rays
+    first = np.ceil((low + math.pi) / width).astype(int)
+    n = np.floor((low + span + math.pi) / width).astype(int) - first + 1
+    n = np.where((distance > 2*FLOAT_COMP) & (n > 1), n, 0)
+    wall = np.repeat(np.arange(len(segments)), n)
+    edge = np.repeat(first - np.cumsum(n) + n, n) + np.arange(n.sum())
+    dx, dy = np.cos(edge * width - math.pi), np.sin(edge * width - math.pi)
+    ex, ey = e[wall, 0], e[wall, 1]
+    wx, wy = a[wall, 0] - point[0], a[wall, 1] - point[1]
+    t = (wx*ey - wy*ex) / (dx*ey - dy*ex)
+    # bins between consecutive edges of the same wall are covered by it
+    inner = wall[1:] == wall[:-1]
+    bound = np.full(SWEEP_BINS, np.inf)
+    np.minimum.at(bound, edge[:-1][inner] % SWEEP_BINS, np.maximum(t[:-1], t[1:])[inner])
+
+    # largest bound in bins overlapped by widened interval of every wall
+    first = np.floor((low - eps + math.pi) / width).astype(int)
+    n = np.minimum(np.floor((low + span + eps + math.pi) / width).astype(int) - first + 1, SWEEP_BINS)
+    bins = (np.repeat(first - np.cumsum(n) + n, n) + np.arange(n.sum())) % SWEEP_BINS
+    farthest = np.maximum.reduceat(bound[bins], np.cumsum(n) - n)
+    return distance - FLOAT_COMP > farthest + FLOAT_COMP
+
+
+def join_rays(rays1: np.ndarray,
+              rays2: np.ndarray,
+              hit_ray: np.ndarray,
+              hit_wall: np.ndarray,
+              n_rays: int) -> np.ndarray:
+    """
+    Returns all pairs (wall hit by rays1[k], wall hit by rays2[k]).
+    """
+    order = np.argsort(hit_ray, kind="stable")
+    hit_wall = hit_wall[order]
+    counts = np.bincount(hit_ray, minlength=n_rays)
+    offsets = np.cumsum(counts) - counts
+    c1, c2 = counts[rays1], counts[rays2]
+    size = c1 * c2
+    k = np.repeat(np.arange(len(rays1)), size)
+    local = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+    return np.stack((hit_wall[offsets[rays1[k]] + local // c2[k]], hit_wall[offsets[rays2[k]] + local % c2[k]]),
+                    axis=1)
+
+
+def wrap_angle(angle: np.ndarray) -> np.ndarray:
+    """
+    Returns angles moved to [-pi, pi) range.
+    """
+    return (angle + math.pi) % (2*math.pi) - math.pi
+
+
+def angular_interval(angle1: np.ndarray | float,
+                     angle2: np.ndarray | float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns start and length of shorter angular interval between two angles.
+    """
+    span = (np.asarray(angle2) - np.asarray(angle1)) % (2*math.pi)
+    longer = span > math.pi
+    return np.where(longer, angle2, angle1), np.where(longer, 2*math.pi - span, span)
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+# Measures time of importing simulator modules in fresh interpreter and checks which heavy libraries they load.
+# Usage: python Tests/bench_import_time.py [runs]
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RadioSimulator")
+MODULES = ("geometrics", "ray", "simulation", "routines")
+HEAVY_MODULES = ("PySimpleGUI", "tkinter", "matplotlib")
+
+SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(m for m in {heavy} if m in sys.modules))
+"""
+
+
+def measure(module: str, runs: int) -> tuple[float, str]:
+    best = float("inf")
+    loaded = ""
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", SNIPPET.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=SOURCE_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            return float("nan"), result.stderr.strip().splitlines()[-1]
+        elapsed, loaded = result.stdout.split(" ", 1)
+        best = min(best, float(elapsed))
+    return best, loaded.strip()
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for module in MODULES:
+        elapsed, loaded = measure(module, runs)
+        print(f"{module:12s} {elapsed*1000:8.1f} ms   heavy modules: {loaded or '-'}")
@@ -0,0 +1,42 @@
+import math
+import os
+import sys
+import timeit
+import numpy as np
+
+# Compares adaptive ray tubes with uniform ray fan giving the same footprint resolution.
+# Usage: python Tests/bench_ray_tubes.py [scene file]
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RadioSimulator"))
+
+from scene import load_scene_file  # noqa: E402
+from ray import launch_tubes, propagate_fan  # noqa: E402
+
+RESOLUTION = 1
+ORDERS = (1, 2, 3, 4)
+
+
+def path_lengths(points: np.ndarray) -> np.ndarray:
+    return np.nansum(np.sqrt((np.diff(points, axis=1)**2).sum(axis=2)), axis=1)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                                              "RadioSimulator", "scena.json")
+    scene = load_scene_file(path)
+    transmitter = scene.transmitters[0]
+    walls = list(scene.walls)
+
+    for ap in ORDERS:
+        tubes = launch_tubes(transmitter, ap, walls, RESOLUTION)
+        tubes_time = timeit.timeit(lambda: launch_tubes(transmitter, ap, walls, RESOLUTION), number=1)
+        footprint = (2*tubes.half_widths*path_lengths(tubes.fan.points)).max()
+
+        # uniform fan needs width of the longest path in all directions
+        n_uniform = math.ceil(2*math.pi*path_lengths(tubes.fan.points).max() / RESOLUTION)
+        angles = np.arange(n_uniform) * 2*math.pi/n_uniform
+        vecs = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+        uniform_time = timeit.timeit(lambda: propagate_fan(transmitter, vecs, ap, walls), number=1)
+
+        print(f"ap {ap}  tubes {len(tubes.angles):6d} (max footprint {footprint:.3f}) {tubes_time*1e3:7.1f} ms  "
+              f"uniform fan {n_uniform:6d} {uniform_time*1e3:7.1f} ms")
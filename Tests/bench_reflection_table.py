@@ -0,0 +1,52 @@
+import math
+import os
+import sys
+import timeit
+import numpy as np
+
+# Compares reflection coefficients from material tables with exact Fresnel formula - accuracy and speed.
+# Usage: python Tests/bench_reflection_table.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RadioSimulator"))
+
+from props import Wall, Material, fresnel_coefficient, reflection_table  # noqa: E402
+from materials import materials_list  # noqa: E402
+from globals import USE_TM  # noqa: E402
+
+SAMPLES = 100000
+
+
+def exact_coefficient(wall: Wall, vec: tuple[float, float]) -> float:
+    # formula used by Wall.reflection_coefficient before tables were introduced
+    cos_theta = abs(vec[0]*wall.normal[0] + vec[1]*wall.normal[1]) / math.sqrt(vec[0]**2 + vec[1]**2)
+    theta = math.acos(min(cos_theta, 1))
+    eta = wall.material.eta
+    if USE_TM:
+        return (eta * math.cos(theta) - math.sqrt(eta - math.sin(theta)**2)) \
+            / (eta * math.cos(theta) + math.sqrt(eta - math.sin(theta)**2))
+    return (math.cos(theta) - math.sqrt(eta - math.sin(theta)**2)) \
+        / (math.cos(theta) + math.sqrt(eta - math.sin(theta)**2))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    angles = rng.uniform(0, 2*math.pi, SAMPLES)
+    vecs = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+    vec_list = [tuple(v) for v in vecs]
+
+    for material in materials_list:
+        # force calculation from permittivity even for materials with custom coefficient
+        material = Material(material.name, -1, False, material.eta)
+        wall = Wall((0, 0), (10, 3), None, material)
+        table = reflection_table(material)
+
+        cos_theta = np.abs(vecs @ np.array(wall.normal))
+        error = np.abs(wall.reflection_coefficient_array(vecs) - fresnel_coefficient(material.eta, cos_theta)).max()
+
+        exact_time = timeit.timeit(lambda: [exact_coefficient(wall, v) for v in vec_list], number=1)
+        table_time = timeit.timeit(lambda: [wall.reflection_coefficient(v) for v in vec_list], number=1)
+        array_time = timeit.timeit(lambda: wall.reflection_coefficient_array(vecs), number=1)
+
+        print(f"{material.name:14s} table size {len(table.values):6d}  max error {error:.2e} "
+              f"(bound {table.max_error:.2e})  exact {exact_time/SAMPLES*1e6:6.3f} us  "
+              f"table {table_time/SAMPLES*1e6:6.3f} us  vectorized {array_time/SAMPLES*1e9:6.1f} ns")
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+# Compares loading time and peak memory of large generated scene from json and binary (.rscene) file.
+# Usage: python Tests/bench_scene_load.py [number of walls]
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RadioSimulator"))
+
+from scene import load_scene_file, convert_scene_file  # noqa: E402
+from materials import materials_list  # noqa: E402
+
+
+def generate_scene(path: str, count: int):
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(0, 500, (count, 2))
+    ends = starts + rng.uniform(1, 20, (count, 2))
+    content = {
+        "Scale": 1,
+        "Materials": materials_list,
+        "Walls": [{"points": [*s, *e], "width": 1, "material": materials_list[i % len(materials_list)].name}
+                  for i, (s, e) in enumerate(zip(starts.tolist(), ends.tolist()))],
+        "Transmitters": [{"point": [250, 150], "power": 1, "freq": 1e9}],
+        "Receivers": []
+    }
+    with open(path, "w") as file:
+        json.dump(content, file)
+
+
+def measure(path: str) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    scene = load_scene_file(path)
+    scene.walls.packed.sum()  # touch all coordinates
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "scene.json")
+        binary_path = os.path.join(directory, "scene.rscene")
+        generate_scene(json_path, count)
+        convert_scene_file(json_path, binary_path)
+        for path in (json_path, binary_path):
+            elapsed, peak = measure(path)
+            print(f"{os.path.basename(path):14s} {os.path.getsize(path)/1e6:8.1f} MB  load {elapsed:6.3f} s  "
+                  f"peak memory {peak/1e6:8.1f} MB")